@@ -0,0 +1,205 @@
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+
+
+# Бэкенды инференса: экспортированные модели кэшируются рядом с исходными весами (models/)
+INFERENCE_BACKENDS = ('torch', 'onnx', 'onnx-int8', 'openvino', 'openvino-int8')
+
+
+def artifact_path(weights, backend):
+    """Путь к экспортированной модели для бэкенда"""
+    stem = os.path.splitext(weights)[0]
+    return {
+        'torch': weights,
+        'onnx': f'{stem}.onnx',
+        'onnx-int8': f'{stem}.int8.onnx',
+        'openvino': f'{stem}_openvino_model',
+        'openvino-int8': f'{stem}_int8_openvino_model',
+    }[backend]
+
+
+def _is_fresh(path, weights):
+    """Экспорт существует и не старше исходных весов"""
+    if not os.path.exists(path):
+        return False
+    return not os.path.exists(weights) or os.path.getmtime(path) >= os.path.getmtime(weights)
+
+
+@contextmanager
+def _export_lock(path):
+    """Эксклюзивная блокировка экспорта между процессами (без fcntl - только в одном процессе)"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _publish(source, path):
+    """Атомарная замена экспорта: по пути path лежит либо старая, либо полностью записанная модель"""
+    if os.path.isdir(path):
+        # Каталог (OpenVINO) нельзя заменить поверх существующего: старый сначала убирается в сторону
+        stale = tempfile.mkdtemp(dir=os.path.dirname(path) or '.', prefix='.stale-')
+        os.replace(path, os.path.join(stale, 'model'))
+        os.replace(source, path)
+        shutil.rmtree(stale, ignore_errors=True)
+    else:
+        os.replace(source, path)
+
+
+def export_weights(weights, backend, imgsz=640, calibration_data=None):
+    """
+    Экспорт весов YOLO в формат бэкенда (ONNX, ONNX int8, OpenVINO, OpenVINO int8).
+    Готовый экспорт переиспользуется; возвращает путь к модели.
+    Воркеры gunicorn загружают модели одновременно: экспортирует один процесс под
+    файловой блокировкой, остальные ждут его. Экспорт пишется во временный каталог
+    и подменяется атомарно, поэтому недописанная модель не видна как готовая
+    """
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+
+    path = artifact_path(weights, backend)
+    if backend == 'torch' or _is_fresh(path, weights):
+        return path
+
+    with _export_lock(path):
+        # Пока ждали блокировку, экспорт мог выполнить другой воркер
+        if _is_fresh(path, weights):
+            return path
+
+        print(f"Экспорт {weights} для бэкенда {backend}...")
+        workdir = tempfile.mkdtemp(dir=os.path.dirname(path) or '.', prefix='.export-')
+        try:
+            exported = os.path.join(workdir, os.path.basename(path))
+            if backend == 'onnx-int8':
+                # Динамическая int8-квантизация весов поверх обычного ONNX-экспорта
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+
+                quantize_dynamic(export_weights(weights, 'onnx', imgsz), exported, weight_type=QuantType.QUInt8)
+            else:
+                from ultralytics import YOLO
+
+                # ultralytics сохраняет экспорт рядом с весами - экспортируем копию во временном каталоге
+                source = weights
+                if os.path.exists(weights):
+                    source = os.path.join(workdir, os.path.basename(weights))
+                    shutil.copy2(weights, source)
+                model = YOLO(source)
+                if backend == 'onnx':
+                    result = model.export(format='onnx', imgsz=imgsz, dynamic=True)
+                else:
+                    result = model.export(format='openvino', imgsz=imgsz, dynamic=True,
+                                          int8=backend == 'openvino-int8', data=calibration_data)
+                if os.path.abspath(result) != os.path.abspath(exported):
+                    shutil.move(result, exported)
+            _publish(exported, path)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return path
+
+
+def load_model(weights, backend='torch'):
+    """Загрузка модели для бэкенда (с экспортом при первом использовании)"""
+    # ultralytics тянет torch: импорт только при загрузке модели, а не при импорте сервера
+    from ultralytics import YOLO
+
+    return YOLO(export_weights(weights, backend), task='detect')
+
+
+def _match_rate(reference, candidate, iou_threshold=0.5):
+    """Доля эталонных боксов, найденных бэкендом (IoU >= порога), и средняя разница уверенности"""
+    from occupancy import iou_matrix
+
+    if len(reference) == 0:
+        return (1.0 if len(candidate) == 0 else 0.0), 0.0
+    if len(candidate) == 0:
+        return 0.0, 1.0
+
+    iou = iou_matrix(reference.xyxy, candidate.xyxy)
+    best = iou.argmax(axis=1)
+    matched = iou[np.arange(len(reference)), best] >= iou_threshold
+    confidence_diff = np.abs(reference.confidence[matched] - candidate.confidence[best[matched]])
+    return float(matched.mean()), float(confidence_diff.mean()) if matched.any() else 1.0
+
+
+def parity_check(backend, image_paths, roles=None):
+    """
+    Сравнение детекций бэкенда с эталонным torch-бэкендом на наборе изображений.
+    Возвращает по каждой роли среднюю долю совпавших боксов и разницу уверенности
+    """
+    import cv2
+    from detection import DETECTOR_ROLES, DetectorRegistry
+
+    roles = roles or DETECTOR_ROLES
+    reference = DetectorRegistry(roles, backend='torch')
+    candidate = DetectorRegistry(roles, backend=backend)
+
+    report = {name: {'match_rate': [], 'confidence_diff': []} for name in roles}
+    for path in image_paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        expected = reference.detect(image_rgb)
+        actual = candidate.detect(image_rgb)
+        for name in roles:
+            match_rate, confidence_diff = _match_rate(expected[name], actual[name])
+            report[name]['match_rate'].append(match_rate)
+            report[name]['confidence_diff'].append(confidence_diff)
+
+    return {
+        name: {
+            'images': len(values['match_rate']),
+            'match_rate': float(np.mean(values['match_rate'])) if values['match_rate'] else 0.0,
+            'confidence_diff': float(np.mean(values['confidence_diff'])) if values['confidence_diff'] else 0.0,
+        }
+        for name, values in report.items()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Экспорт моделей и проверка точности бэкендов инференса')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='экспорт весов в формат бэкенда')
+    export_parser.add_argument('--backend', choices=INFERENCE_BACKENDS[1:], required=True)
+    export_parser.add_argument('--weights', default='models/yolov8n.pt')
+    export_parser.add_argument('--imgsz', type=int, default=640)
+    export_parser.add_argument('--data', help='датасет для калибровки OpenVINO int8')
+
+    parity_parser = subparsers.add_parser('parity', help='сравнение детекций бэкенда с torch')
+    parity_parser.add_argument('--backend', choices=INFERENCE_BACKENDS[1:], required=True)
+    parity_parser.add_argument('--images', default='imgs_for_demonstration/*')
+    parity_parser.add_argument('--min-match-rate', type=float, default=0.95)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        print(export_weights(args.weights, args.backend, args.imgsz, args.data))
+        return 0
+
+    report = parity_check(args.backend, sorted(glob.glob(args.images)))
+    failed = False
+    for name, values in report.items():
+        ok = values['match_rate'] >= args.min_match_rate
+        failed |= not ok
+        print(f"{name}: совпадение {values['match_rate'] * 100:.1f}%, "
+              f"разница уверенности {values['confidence_diff']:.4f} ({'OK' if ok else 'FAIL'})")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
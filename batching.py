@@ -0,0 +1,152 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+class BatchScheduler:
+    """
+    Фоновый планировщик инференса с динамическим формированием батчей.
+    Запросы кладут кадры в очередь, рабочий поток собирает их в батч,
+    который закрывается при достижении max_batch_size кадров или по
+    истечении max_wait_ms с момента прихода первого кадра, и выполняет
+    один батчевый вызов detect_batch на каждый файл весов: кадры с разными
+    наборами ролей проходят через модель вместе с объединением запрошенных
+    ролей, лишние роли затем отбрасываются. role_weights - {роль: файл весов}
+    (без него все роли считаются общими для одной модели).
+    on_batch(размер, секунды) вызывается после каждого успешного батча (для метрик)
+    """
+
+    def __init__(self, detect_batch, max_batch_size=8, max_wait_ms=5.0, on_batch=None, role_weights=None):
+        self.detect_batch = detect_batch
+        self.on_batch = on_batch
+        self.role_weights = dict(role_weights or {})
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._frames = 0
+        self._last_batch_ms = None
+
+    def start(self):
+        """Запуск рабочего потока (повторный вызов ничего не делает)"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, image_rgb, role_names=None):
+        """
+        Постановка кадра в очередь; возвращает Future с результатом detect_batch для этого кадра.
+        role_names - какие роли детектировать (по умолчанию - все)
+        """
+        self.start()
+        future = Future()
+        self._queue.put((image_rgb, tuple(role_names) if role_names else None, future))
+        return future
+
+    def detect(self, image_rgb, role_names=None, timeout=None):
+        """Синхронный вызов: ждём результат своего кадра"""
+        return self.submit(image_rgb, role_names).result(timeout=timeout)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def last_batch_ms(self):
+        return self._last_batch_ms
+
+    def stats(self):
+        """Статистика планировщика: глубина очереди и гистограмма размеров батчей"""
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                'queue_depth': self.queue_depth,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'batches': batches,
+                'frames': self._frames,
+                'avg_batch_size': self._frames / batches if batches else 0.0,
+                'batch_size_histogram': {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                'last_batch_ms': self._last_batch_ms,
+            }
+
+    def _collect(self):
+        """Сбор батча: блокируемся на первом кадре, затем добираем до лимита по размеру или времени"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Пропускаем кадры, чьи запросы уже отменены
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+
+            detections = [{} for _ in batch]
+            errors = [None] * len(batch)
+            for role_names, indices in self._plan(batch).items():
+                self._run_batch(batch, role_names, indices, detections, errors)
+
+            for (_, role_names, future), result, error in zip(batch, detections, errors):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    # Роли, которые кадр не запрашивал, попали в результат из-за соседей по батчу
+                    future.set_result(result if role_names is None else
+                                      {name: result[name] for name in role_names if name in result})
+
+    def _plan(self, batch):
+        """
+        Вызовы detect_batch для батча: {роли вызова (None - все): индексы кадров}.
+        Один вызов на файл весов с объединением ролей, запрошенных его кадрами
+        """
+        if not self.role_weights:
+            requested = [role_names for _, role_names, _ in batch]
+            roles = None if None in requested else tuple(sorted({name for names in requested for name in names}))
+            return {roles: list(range(len(batch)))}
+
+        groups = {}
+        for index, (_, role_names, _) in enumerate(batch):
+            for name in role_names or self.role_weights:
+                roles, indices = groups.setdefault(self.role_weights.get(name, name), (set(), []))
+                roles.add(name)
+                if not indices or indices[-1] != index:
+                    indices.append(index)
+        return {tuple(sorted(roles)): indices for roles, indices in groups.values()}
+
+    def _run_batch(self, batch, role_names, indices, detections, errors):
+        started = time.perf_counter()
+        try:
+            results = self.detect_batch([batch[index][0] for index in indices], role_names)
+        except Exception as e:
+            for index in indices:
+                errors[index] = e
+            return
+
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._batch_sizes[len(indices)] += 1
+            self._frames += len(indices)
+            self._last_batch_ms = elapsed * 1000
+        if self.on_batch is not None:
+            self.on_batch(len(indices), elapsed)
+
+        for index, result in zip(indices, results):
+            detections[index].update(result)
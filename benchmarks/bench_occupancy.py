@@ -0,0 +1,66 @@
+"""
+Сравнение плотного расчёта занятости и расчёта через пространственный индекс.
+
+    python benchmarks/bench_occupancy.py --sizes 10x30,100x400,1000x3000
+
+Для каждого размера сцены (столы x люди) на случайных боксах проверяется,
+что оба способа дают одинаковый результат, и выводится время каждого и
+способ, который выбрал бы 'auto' (порог occupancy.DENSE_MAX_PAIRS)
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from occupancy import DENSE_MAX_PAIRS, occupancy_arrays  # noqa: E402
+
+DEFAULT_SIZES = '10x30,40x200,100x400,300x1000,1000x3000'
+
+
+def random_boxes(rng, count, width, height, size):
+    xy = rng.random((count, 2)) * [width, height]
+    return np.hstack([xy, xy + rng.uniform(*size, (count, 2))])
+
+
+def measure(function, min_seconds=0.3):
+    """Среднее время вызова (мс) за не меньше чем min_seconds"""
+    started, runs = time.perf_counter(), 0
+    while time.perf_counter() - started < min_seconds:
+        function()
+        runs += 1
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Плотный расчёт занятости против пространственного индекса')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='сцены "столы x люди" через запятую')
+    parser.add_argument('--hall', default='8000x4000', help='размер зала в пикселях')
+    args = parser.parse_args(argv)
+
+    width, height = (int(v) for v in args.hall.split('x'))
+    rng = np.random.default_rng(0)
+    failed = False
+    for size in args.sizes.split(','):
+        tables, people = (int(v) for v in size.split('x'))
+        table_boxes = random_boxes(rng, tables, width, height, (60, 200))
+        person_boxes = random_boxes(rng, people, width, height, (40, 160))
+
+        dense = occupancy_arrays(table_boxes, person_boxes, 'dense')
+        indexed = occupancy_arrays(table_boxes, person_boxes, 'indexed')
+        same = all(np.array_equal(a, b) for a, b in zip(dense, indexed))
+        failed |= not same
+
+        dense_ms = measure(lambda: occupancy_arrays(table_boxes, person_boxes, 'dense'))
+        indexed_ms = measure(lambda: occupancy_arrays(table_boxes, person_boxes, 'indexed'))
+        auto = 'dense' if tables * people <= DENSE_MAX_PAIRS else 'indexed'
+        print(f"{size:>10}: dense {dense_ms:8.3f} мс  indexed {indexed_ms:8.3f} мс  auto -> {auto:7}  "
+              f"{'совпадает' if same else 'РАСХОЖДЕНИЕ'}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+Бенчмарк конвейера /api/analyze по этапам и под нагрузкой.
+
+    python benchmarks/bench_pipeline.py --output bench.json
+    python benchmarks/bench_pipeline.py --baseline bench.json --max-regression 0.2
+
+Этапы замеряются по отдельности на кадрах из imgs_for_demonstration и на
+синтетических "людных" кадрах (мозаики из тех же изображений): декодирование,
+конвертация цвета, проход модели для каждой роли, сопоставление столов и людей,
+запись в историю и сериализация JSON. Затем весь запрос прогоняется через
+Flask test client (или через запущенный сервер, --url) с разным числом
+параллельных клиентов. Результаты сохраняются в JSON; при сравнении с базовым
+прогоном рост p95 любого этапа больше --max-regression завершает запуск с ошибкой.
+История и статистика пишутся во временную папку.
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CONCURRENCY_LEVELS = (1, 2, 4, 8)
+PERCENTILES = (50, 95, 99)
+
+
+def summarize(timings_ms):
+    """p50/p95/p99, среднее и число замеров в миллисекундах"""
+    values = np.asarray(timings_ms, dtype=np.float64)
+    result = {f'p{p}': float(np.percentile(values, p)) for p in PERCENTILES}
+    result.update({'mean': float(values.mean()), 'count': int(len(values))})
+    return result
+
+
+def timed(timings, name, function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    timings.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+    return result
+
+
+def load_frames(pattern, crowded_grid):
+    """Закодированные кадры: исходные изображения и мозаики grid x grid из них"""
+    images = [image for image in (cv2.imread(path) for path in sorted(glob.glob(pattern))) if image is not None]
+    frames = [(f'demo_{i}', cv2.imencode('.jpg', image)[1].tobytes()) for i, image in enumerate(images)]
+
+    if crowded_grid > 1 and images:
+        height, width = 540, 960
+        tiles = [cv2.resize(image, (width // crowded_grid, height // crowded_grid)) for image in images]
+        for i in range(len(images)):
+            rows = [np.hstack([tiles[(i + r * crowded_grid + c) % len(tiles)] for c in range(crowded_grid)])
+                    for r in range(crowded_grid)]
+            frames.append((f'crowded_{i}', cv2.imencode('.jpg', np.vstack(rows))[1].tobytes()))
+    return frames
+
+
+def synthetic_boxes(rng, count, width=1920, height=1080, size=(40, 200)):
+    xy = rng.random((count, 2)) * [width, height]
+    wh = rng.uniform(*size, (count, 2))
+    return np.hstack([xy, xy + wh])
+
+
+def bench_stages(server, frames, runs):
+    """Замер каждого этапа конвейера отдельно (без планировщика батчей)"""
+    from ingest import decode_image, rgb_frame
+    from occupancy import compute_occupancy
+    from preprocess import downscale
+
+    timings = {}
+    store = server.get_history_store()
+    for _ in range(runs):
+        for _, data in frames:
+            image = timed(timings, 'decode', decode_image, data, server.app.config['MAX_IMAGE_PIXELS'])
+            small, _ = timed(timings, 'downscale', downscale, image, server.app.config['INFERENCE_MAX_SIDE'])
+
+            started = time.perf_counter()
+            with rgb_frame(small) as image_rgb:
+                timings.setdefault('color_conversion', []).append((time.perf_counter() - started) * 1000)
+                detections = {}
+                for role in server.detectors.roles:
+                    detections.update(timed(timings, f'predict_{role}', server.detectors.detect_batch,
+                                            [image_rgb], [role])[0])
+
+            tables = timed(timings, 'occupancy', compute_occupancy, detections['table'].xyxy,
+                           detections['table'].confidence, detections['person'].xyxy)
+            results = {
+                'timestamp': datetime.now().isoformat(),
+                'tables_found': len(tables),
+                'people_found': len(detections['person']),
+                'tables': tables,
+                'people': [{'id': i + 1, 'bbox': box, 'confidence': 0.5}
+                           for i, box in enumerate(detections['person'].xyxy.tolist())],
+                'occupancy_rate': 0.0,
+            }
+            timed(timings, 'history_write', store.append, results)
+            with server.app.app_context():
+                timed(timings, 'json_serialization', server.jsonify, results)
+
+    # Сопоставление на людной сцене, где случайные веса ничего бы не нашли
+    rng = np.random.default_rng(0)
+    for _ in range(runs * len(frames)):
+        table_boxes, person_boxes = synthetic_boxes(rng, 40), synthetic_boxes(rng, 200)
+        timed(timings, 'occupancy_crowded', compute_occupancy, table_boxes, np.ones(len(table_boxes)), person_boxes)
+
+    return {name: summarize(values) for name, values in timings.items()}
+
+
+def make_client(server, url):
+    """Функция отправки одного кадра: через test client или HTTP к запущенному серверу"""
+    if url is None:
+        local = threading.local()
+
+        def send(name, data):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = server.app.test_client()
+            response = client.post('/api/analyze', data={'file': (io.BytesIO(data), f'{name}.jpg')},
+                                   headers={'X-Cache-Bypass': '1'}, content_type='multipart/form-data')
+            return response.status_code
+        return send
+
+    def send(name, data):
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}.jpg"\r\n'
+                f'Content-Type: image/jpeg\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+        request = urllib.request.Request(url.rstrip('/') + '/api/analyze', data=body, headers={
+            'Content-Type': f'multipart/form-data; boundary={boundary}', 'X-Cache-Bypass': '1'})
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return response.status
+    return send
+
+
+def bench_concurrency(send, frames, levels, requests_per_level):
+    """Пропускная способность и задержка запроса целиком при разном числе клиентов"""
+    report = {}
+    for level in levels:
+        jobs = [frames[i % len(frames)] for i in range(max(requests_per_level, level))]
+        timings, errors = [], 0
+
+        def run(job):
+            started = time.perf_counter()
+            status = send(*job)
+            return status, (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as executor:
+            for status, elapsed in executor.map(run, jobs):
+                timings.append(elapsed)
+                errors += status != 200
+        wall = time.perf_counter() - started
+
+        report[str(level)] = dict(summarize(timings), throughput_rps=len(jobs) / wall, errors=errors)
+    return report
+
+
+def compare(results, baseline, max_regression, min_delta_ms=1.0):
+    """
+    Этапы и уровни нагрузки, у которых p95 вырос больше чем на max_regression.
+    Рост меньше min_delta_ms не считается: у быстрых этапов это шум измерения
+    """
+    regressions = []
+    pairs = [(f'stage {name}', values, baseline.get('stages', {}).get(name))
+             for name, values in results['stages'].items()]
+    pairs += [(f'concurrency {level}', values, baseline.get('concurrency', {}).get(level))
+              for level, values in results['concurrency'].items()]
+    for name, values, reference in pairs:
+        if reference and values['p95'] > reference['p95'] * (1 + max_regression) \
+                and values['p95'] - reference['p95'] > min_delta_ms:
+            regressions.append((name, reference['p95'], values['p95']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк конвейера анализа по этапам и под нагрузкой')
+    parser.add_argument('--images', default=os.path.join(ROOT, 'imgs_for_demonstration', '*'))
+    parser.add_argument('--crowded-grid', type=int, default=3, help='мозаики N x N изображений (1 - без них)')
+    parser.add_argument('--runs', type=int, default=3, help='проходов по кадрам при замере этапов')
+    parser.add_argument('--concurrency', default=','.join(map(str, CONCURRENCY_LEVELS)))
+    parser.add_argument('--requests', type=int, default=32, help='запросов на каждый уровень нагрузки')
+    parser.add_argument('--url', help='адрес запущенного сервера вместо Flask test client')
+    parser.add_argument('--weights', help='другой файл весов для всех ролей')
+    parser.add_argument('--output', help='куда сохранить результаты (JSON)')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='допустимый рост p95 (0.2 = 20%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='меньший рост p95 не считается регрессией')
+    args = parser.parse_args(argv)
+
+    from detection import DETECTOR_ROLES
+    if args.weights:
+        for role in DETECTOR_ROLES.values():
+            role['weights'] = args.weights
+
+    workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    import server
+    server.app.config.update({
+        'HISTORY_PATH': os.path.join(workdir, 'history.db'),
+        'STATS_PATH': os.path.join(workdir, 'stats.db'),
+    })
+
+    frames = load_frames(args.images, args.crowded_grid)
+    if not frames:
+        print("Нет изображений")
+        return 1
+    if not server.warmup_models():
+        return 1
+
+    levels = [int(level) for level in args.concurrency.split(',') if level]
+    results = {
+        'created': datetime.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'inference_backend': server.detectors.backend,
+            'frames': len(frames),
+        },
+        'stages': bench_stages(server, frames, args.runs),
+        'concurrency': bench_concurrency(make_client(server, args.url), frames, levels, args.requests),
+    }
+
+    for name, values in results['stages'].items():
+        print(f"{name:>20}: p50 {values['p50']:8.2f} мс  p95 {values['p95']:8.2f} мс  p99 {values['p99']:8.2f} мс")
+    for level, values in results['concurrency'].items():
+        print(f"{'клиентов ' + level:>20}: p50 {values['p50']:8.1f} мс  p95 {values['p95']:8.1f} мс  "
+              f"{values['throughput_rps']:6.2f} запр/с  ошибок {values['errors']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    failed = any(values['errors'] for values in results['concurrency'].values())
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        for name, before, after in compare(results, baseline, args.max_regression, args.min_delta_ms):
+            print(f"Регрессия: {name}: p95 {before:.2f} -> {after:.2f} мс")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Замер времени генерации PDF-отчётов.
+
+    python benchmarks/bench_reports.py --runs 50 --max-p95-ms 50
+
+Первый отчёт в процессе включает регистрацию шрифтов и сборку стилей,
+поэтому выводится отдельно от установившихся значений
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import report_rendering  # noqa: E402
+
+
+def sample_report_data(tables=20, people=30):
+    """Данные отчёта в формате результата /api/analyze"""
+    rng = np.random.default_rng(0)
+    return {
+        'period': 'current',
+        'data': {
+            'tables_found': tables,
+            'people_found': people,
+            'occupancy_rate': 0.5,
+            'total_analyses': 1,
+            'avg_tables_per_analysis': tables,
+            'avg_people_per_analysis': people,
+            'tables': [{'id': i + 1, 'status': 'occupied' if i % 2 else 'free', 'person_count': i % 4,
+                        'confidence': float(rng.random()), 'bbox': [0, 0, 100, 100]} for i in range(tables)],
+            'people': [{'id': i + 1, 'confidence': float(rng.random()),
+                        'bbox': [float(v) for v in rng.random(4) * 640]} for i in range(people)],
+        },
+    }
+
+
+def measure(render, data, runs, folder):
+    path = os.path.join(folder, 'report.pdf')
+    started = time.perf_counter()
+    render(data, path)
+    first_ms = (time.perf_counter() - started) * 1000
+
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        render(data, path)
+        timings.append((time.perf_counter() - started) * 1000)
+    return first_ms, np.percentile(timings, [50, 95, 99])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Время генерации PDF-отчётов')
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--tables', type=int, default=20)
+    parser.add_argument('--people', type=int, default=30)
+    parser.add_argument('--max-p95-ms', type=float, help='завершиться с ошибкой, если p95 больше порога')
+    args = parser.parse_args(argv)
+
+    data = sample_report_data(args.tables, args.people)
+    failed = False
+    with tempfile.TemporaryDirectory() as folder:
+        for name, render in (('pdf', report_rendering.render_pdf_report),
+                             ('summary_pdf', report_rendering.render_summary_pdf_report)):
+            first_ms, (p50, p95, p99) = measure(render, data, args.runs, folder)
+            print(f"{name}: первый {first_ms:.1f} мс, p50 {p50:.1f} мс, p95 {p95:.1f} мс, p99 {p99:.1f} мс")
+            failed |= args.max_p95_ms is not None and p95 > args.max_p95_ms
+
+    print(f"Кириллический шрифт: {'да' if report_rendering.register_russian_fonts() else 'нет'}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Задержка и полнота детекции при разных режимах предобработки кадра.
+
+    python benchmarks/bench_resolution.py --images "imgs_for_demonstration/*" --upscale 3840
+
+Режимы: full - кадр целиком в модель (без раннего уменьшения и адаптивного
+размера), downscale - раннее уменьшение до INFERENCE_MAX_SIDE, tiled - плюс
+SAHI-нарезка. Полнота считается относительно режима tiled как доля его
+боксов, найденных в режиме (IoU >= 0.5)
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = {
+    'full': {'INFERENCE_MAX_SIDE': None, 'INFERENCE_TILING': False, 'adaptive_size': False},
+    'downscale': {'INFERENCE_TILING': False},
+    'tiled': {'INFERENCE_TILING': True},
+}
+
+
+def load_images(pattern, upscale):
+    images = []
+    for path in sorted(glob.glob(pattern)):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        if upscale:
+            # Имитация кадра высокого разрешения
+            scale = upscale / max(image.shape[:2])
+            image = cv2.resize(image, (round(image.shape[1] * scale), round(image.shape[0] * scale)),
+                               interpolation=cv2.INTER_CUBIC)
+        images.append(image)
+    return images
+
+
+def run_mode(server, images, settings, runs):
+    defaults = {key: server.app.config[key] for key in ('INFERENCE_MAX_SIDE', 'INFERENCE_TILING')}
+    adaptive = server.detectors.adaptive_size
+    server.app.config.update({key: value for key, value in settings.items() if key != 'adaptive_size'})
+    server.detectors.adaptive_size = settings.get('adaptive_size', adaptive)
+    try:
+        timings, detections = [], []
+        for image in images:
+            for _ in range(runs):
+                started = time.perf_counter()
+                result = server.detect_frame(image)
+                timings.append((time.perf_counter() - started) * 1000)
+            detections.append(result)
+        return timings, detections
+    finally:
+        server.app.config.update(defaults)
+        server.detectors.adaptive_size = adaptive
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Задержка и полнота для режимов предобработки кадра')
+    parser.add_argument('--images', default=os.path.join(ROOT, 'imgs_for_demonstration', '*'))
+    parser.add_argument('--upscale', type=int, default=3840, help='длинная сторона кадра (0 - как есть)')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--weights', help='другой файл весов для всех ролей')
+    args = parser.parse_args(argv)
+
+    from detection import DETECTOR_ROLES
+    if args.weights:
+        for role in DETECTOR_ROLES.values():
+            role['weights'] = args.weights
+
+    import server
+    from backends import _match_rate
+
+    images = load_images(args.images, args.upscale)
+    if not images:
+        print("Нет изображений")
+        return 1
+    server.warmup_models()
+
+    results = {mode: run_mode(server, images, settings, args.runs) for mode, settings in MODES.items()}
+    reference = results['tiled'][1]
+
+    print(f"Кадров: {len(images)}, размер {images[0].shape[1]}x{images[0].shape[0]}")
+    for mode, (timings, detections) in results.items():
+        p50, p95 = np.percentile(timings, [50, 95])
+        line = f"{mode:>10}: p50 {p50:.0f} мс, p95 {p95:.0f} мс"
+        for role in DETECTOR_ROLES:
+            found = sum(len(frame[role]) for frame in detections)
+            recall = np.mean([_match_rate(expected[role], actual[role])[0]
+                              for expected, actual in zip(reference, detections)])
+            line += f", {role}: {found} (полнота {recall * 100:.0f}%)"
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Замер холодного старта сервера: время `import server`, время до первого ответа
+/health и тяжёлые модули, загруженные при импорте.
+
+    python benchmarks/bench_startup.py --runs 5 --max-import-ms 1500
+
+Каждый замер выполняется в отдельном процессе (кэш импорта не переиспользуется).
+torch, ultralytics, supervision, pandas, openpyxl и reportlab не должны
+загружаться при импорте: они нужны только для инференса и отчётов.
+С --top выводятся самые медленные модули по данным `python -X importtime`
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, которые должны загружаться только по требованию
+LAZY_MODULES = ('torch', 'ultralytics', 'supervision', 'pandas', 'openpyxl', 'reportlab')
+
+# Выполняется в дочернем процессе: импорт сервера и первый /health через test client
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+response = server.app.test_client().get('/health')
+answered = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'health_ms': (answered - imported) * 1000,
+    'status': response.status_code,
+    'loaded': [name for name in LAZY_MODULES if name in sys.modules],
+}))
+"""
+
+
+def probe():
+    """Один холодный старт в новом процессе"""
+    code = f'LAZY_MODULES = {LAZY_MODULES!r}\n' + PROBE
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(top):
+    """Модули с наибольшим собственным временем импорта (мс)"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import server'], cwd=ROOT,
+                            check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)', line)
+        if match:
+            rows.append((int(match.group(1)) / 1000, int(match.group(2)) / 1000, match.group(4)))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк холодного старта сервера')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='сколько самых медленных модулей показать (0 - нет)')
+    parser.add_argument('--max-import-ms', type=float, help='ошибка, если медиана импорта больше')
+    args = parser.parse_args(argv)
+
+    results = [probe() for _ in range(args.runs)]
+    import_ms = np.array([result['import_ms'] for result in results])
+    health_ms = np.array([result['health_ms'] for result in results])
+    print(f"import server: медиана {np.median(import_ms):.0f} мс, максимум {import_ms.max():.0f} мс")
+    print(f"первый /health: медиана {np.median(health_ms):.1f} мс, максимум {health_ms.max():.1f} мс")
+
+    failed = False
+    loaded = sorted({name for result in results for name in result['loaded']})
+    if loaded:
+        print(f"Загружены при импорте: {', '.join(loaded)}")
+        failed = True
+    if any(result['status'] != 200 for result in results):
+        print("/health ответил ошибкой")
+        failed = True
+    if args.max_import_ms is not None and np.median(import_ms) > args.max_import_ms:
+        print(f"Импорт дольше {args.max_import_ms:.0f} мс")
+        failed = True
+
+    if args.top:
+        print("Самые медленные модули (собственное / накопленное время, мс):")
+        for own, cumulative, name in slowest_imports(args.top):
+            print(f"{own:10.1f} {cumulative:10.1f}  {name}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
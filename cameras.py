@@ -0,0 +1,378 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from ingest import decode_image
+from jsonstore import JSONFileStore
+
+
+# Пределы частоты опроса камеры (кадров в секунду)
+MIN_FPS = 0.01
+MAX_FPS = 30.0
+
+
+def normalize_camera(config, resolve_source=None):
+    """
+    Проверка настроек камеры: {'source': путь к снимку или http(s)://..., 'fps': 1.0,
+    'priority': 0, 'enabled': true}. resolve_source(source) проверяет источник
+    (ValueError для недопустимого). Возвращает новый словарь; при ошибке - ValueError
+    """
+    if not isinstance(config, dict):
+        raise ValueError("Camera config must be an object")
+    source = config.get('source')
+    if not isinstance(source, str) or not source:
+        raise ValueError("Camera source is required")
+    if resolve_source is not None:
+        resolve_source(source)
+    try:
+        fps = float(config.get('fps', 1.0))
+        priority = int(config.get('priority', 0))
+    except (TypeError, ValueError):
+        raise ValueError("fps must be a number and priority an integer")
+    if not MIN_FPS <= fps <= MAX_FPS:
+        raise ValueError(f"fps must be between {MIN_FPS} and {MAX_FPS}")
+    return {'source': source, 'fps': fps, 'priority': priority, 'enabled': bool(config.get('enabled', True))}
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Перенаправления не выполняются: адрес камеры проверен, а адрес перенаправления - нет"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_snapshot_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def fetch_snapshot(source, max_bytes, max_pixels, timeout=10):
+    """
+    Снимок камеры: HTTP(S)-адрес, отдающий JPEG/PNG, или локальный файл изображения.
+    Источник должен быть уже проверен (ingest.resolve_source); на перенаправление - ошибка
+    """
+    if source.startswith(('http://', 'https://')):
+        with _snapshot_opener.open(source, timeout=timeout) as response:
+            data = response.read(max_bytes + 1)
+    else:
+        with open(source, 'rb') as f:
+            data = f.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"Snapshot is larger than {max_bytes} bytes")
+    image = decode_image(data, max_pixels)
+    if image is None:
+        raise ValueError("Failed to decode snapshot")
+    return image
+
+
+class CameraStore(JSONFileStore):
+    """
+    Настройки камер серверного опроса в одном JSON-файле (перечитывается при изменении).
+    resolve_source - проверка источника камеры при сохранении
+    """
+
+    def __init__(self, path, resolve_source=None):
+        super().__init__(path)
+        self.resolve_source = resolve_source
+
+    def put(self, camera_id, config):
+        camera = normalize_camera(config, self.resolve_source)
+        return self._set(camera_id, dict(camera, updated=datetime.now().isoformat()))
+
+
+def try_leader_lock(path):
+    """
+    Эксклюзивная блокировка файла: из пула воркеров камеры опрашивает только
+    процесс, который её получил. Возвращает открытый файл блокировки или None
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # Без fcntl (Windows) сервер работает одним процессом
+        return open(path, 'a')
+    f = open(path, 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+class CameraState:
+    """Состояние опроса одной камеры"""
+
+    def __init__(self):
+        self.next_due = 0.0
+        self.retry_at = 0.0  # Пауза после ошибки источника
+        self.last_started = None
+        self.busy = False
+        self.polls = 0
+        self.errors = 0
+        self.failures = 0  # Ошибок подряд
+        self.last_error = None
+        self.last_poll = None
+        self.last_latency_ms = None
+        self.last_result = None
+        self.fps = None  # Фактическая частота (скользящее среднее)
+
+    def stats(self, now):
+        return {
+            'polls': self.polls,
+            'errors': self.errors,
+            'consecutive_failures': self.failures,
+            'last_error': self.last_error,
+            'last_poll': self.last_poll,
+            'last_latency_ms': self.last_latency_ms,
+            'fps': self.fps,
+            'next_poll_in': max(self.next_due - now, 0.0),
+        }
+
+
+class CameraScheduler:
+    """
+    Серверный опрос камер на asyncio в отдельном потоке.
+    Камера опрашивается не чаще своего fps; если свободных слотов меньше, чем
+    камер к опросу, первыми идут камеры с большим priority, затем самые
+    просроченные. Снимок и анализ выполняются в пуле потоков, поэтому кадры
+    разных камер попадают в общие батчи инференса.
+    Когда очередь инференса переполнена (saturated()), интервалы всех камер
+    растут в BACKOFF_FACTOR раз (до MAX_SLOWDOWN) и плавно возвращаются после
+    разгрузки. Камера с ошибкой источника опрашивается с экспоненциальной паузой.
+    analyze(camera_id, image) выполняет анализ и запись в историю и возвращает
+    словарь результата. С lock_path опрос ведёт только один процесс: остальные
+    воркеры периодически пытаются перехватить блокировку. Состояние опроса и
+    последние результаты ведущий процесс сохраняет в state_path (не чаще
+    PUBLISH_INTERVAL), остальные воркеры отдают их оттуда
+    """
+
+    BACKOFF_FACTOR = 1.5
+    RECOVERY_FACTOR = 0.8
+    MAX_SLOWDOWN = 16.0
+    ADAPT_INTERVAL = 0.5  # Как часто проверяется загрузка инференса, секунды
+    ERROR_BACKOFF = (1.0, 60.0)  # Первая и максимальная пауза после ошибки, секунды
+    LEADER_RETRY = 5.0  # Секунды между попытками получить блокировку опроса
+    PUBLISH_INTERVAL = 1.0  # Секунды между сохранениями состояния для других воркеров
+
+    def __init__(self, store, analyze, fetch, saturated=None, max_in_flight=4, tick=0.25, lock_path=None,
+                 state_path=None):
+        self.store = store
+        self.analyze = analyze
+        self.fetch = fetch
+        self.saturated = saturated or (lambda: False)
+        self.max_in_flight = max_in_flight
+        self.tick = tick
+        self.lock_path = lock_path
+        self.state_path = state_path
+
+        self.slowdown = 1.0
+        self.states = {}
+        self._in_flight = 0
+        self._loop = None
+        self._wakeup = None
+        self._stopping = False
+        self._thread = None
+        self._leader = None
+        self._lock = threading.Lock()
+        self._version = 0  # Растёт с каждым завершённым опросом
+        self._published = None
+        self._shared = (None, None)  # (mtime, содержимое) прочитанного state_path
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def polling_here(self):
+        """Камеры опрашивает этот процесс"""
+        return self.running and (self.lock_path is None or self._leader is not None)
+
+    def start(self):
+        with self._lock:
+            if not self.running:
+                self._stopping = False
+                self._thread = threading.Thread(target=lambda: asyncio.run(self._main()),
+                                                name='camera-scheduler', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopping = True
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if self.lock_path is not None:
+            while not self._stopping and self._leader is None:
+                self._leader = try_leader_lock(self.lock_path)
+                if self._leader is None:
+                    await self._wait(self.LEADER_RETRY)
+
+        tasks = set()
+        adapted_at = published_at = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='camera-poll') as executor:
+            while not self._stopping:
+                now = time.monotonic()
+                if now - adapted_at >= self.ADAPT_INTERVAL:
+                    self._adapt()
+                    adapted_at = now
+                if now - published_at >= self.PUBLISH_INTERVAL:
+                    self._publish()
+                    published_at = now
+
+                selected, wake_at = self._due(now)
+                for camera_id, camera in selected:
+                    task = asyncio.create_task(self._poll(executor, camera_id, camera))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                # Спим до ближайшей камеры, но не дольше tick: настройки камер перечитываются
+                await self._wait(min(max(wake_at - time.monotonic(), 0.001), self.tick))
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self._leader is not None:
+            self._leader.close()
+            self._leader = None
+
+    def _due(self, now):
+        """
+        Камеры, которые пора опросить, в пределах свободных слотов, и время
+        следующей проверки. Срок опроса считается от начала предыдущего с
+        текущим замедлением, поэтому после разгрузки частота возвращается сразу
+        """
+        cameras = {camera_id: camera for camera_id, camera in self.store.list().items() if camera.get('enabled', True)}
+        for camera_id in [camera_id for camera_id in self.states if camera_id not in cameras]:
+            if not self.states[camera_id].busy:
+                del self.states[camera_id]
+
+        due, wake_at = [], now + self.tick
+        for camera_id, camera in cameras.items():
+            state = self.states.setdefault(camera_id, CameraState())
+            if state.last_started is not None:
+                state.next_due = max(state.last_started + self.slowdown / camera['fps'], state.retry_at)
+            if state.busy:
+                continue
+            if state.next_due <= now:
+                due.append((-camera['priority'], state.next_due, camera_id))
+            else:
+                wake_at = min(wake_at, state.next_due)
+        due.sort()
+
+        selected = []
+        for _, _, camera_id in due[:max(self.max_in_flight - self._in_flight, 0)]:
+            self.states[camera_id].busy = True
+            self._in_flight += 1
+            selected.append((camera_id, cameras[camera_id]))
+        return selected, wake_at
+
+    async def _poll(self, executor, camera_id, camera):
+        state = self.states[camera_id]
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        previous_start, state.last_started = state.last_started, started
+        try:
+            image = await loop.run_in_executor(executor, self.fetch, camera['source'])
+            result = await loop.run_in_executor(executor, self.analyze, camera_id, image)
+        except Exception as e:
+            state.errors += 1
+            state.failures += 1
+            state.last_error = str(e)
+            first, maximum = self.ERROR_BACKOFF
+            state.retry_at = time.monotonic() + min(first * 2 ** (state.failures - 1), maximum)
+            print(f"Ошибка опроса камеры {camera_id}: {e}")
+        else:
+            state.polls += 1
+            state.failures = 0
+            state.last_result = result
+            state.last_poll = datetime.now().isoformat()
+            state.last_latency_ms = (time.monotonic() - started) * 1000
+            if previous_start is not None:
+                fps = 1 / max(started - previous_start, 1e-6)
+                state.fps = fps if state.fps is None else 0.8 * state.fps + 0.2 * fps
+        finally:
+            state.busy = False
+            self._in_flight -= 1
+            self._version += 1
+            self._wakeup.set()
+
+    def _adapt(self):
+        """Замедление опроса при переполненной очереди инференса и возврат после разгрузки"""
+        if self.saturated():
+            self.slowdown = min(self.slowdown * self.BACKOFF_FACTOR, self.MAX_SLOWDOWN)
+        else:
+            self.slowdown = max(self.slowdown * self.RECOVERY_FACTOR, 1.0)
+
+    def _local_stats(self):
+        now = time.monotonic()
+        return {
+            'running': self.running,
+            'leader': self._leader is not None,
+            'slowdown': self.slowdown,
+            'in_flight': self._in_flight,
+            'cameras': {camera_id: state.stats(now) for camera_id, state in list(self.states.items())},
+        }
+
+    def _publish(self):
+        """Сохранение состояния опроса и последних результатов для остальных воркеров"""
+        if self.state_path is None or self._published == self._version:
+            return
+        self._published = self._version
+        stats = dict(self._local_stats(), updated=time.time())
+        results = {camera_id: state.last_result for camera_id, state in list(self.states.items())
+                   if state.last_result is not None}
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.state_path)), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'stats': stats, 'results': results}, f, default=str)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            print(f"Ошибка сохранения состояния опроса камер: {e}")
+
+    def _shared_state(self):
+        """Состояние, сохранённое ведущим процессом (None, если его нет)"""
+        if self.state_path is None:
+            return None
+        try:
+            mtime = os.path.getmtime(self.state_path)
+            if mtime != self._shared[0]:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    self._shared = (mtime, json.load(f))
+        except (OSError, ValueError):
+            return None
+        return self._shared[1]
+
+    def last_result(self, camera_id):
+        if not self.polling_here:
+            shared = self._shared_state()
+            return shared['results'].get(camera_id) if shared is not None else None
+        state = self.states.get(camera_id)
+        return state.last_result if state is not None else None
+
+    def stats(self):
+        if self.polling_here:
+            return self._local_stats()
+        shared = self._shared_state()
+        if shared is None:
+            return self._local_stats()
+
+        # Снимок ведущего процесса: сроки следующего опроса - с поправкой на его возраст
+        stats = shared['stats']
+        age = max(time.time() - stats['updated'], 0.0)
+        cameras = {camera_id: dict(state, next_poll_in=max(state['next_poll_in'] - age, 0.0))
+                   for camera_id, state in stats['cameras'].items()}
+        return dict(stats, running=self.running, leader=False, cameras=cameras)
@@ -0,0 +1,120 @@
+import threading
+
+from backends import load_model
+from preprocess import inference_size
+
+
+# Классы COCO, которые нас интересуют
+PERSON_CLASS_ID = 0  # person
+TABLE_CLASS_ID = 60  # dining table
+
+# Роли детекторов: файл весов, класс и пороги уверенности/NMS
+DETECTOR_ROLES = {
+    'table': {'weights': 'models/yolov8n.pt', 'class_id': TABLE_CLASS_ID, 'conf': 0.10, 'iou': 0.10},
+    'person': {'weights': 'models/yolov8n.pt', 'class_id': PERSON_CLASS_ID, 'conf': 0.10, 'iou': 0.15},
+}
+
+# Предел детекций на кадр после NMS (как max_det модели по умолчанию) и кандидатов до него
+MAX_DETECTIONS = 300
+MAX_CANDIDATES = 30_000
+
+
+class DetectorRegistry:
+    """
+    Реестр детекторов: каждый файл весов загружается ровно один раз.
+    Роли с общими весами обслуживаются одним проходом модели с фильтром
+    классов, после чего к каждому классу применяются его собственные
+    пороги уверенности и NMS. backend - формат модели ('torch', 'onnx',
+    'onnx-int8', 'openvino', 'openvino-int8'), экспорт выполняется при загрузке.
+    imgsz - размер входа модели; с adaptive_size батч из маленьких кадров
+    обрабатывается в размере самого большого из них, а не в imgsz
+    """
+
+    def __init__(self, roles, backend='torch', imgsz=640, adaptive_size=True):
+        self.roles = roles
+        self.backend = backend
+        self.imgsz = imgsz
+        self.adaptive_size = adaptive_size
+        self._models = {}
+        self._locks = {}
+        self._load_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return all(role['weights'] in self._models for role in self.roles.values())
+
+    def load(self):
+        """Загрузка всех файлов весов (повторный вызов ничего не делает)"""
+        with self._load_lock:
+            for role in self.roles.values():
+                weights = role['weights']
+                if weights not in self._models:
+                    self._models[weights] = load_model(weights, self.backend)
+                    self._locks[weights] = threading.Lock()
+
+    def model(self, weights):
+        if weights not in self._models:
+            self.load()
+        return self._models[weights]
+
+    def _groups(self, role_names):
+        """Группировка ролей по файлу весов"""
+        groups = {}
+        for name in role_names:
+            groups.setdefault(self.roles[name]['weights'], []).append(name)
+        return groups
+
+    def detect(self, image_rgb, role_names=None):
+        """
+        Детектирование объектов для указанных ролей (по умолчанию - для всех).
+        Возвращает словарь {роль: sv.Detections}
+        """
+        return self.detect_batch([image_rgb], role_names)[0]
+
+    def detect_batch(self, images_rgb, role_names=None):
+        """Детектирование на пачке изображений одним вызовом модели; список словарей {роль: sv.Detections}"""
+        import supervision as sv
+
+        role_names = list(role_names or self.roles)
+        batch_detections = [{} for _ in images_rgb]
+        imgsz = self.imgsz
+        if self.adaptive_size and len(images_rgb):
+            imgsz = max(inference_size(image.shape, self.imgsz) for image in images_rgb)
+
+        for weights, names in self._groups(role_names).items():
+            roles = [self.roles[name] for name in names]
+            model = self.model(weights)
+
+            # Один проход с самым мягким порогом уверенности среди ролей группы. При разных
+            # порогах IoU модель отдаёт кандидатов без NMS, и каждая роль подавляет их сама -
+            # так же, как отдельный вызов модели с её порогами
+            shared_iou = len({role['iou'] for role in roles}) == 1
+            with self._locks[weights]:
+                results = model.predict(
+                    list(images_rgb),
+                    conf=min(role['conf'] for role in roles),
+                    iou=roles[0]['iou'] if shared_iou else 1.0,
+                    classes=sorted({role['class_id'] for role in roles}),
+                    imgsz=imgsz,
+                    max_det=MAX_DETECTIONS if shared_iou else MAX_CANDIDATES,
+                )
+
+            for detections, result in zip(batch_detections, results):
+                group_detections = sv.Detections.from_ultralytics(result)
+                for name, role in zip(names, roles):
+                    detections[name] = self._filter(group_detections, role, nms=not shared_iou)
+
+        return batch_detections
+
+    @staticmethod
+    def _filter(group_detections, role, nms=False):
+        """Выделение детекций одной роли с её порогом уверенности; nms - подавление с её порогом IoU"""
+        role_detections = group_detections[
+            (group_detections.class_id == role['class_id']) &
+            (group_detections.confidence >= role['conf'])
+        ]
+        if nms and len(role_detections) > 1:
+            # Кандидаты отсортированы по уверенности, как и результат NMS модели
+            role_detections = role_detections.with_nms(threshold=role['iou'], class_agnostic=True)
+            role_detections = role_detections[:MAX_DETECTIONS]
+        return role_detections
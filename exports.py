@@ -0,0 +1,226 @@
+import csv
+import importlib.util
+import io
+import itertools
+import tempfile
+from datetime import datetime
+
+
+# Колонки выгрузки: по строке на анализ или по строке на каждый стол в каждом анализе.
+# Числа остаются числами, координаты bbox - отдельными колонками
+EXPORT_COLUMNS = {
+    'analyses': ['id', 'timestamp', 'camera_id', 'tables_found', 'people_found', 'occupied_tables',
+                 'occupancy_rate'],
+    'tables': ['analysis_id', 'timestamp', 'camera_id', 'table_id', 'status', 'person_count', 'confidence',
+               'x1', 'y1', 'x2', 'y2', 'dwell_seconds'],
+}
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# Типы колонок Parquet (остальные - целые)
+STRING_COLUMNS = {'timestamp', 'camera_id', 'status'}
+FLOAT_COLUMNS = {'occupancy_rate', 'confidence', 'x1', 'y1', 'x2', 'y2', 'dwell_seconds'}
+
+# Листы XLSX-выгрузки
+SHEET_NAMES = {'analyses': 'Анализы', 'tables': 'Столы'}
+
+# Предел строк на листе Excel (вместе с заголовком); остальные строки уходят на листы-продолжения
+EXCEL_MAX_ROWS = 1_048_576
+
+CHUNK_SIZE = 64 * 1024
+PARQUET_ROW_GROUP = 10_000
+
+
+def analysis_rows(entries, camera_id=None):
+    """Строки 'analyses' из записей истории (генератор)"""
+    for entry in entries:
+        data = entry['data']
+        if camera_id is not None and data.get('camera_id') != camera_id:
+            continue
+        tables = data.get('tables') or []
+        yield (
+            entry.get('id'),
+            entry['timestamp'],
+            data.get('camera_id'),
+            data.get('tables_found', len(tables)),
+            data.get('people_found', len(data.get('people') or [])),
+            sum(1 for table in tables if table.get('status') == 'occupied'),
+            float(data.get('occupancy_rate', 0)),
+        )
+
+
+def table_rows(entries, camera_id=None):
+    """Строки 'tables' из записей истории (генератор)"""
+    for entry in entries:
+        data = entry['data']
+        if camera_id is not None and data.get('camera_id') != camera_id:
+            continue
+        for table in data.get('tables') or []:
+            x1, y1, x2, y2 = (table.get('bbox') or [None] * 4)[:4]
+            yield (
+                entry.get('id'),
+                entry['timestamp'],
+                data.get('camera_id'),
+                table.get('id'),
+                table.get('status'),
+                table.get('person_count', 0),
+                float(table.get('confidence', 0)),
+                x1, y1, x2, y2,
+                table.get('dwell_seconds'),
+            )
+
+
+ROW_BUILDERS = {
+    'analyses': analysis_rows,
+    'tables': table_rows,
+}
+
+
+def _read_chunks(f):
+    f.seek(0)
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def stream_csv(rows, columns):
+    """CSV по частям: в памяти не больше одного блока строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM, чтобы Excel открыл кириллицу в UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _xlsx_value(column, value):
+    # Время - настоящей датой Excel, а не строкой
+    if column == 'timestamp' and value:
+        return datetime.fromisoformat(value)
+    return value
+
+
+def stream_xlsx(sheets):
+    """
+    XLSX с постоянным расходом памяти: xlsxwriter в режиме constant_memory,
+    если он установлен, иначе openpyxl в режиме write-only. Строки сразу уходят
+    во временный файл на диске; zip-архив XLSX нельзя отдавать до завершения,
+    поэтому ответ начинается после записи файла.
+    sheets: список (имя листа, колонки, генератор строк)
+    """
+    with tempfile.TemporaryFile() as f:
+        if importlib.util.find_spec('xlsxwriter') is not None:
+            _write_xlsxwriter(f, sheets)
+        else:
+            _write_openpyxl(f, sheets)
+        yield from _read_chunks(f)
+
+
+def _sheet_parts(sheets):
+    """
+    Листы, разбитые по EXCEL_MAX_ROWS: 'Столы', 'Столы (2)', ... с повтором заголовка.
+    Строки не копируются - каждая часть читает общий генератор, пока лист не заполнится
+    """
+    for title, columns, rows in sheets:
+        rows = iter(rows)
+        yield title, columns, itertools.islice(rows, EXCEL_MAX_ROWS - 1)
+        for part in itertools.count(2):
+            first = next(rows, None)
+            if first is None:
+                break
+            yield f'{title} ({part})', columns, itertools.chain([first], itertools.islice(rows, EXCEL_MAX_ROWS - 2))
+
+
+def _write_xlsxwriter(f, sheets):
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(f, {'constant_memory': True, 'in_memory': False})
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    for title, columns, rows in _sheet_parts(sheets):
+        sheet = workbook.add_worksheet(title)
+        sheet.write_row(0, 0, columns)
+        timestamp_column = columns.index('timestamp')
+        sheet.set_column(timestamp_column, timestamp_column, 20, date_format)
+        for row_number, row in enumerate(rows, start=1):
+            sheet.write_row(row_number, 0, [_xlsx_value(column, value) for column, value in zip(columns, row)])
+    workbook.close()
+
+
+def _write_openpyxl(f, sheets):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for title, columns, rows in _sheet_parts(sheets):
+        sheet = workbook.create_sheet(title)
+        sheet.append(columns)
+        for row in rows:
+            sheet.append([_xlsx_value(column, value) for column, value in zip(columns, row)])
+    workbook.save(f)
+
+
+def stream_parquet(rows, columns):
+    """Parquet группами по PARQUET_ROW_GROUP строк (нужен pyarrow)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Явная схема: в первой группе колонка может состоять из одних None
+    schema = pa.schema([(column, pa.string() if column in STRING_COLUMNS else
+                         pa.float64() if column in FLOAT_COLUMNS else pa.int64()) for column in columns])
+
+    with tempfile.TemporaryFile() as f:
+        with pq.ParquetWriter(f, schema) as writer:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == PARQUET_ROW_GROUP:
+                    writer.write_table(pa.Table.from_pylist([dict(zip(columns, row)) for row in batch], schema))
+                    batch = []
+            if batch:
+                writer.write_table(pa.Table.from_pylist([dict(zip(columns, row)) for row in batch], schema))
+        yield from _read_chunks(f)
+
+
+def export_available(export_format):
+    """Доступен ли формат (parquet требует необязательного pyarrow)"""
+    if export_format not in EXPORT_FORMATS:
+        return False
+    return export_format != 'parquet' or importlib.util.find_spec('pyarrow') is not None
+
+
+def stream_export(iter_entries, export_format, level='analyses', camera_id=None):
+    """
+    Потоковая выгрузка истории: генератор байтовых блоков файла.
+    iter_entries() должна каждый раз возвращать новый генератор записей истории
+    (XLSX содержит оба листа и читает историю дважды)
+    """
+    if level not in EXPORT_COLUMNS:
+        raise ValueError(f"Unknown export level: {level}")
+    if not export_available(export_format):
+        raise ValueError(f"Export format is not available: {export_format}")
+
+    if export_format == 'xlsx':
+        return stream_xlsx([(SHEET_NAMES[name], EXPORT_COLUMNS[name], ROW_BUILDERS[name](iter_entries(), camera_id))
+                            for name in ('analyses', 'tables')])
+
+    rows = ROW_BUILDERS[level](iter_entries(), camera_id)
+    if export_format == 'parquet':
+        return stream_parquet(rows, EXPORT_COLUMNS[level])
+    return stream_csv(rows, EXPORT_COLUMNS[level])
+
+
+def export_filename(export_format, level):
+    _, extension = EXPORT_FORMATS[export_format]
+    suffix = '' if export_format == 'xlsx' else f'_{level}'
+    return f"cafe_history{suffix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
@@ -0,0 +1,32 @@
+# Настройки gunicorn для production: gunicorn -c gunicorn.conf.py "wsgi:create_app()"
+import os
+
+from wsgi import default_workers
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# Один воркер: трекинг камер, пропуск инференса, кэш результатов и видеопотоки
+# живут в памяти процесса. WEB_CONCURRENCY > 1 - только для разовых анализов
+# без camera_id (ограничения и масштабирование камер - в описании wsgi.py);
+# ядра делятся между воркерами поровну
+workers = default_workers()
+
+# Потоки внутри воркера обслуживают параллельные запросы, а их кадры
+# собираются в батчи планировщиком инференса
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Модели загружаются в каждом воркере после fork: torch плохо переносит fork
+# с уже запущенными пулами потоков. Экспорт ONNX/OpenVINO при первом запуске
+# выполняет один воркер под файловой блокировкой, остальные ждут его
+preload_app = False
+
+# Модели прогреваются в фоне после старта воркера (WARMUP_BACKGROUND=0 - до начала
+# обслуживания), первые запросы анализа ждут окончания прогрева
+timeout = 120
+graceful_timeout = 30
+
+
+def post_fork(server, worker):
+    # Фактическое число воркеров (в том числе из -w командной строки) для wsgi.create_app
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
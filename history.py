@@ -0,0 +1,345 @@
+import itertools
+import json
+import os
+import sqlite3
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+
+@contextmanager
+def file_lock(path):
+    """Эксклюзивная блокировка между процессами на файле path (без fcntl - ничего не делает)"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def time_bound(value, end=False):
+    """
+    Граница диапазона в формате времени записей (ValueError, если не разбирается).
+    Время с часовым поясом переводится в локальное; конец диапазона,
+    заданный одной датой, включает весь день
+    """
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    if end and len(value) == 10:
+        moment += timedelta(days=1, microseconds=-1)
+    return moment.isoformat()
+
+
+class HistoryStore:
+    """
+    Хранилище истории анализов. Запись добавляется за O(1),
+    выборка - по времени с постраничной навигацией или по курсору (id записи).
+    Записи имеют формат {'id': ..., 'timestamp': ..., 'data': ...}; id
+    назначается сервером, возрастает и не переиспользуется
+    """
+
+    def __init__(self, path, retention=100_000):
+        self.path = path
+        self.retention = retention
+
+    def append(self, data, timestamp=None):
+        """Добавление записи; возвращает её id"""
+        return self.append_many([data], [timestamp])[0]
+
+    def append_many(self, items, timestamps=None):
+        raise NotImplementedError
+
+    def query(self, limit=100, offset=0, start=None, end=None, newest_first=False):
+        """
+        Выборка записей в интервале [start, end] (ISO-строки).
+        offset отсчитывается от самых новых записей
+        """
+        raise NotImplementedError
+
+    def count(self, start=None, end=None):
+        raise NotImplementedError
+
+    def since(self, cursor, limit=100, newest=False):
+        """
+        Записи с id больше cursor в порядке добавления: первые limit,
+        а с newest - последние limit (более старые пропускаются)
+        """
+        raise NotImplementedError
+
+    def last_id(self):
+        """id последней записи (0 - история пуста)"""
+        raise NotImplementedError
+
+    def iter_entries(self, start=None, end=None):
+        """Генератор всех записей интервала в порядке добавления, без загрузки в память целиком"""
+        raise NotImplementedError
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """История в SQLite с индексом по времени (режим WAL, соединение на поток)"""
+
+    # Удаляем записи сверх retention не на каждой вставке, а раз в столько вставок
+    PRUNE_EVERY = 500
+
+    def __init__(self, path, retention=100_000):
+        super().__init__(path, retention)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._appends = 0
+
+        connection = self._connection()
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS history_timestamp ON history (timestamp);
+        """)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def append_many(self, items, timestamps=None):
+        timestamps = timestamps or [None] * len(items)
+        rows = [(timestamp or datetime.now().isoformat(), json.dumps(data))
+                for data, timestamp in zip(items, timestamps)]
+
+        connection = self._connection()
+        with self._write_lock:
+            # Одна транзакция на всю пачку
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                ids = [connection.execute('INSERT INTO history (timestamp, data) VALUES (?, ?)', row).lastrowid
+                       for row in rows]
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+            self._appends += len(rows)
+            if self._appends >= self.PRUNE_EVERY:
+                self._appends = 0
+                self._prune(connection)
+        return ids
+
+    def _prune(self, connection):
+        """Удаление записей, не попадающих в retention"""
+        if self.retention:
+            connection.execute('DELETE FROM history WHERE id <= (SELECT MAX(id) FROM history) - ?',
+                               (self.retention,))
+
+    @staticmethod
+    def _where(start, end):
+        conditions, params = [], []
+        if start:
+            conditions.append('timestamp >= ?')
+            params.append(time_bound(start))
+        if end:
+            conditions.append('timestamp <= ?')
+            params.append(time_bound(end, end=True))
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    def query(self, limit=100, offset=0, start=None, end=None, newest_first=False):
+        where, params = self._where(start, end)
+        rows = self._connection().execute(
+            f'SELECT id, timestamp, data FROM history{where} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?',
+            params + [limit, offset]
+        ).fetchall()
+        entries = [{'id': entry_id, 'timestamp': timestamp, 'data': json.loads(data)}
+                   for entry_id, timestamp, data in rows]
+        return entries if newest_first else entries[::-1]
+
+    def count(self, start=None, end=None):
+        where, params = self._where(start, end)
+        return self._connection().execute(f'SELECT COUNT(*) FROM history{where}', params).fetchone()[0]
+
+    def since(self, cursor, limit=100, newest=False):
+        rows = self._connection().execute(
+            f'SELECT id, timestamp, data FROM history WHERE id > ? ORDER BY id {"DESC" if newest else "ASC"} LIMIT ?',
+            (cursor, limit)
+        ).fetchall()
+        entries = [{'id': entry_id, 'timestamp': timestamp, 'data': json.loads(data)}
+                   for entry_id, timestamp, data in rows]
+        return entries[::-1] if newest else entries
+
+    def last_id(self):
+        return self._connection().execute('SELECT COALESCE(MAX(id), 0) FROM history').fetchone()[0]
+
+    def iter_entries(self, start=None, end=None):
+        where, params = self._where(start, end)
+        # Отдельное соединение, чтобы долгое чтение не мешало записи из этого же потока
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            for entry_id, timestamp, data in connection.execute(
+                    f'SELECT id, timestamp, data FROM history{where} ORDER BY id', params):
+                yield {'id': entry_id, 'timestamp': timestamp, 'data': json.loads(data)}
+        finally:
+            connection.close()
+
+
+class JSONLHistoryStore(HistoryStore):
+    """
+    История в файле JSON Lines: одна запись - одна строка, запись только дописыванием.
+    Файл периодически уплотняется до retention последних записей.
+    Файл общий для воркеров gunicorn: запись и уплотнение идут под блокировкой
+    fcntl (файл *.lock), а последний id и число строк каждый процесс досчитывает
+    по байтам, дописанным после его последнего чтения. Без fcntl (Windows) -
+    только один процесс
+    """
+
+    def __init__(self, path, retention=100_000):
+        super().__init__(path, retention)
+        self._lock = threading.Lock()
+        # Прочитанная часть файла: inode, размер до конца последней полной строки, строки, последний id
+        self._inode = None
+        self._size = 0
+        self._lines = 0
+        self._last_id = 0
+        self._sync()
+
+    def _sync(self):
+        """Учёт строк, дописанных другими процессами; после уплотнения файл перечитывается целиком"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._inode, self._size, self._lines = None, 0, 0
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._size:
+            self._inode, self._size, self._lines = stat.st_ino, 0, 0
+        if stat.st_size == self._size:
+            return
+
+        last_line = None
+        with open(self.path, 'rb') as f:
+            f.seek(self._size)
+            for line in f:
+                # Недописанная строка (запись идёт прямо сейчас) учитывается при следующем чтении
+                if not line.endswith(b'\n'):
+                    break
+                self._size += len(line)
+                if line.strip():
+                    self._lines += 1
+                    last_line = line
+        if last_line is not None:
+            self._last_id = json.loads(last_line).get('id', self._last_id)
+
+    def append_many(self, items, timestamps=None):
+        timestamps = timestamps or [None] * len(items)
+        with self._lock, file_lock(self.path + '.lock'):
+            self._sync()
+            ids = list(range(self._last_id + 1, self._last_id + 1 + len(items)))
+            lines = [json.dumps({'id': entry_id, 'timestamp': timestamp or datetime.now().isoformat(), 'data': data})
+                     for entry_id, data, timestamp in zip(ids, items, timestamps)]
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            self._sync()
+
+            # Уплотняем файл, когда он вырос в полтора раза больше retention
+            if self.retention and self._lines > self.retention * 3 // 2:
+                self._compact()
+        return ids
+
+    def _compact(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            tail = deque((line for line in f if line.strip()), maxlen=self.retention)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(tail)
+        os.replace(tmp_path, self.path)
+        self._sync()
+
+    def _scan(self, start, end):
+        start = time_bound(start) if start else None
+        end = time_bound(end, end=True) if end else None
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                # Пустые строки и недописанная последняя строка пропускаются
+                if not line.strip() or not line.endswith('\n'):
+                    continue
+                entry = json.loads(line)
+                if start and entry['timestamp'] < start:
+                    continue
+                if end and entry['timestamp'] > end:
+                    continue
+                yield entry
+
+    def query(self, limit=100, offset=0, start=None, end=None, newest_first=False):
+        with self._lock:
+            window = deque(self._scan(start, end), maxlen=limit + offset)
+        entries = [{'id': entry.get('id'), 'timestamp': entry['timestamp'], 'data': entry['data']} for entry in window]
+        entries = entries[:len(entries) - offset] if offset else entries
+        entries = entries[-limit:] if limit else []
+        return entries[::-1] if newest_first else entries
+
+    def count(self, start=None, end=None):
+        with self._lock:
+            return sum(1 for _ in self._scan(start, end))
+
+    def since(self, cursor, limit=100, newest=False):
+        with self._lock:
+            entries = (entry for entry in self._scan(None, None) if entry.get('id', 0) > cursor)
+            if newest:
+                return list(deque(entries, maxlen=limit))
+            return list(itertools.islice(entries, limit))
+
+    def last_id(self):
+        with self._lock:
+            self._sync()
+            return self._last_id
+
+    def iter_entries(self, start=None, end=None):
+        return self._scan(start, end)
+
+
+HISTORY_BACKENDS = {
+    'sqlite': SQLiteHistoryStore,
+    'jsonl': JSONLHistoryStore,
+}
+
+
+def create_history_store(backend, path, retention=100_000):
+    """Создание хранилища истории по имени бэкенда ('sqlite' или 'jsonl')"""
+    if backend not in HISTORY_BACKENDS:
+        raise ValueError(f"Unknown history backend: {backend}")
+    return HISTORY_BACKENDS[backend](path, retention)
+
+
+def migrate_json_history(json_path, store):
+    """
+    Перенос истории из старого analysis_history.json в хранилище.
+    После переноса файл переименовывается в *.migrated; возвращает число перенесённых записей.
+    Воркеры gunicorn обращаются к истории одновременно: переносит один под файловой
+    блокировкой, остальные после её снятия видят, что файла уже нет
+    """
+    if not os.path.exists(json_path):
+        return 0
+
+    with file_lock(json_path + '.lock'):
+        if not os.path.exists(json_path):
+            return 0
+
+        with open(json_path, 'r') as f:
+            history = json.load(f)
+
+        if history:
+            store.append_many([entry.get('data') for entry in history],
+                              [entry.get('timestamp') for entry in history])
+        os.replace(json_path, json_path + '.migrated')
+    return len(history)
@@ -0,0 +1,299 @@
+import io
+import ipaddress
+import os
+import socket
+import struct
+import threading
+import uuid
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+
+
+# Ограничение на размер изображения в пикселях (проверяется до декодирования)
+MAX_IMAGE_PIXELS = 50_000_000
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Файлы ZIP-архива пакетной загрузки, которые считаются изображениями
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.jfif', '.png', '.bmp', '.gif', '.webp', '.tif', '.tiff'}
+
+
+# Адреса, недоступные внешним источникам без явного разрешения: сам сервер,
+# link-local (метаданные облака 169.254.169.254) и служебные диапазоны
+def _forbidden_address(address):
+    address = ipaddress.ip_address(address.split('%')[0])
+    return address.is_loopback or address.is_link_local or address.is_unspecified or \
+        address.is_multicast or address.is_reserved
+
+
+class ImageTooLarge(ValueError):
+    """Изображение превышает допустимое число пикселей"""
+
+
+class BufferPool:
+    """
+    Пул переиспользуемых буферов. Кадры с камер приходят одного и того же
+    размера, поэтому буферы под байты файла и под RGB-изображение
+    выделяются один раз и дальше берутся из пула.
+    """
+
+    def __init__(self, max_keys=8, max_free_per_key=4):
+        self.max_keys = max_keys
+        self.max_free_per_key = max_free_per_key
+        self._free = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key, factory):
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                self._free.move_to_end(key)
+                return free.pop()
+        return factory()
+
+    def release(self, key, buffer):
+        with self._lock:
+            free = self._free.setdefault(key, [])
+            self._free.move_to_end(key)
+            if len(free) < self.max_free_per_key:
+                free.append(buffer)
+            # Вытесняем давно не использовавшиеся размеры
+            while len(self._free) > self.max_keys:
+                self._free.popitem(last=False)
+
+
+byte_buffers = BufferPool()
+rgb_buffers = BufferPool()
+
+
+def _capacity(size):
+    """Округление размера буфера вверх до степени двойки"""
+    return 1 << max(size - 1, READ_CHUNK_SIZE - 1).bit_length()
+
+
+def read_stream(stream, max_bytes=None, size_hint=None):
+    """
+    Чтение потока в буфер из пула без промежуточных копий.
+    size_hint - ожидаемый размер (например, Content-Length), чтобы сразу взять буфер нужной ёмкости.
+    Возвращает (буфер, длина); буфер нужно вернуть через byte_buffers.release
+    """
+    capacity = _capacity(size_hint or READ_CHUNK_SIZE)
+    buffer = byte_buffers.acquire(capacity, lambda: bytearray(capacity))
+    length = 0
+
+    while True:
+        if length == len(buffer):
+            if max_bytes is not None and length >= max_bytes:
+                byte_buffers.release(len(buffer), buffer)
+                raise ImageTooLarge(f'File exceeds {max_bytes} bytes')
+            grown = byte_buffers.acquire(len(buffer) * 2, lambda: bytearray(len(buffer) * 2))
+            grown[:length] = buffer[:length]
+            byte_buffers.release(len(buffer), buffer)
+            buffer = grown
+
+        read = stream.readinto(memoryview(buffer)[length:])
+        if not read:
+            break
+        length += read
+
+    return buffer, length
+
+
+def image_dimensions(data):
+    """
+    Размеры изображения (ширина, высота) по заголовку файла без декодирования.
+    Поддерживаются JPEG, PNG, GIF, BMP и WebP; для остальных форматов - None
+    """
+    data = bytes(data[:64 * 1024])
+
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        return struct.unpack('<HH', data[6:10])
+
+    if data[:2] == b'BM' and len(data) >= 26:
+        width, height = struct.unpack('<ii', data[18:26])
+        return abs(width), abs(height)
+
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP' and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L':
+            bits = int.from_bytes(data[21:25], 'little')
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X':
+            return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+        return None
+
+    if data[:2] == b'\xff\xd8':
+        # Ищем маркер SOFn, в котором записаны размеры кадра
+        pos = 2
+        while pos + 9 < len(data):
+            if data[pos] != 0xFF:
+                pos += 1
+                continue
+            marker = data[pos + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+                pos += 1 if marker == 0xFF else 2
+                continue
+            segment_length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+                return width, height
+            pos += 2 + segment_length
+        return None
+
+    return None
+
+
+def check_dimensions(width, height, max_pixels=MAX_IMAGE_PIXELS):
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f'Image {width}x{height} exceeds {max_pixels} pixels')
+
+
+def decode_image(data, max_pixels=MAX_IMAGE_PIXELS):
+    """Декодирование изображения из байтов в BGR-массив без записи на диск"""
+    dimensions = image_dimensions(data)
+    if dimensions is not None:
+        check_dimensions(*dimensions, max_pixels=max_pixels)
+
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is not None and dimensions is None:
+        check_dimensions(image.shape[1], image.shape[0], max_pixels=max_pixels)
+    return image
+
+
+@contextmanager
+def read_upload(file, max_bytes=None, size_hint=None):
+    """Байты загруженного файла (memoryview на буфер из пула, действителен внутри блока with)"""
+    buffer, length = read_stream(file.stream, max_bytes=max_bytes, size_hint=size_hint)
+    try:
+        yield memoryview(buffer)[:length]
+    finally:
+        byte_buffers.release(len(buffer), buffer)
+
+
+def decode_upload(file, max_pixels=MAX_IMAGE_PIXELS, max_bytes=None, size_hint=None):
+    """Декодирование загруженного файла напрямую из потока запроса"""
+    with read_upload(file, max_bytes=max_bytes, size_hint=size_hint) as data:
+        return decode_image(data, max_pixels=max_pixels)
+
+
+def detach_upload(file):
+    """
+    Загруженный файл, который переживёт завершение запроса (для потоковых ответов:
+    Flask закрывает файлы запроса до того, как начнёт отдавать тело ответа).
+    Закрыть возвращённый файл должен вызывающий
+    """
+    stream, file.stream = file.stream, io.BytesIO()
+    return FileStorage(stream=stream, filename=file.filename, name=file.name, headers=file.headers)
+
+
+def is_zip(stream):
+    """ZIP-архив определяется по сигнатуре, а не по имени файла"""
+    position = stream.tell()
+    signature = stream.read(4)
+    stream.seek(position)
+    return signature == b'PK\x03\x04'
+
+
+def archive_images(stream, max_bytes=None, max_pixels=MAX_IMAGE_PIXELS):
+    """
+    Изображения из ZIP-архива: список (имя, функция декодирования).
+    Распаковка и декодирование выполняются при вызове функции, поэтому могут
+    идти в потоках пула (zipfile читает члены архива под общим замком)
+    """
+    archive = zipfile.ZipFile(stream)
+    images = []
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        # Служебные файлы (__MACOSX/._*, .DS_Store) пропускаем
+        if info.is_dir() or name.startswith('.') or os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        images.append((info.filename, partial(_decode_member, archive, info, max_bytes, max_pixels)))
+    return images
+
+
+def _decode_member(archive, info, max_bytes, max_pixels):
+    # Размер из заголовка проверяется до распаковки; больше file_size zipfile не распакует
+    if max_bytes is not None and info.file_size > max_bytes:
+        raise ImageTooLarge(f'File exceeds {max_bytes} bytes')
+    return decode_image(archive.read(info), max_pixels=max_pixels)
+
+
+def load_upload_from_disk(file, upload_folder, max_pixels=MAX_IMAGE_PIXELS):
+    """Отладочный режим: сохранение файла в upload_folder и чтение через cv2.imread"""
+    os.makedirs(upload_folder, exist_ok=True)
+    # Уникальный префикс, чтобы одноимённые загрузки не перезаписывали друг друга
+    filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+    filepath = os.path.join(upload_folder, filename)
+    file.save(filepath)
+
+    try:
+        image = cv2.imread(filepath)
+        if image is not None:
+            check_dimensions(image.shape[1], image.shape[0], max_pixels=max_pixels)
+        return image
+    finally:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+
+@contextmanager
+def rgb_frame(image):
+    """Конвертация BGR -> RGB в переиспользуемый буфер того же размера"""
+    key = image.shape
+    buffer = rgb_buffers.acquire(key, lambda: np.empty(key, dtype=np.uint8))
+    try:
+        yield cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=buffer)
+    finally:
+        rgb_buffers.release(key, buffer)
+
+
+def resolve_source(source, media_dir, schemes=('http', 'https'), allowed_hosts=None):
+    """
+    Проверка источника видео или снимков, присланного клиентом.
+    URL допускается только со схемой из schemes; с allowed_hosts - только на эти
+    хосты, без него - на любые, кроме адресов самого сервера, link-local и служебных.
+    Остальное считается файлом внутри media_dir (относительный путь - от неё).
+    Возвращает URL или абсолютный путь к файлу; при ошибке - ValueError
+    """
+    if not isinstance(source, str) or not source:
+        raise ValueError("Source must be a non-empty string")
+
+    if '://' in source:
+        parts = urlsplit(source)
+        if parts.scheme.lower() not in schemes:
+            raise ValueError(f"URL scheme must be one of: {', '.join(schemes)}")
+        host = parts.hostname
+        if not host:
+            raise ValueError("URL host is required")
+        if allowed_hosts is not None:
+            if host.lower() not in {allowed.lower() for allowed in allowed_hosts}:
+                raise ValueError(f"Host is not allowed: {host}")
+            return source
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 0)}
+        except (socket.gaierror, UnicodeError):
+            raise ValueError(f"Unknown host: {host}")
+        if any(_forbidden_address(address) for address in addresses):
+            raise ValueError(f"Host is not allowed: {host}")
+        return source
+
+    # Путь к файлу: только внутри media_dir (с учётом .. и символических ссылок)
+    root = os.path.realpath(media_dir)
+    path = os.path.realpath(os.path.join(root, source))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise ValueError(f"Source must be a URL or a file in {media_dir}")
+    return path
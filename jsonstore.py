@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from history import file_lock
+
+
+class JSONFileStore:
+    """
+    Словарь настроек по ключу (id камеры) в одном JSON-файле.
+    Файл могли отредактировать вручную - он перечитывается при изменении.
+    Файл общий для воркеров gunicorn: изменение (перечитать, поправить, записать)
+    идёт под файловой блокировкой, запись - через уникальный временный файл и
+    атомарную замену
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._items = None
+        self._mtime = None
+
+    def _load(self, force=False):
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if force or self._items is None or mtime != self._mtime:
+            if mtime is None:
+                self._items = {}
+            else:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._items = json.load(f)
+            self._mtime = mtime
+        return self._items
+
+    def _save(self):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._items, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._mtime = os.path.getmtime(self.path)
+
+    @contextmanager
+    def _modify(self):
+        """Изменение под блокировкой: словарь перечитывается с диска (его мог изменить другой воркер)"""
+        with self._lock, file_lock(self.path + '.lock'):
+            yield self._load(force=True)
+            self._save()
+
+    def _set(self, key, value):
+        with self._modify() as items:
+            items[key] = value
+        return value
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            return self._load().get(key)
+
+    def list(self):
+        with self._lock:
+            return dict(self._load())
+
+    def delete(self, key):
+        with self._modify() as items:
+            deleted = items.pop(key, None) is not None
+        return deleted
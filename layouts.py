@@ -0,0 +1,145 @@
+import hashlib
+import json
+from datetime import datetime
+
+import numpy as np
+
+from jsonstore import JSONFileStore
+
+
+def normalize_layout(tables):
+    """
+    Проверка схемы столов: список {'id': ..., 'bbox': [x1, y1, x2, y2]} или
+    {'id': ..., 'polygon': [[x, y], ...]}. Для многоугольника bbox - его габариты,
+    а люди сопоставляются с самим многоугольником.
+    Возвращает новый список; при ошибке - ValueError
+    """
+    if not isinstance(tables, list) or not tables:
+        raise ValueError("Layout must be a non-empty list of tables")
+
+    normalized, ids = [], set()
+    for table in tables:
+        table_id = table.get('id')
+        if not isinstance(table_id, int) or table_id <= 0 or table_id in ids:
+            raise ValueError(f"Table ids must be unique positive integers: {table_id!r}")
+        ids.add(table_id)
+
+        entry = {'id': table_id}
+        if table.get('polygon') is not None:
+            polygon = np.asarray(table['polygon'], dtype=np.float64)
+            if polygon.ndim != 2 or polygon.shape[1] != 2 or len(polygon) < 3:
+                raise ValueError(f"Table {table_id}: polygon must have at least 3 [x, y] points")
+            entry['polygon'] = polygon.tolist()
+            bbox = [*polygon.min(axis=0), *polygon.max(axis=0)]
+        else:
+            bbox = table.get('bbox')
+            if bbox is None or len(bbox) != 4:
+                raise ValueError(f"Table {table_id}: bbox or polygon required")
+        x1, y1, x2, y2 = (float(v) for v in bbox)
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"Table {table_id}: empty bbox")
+        entry['bbox'] = [x1, y1, x2, y2]
+        normalized.append(entry)
+    return normalized
+
+
+def normalize_image_size(image_size):
+    """Размер кадра разметки: None или {'width': int > 0, 'height': int > 0}; при ошибке - ValueError"""
+    if image_size is None:
+        return None
+    if not isinstance(image_size, dict):
+        raise ValueError("image_size must be an object with width and height")
+    width, height = image_size.get('width'), image_size.get('height')
+    for value in (width, height):
+        if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+            raise ValueError("image_size width and height must be positive integers")
+    return {'width': width, 'height': height}
+
+
+def layout_version(layout):
+    """
+    Версия схемы - хэш её содержимого (None - схемы нет). Ключ кэша результатов и
+    сессии трекинга включают версию, поэтому смена схемы в одном воркере делает
+    устаревшие данные недействительными во всех
+    """
+    if layout is None:
+        return None
+    if layout.get('version'):
+        return layout['version']
+    # Схема, записанная вручную без версии
+    content = json.dumps([layout['tables'], layout.get('image_size')], sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+
+def _layout_scale(layout, image_shape):
+    """Масштаб координат схемы к кадру (x, y) или None, если разрешение совпадает"""
+    size = layout.get('image_size')
+    if not size:
+        return None
+    height, width = image_shape[:2]
+    scale = np.array([width / size['width'], height / size['height']])
+    return None if np.allclose(scale, 1.0) else scale
+
+
+def layout_boxes(layout, image_shape):
+    """
+    Боксы и id столов схемы для кадра данного размера.
+    Если схема размечена на кадре другого разрешения, координаты масштабируются
+    """
+    boxes = np.array([table['bbox'] for table in layout['tables']], dtype=np.float64)
+    scale = _layout_scale(layout, image_shape)
+    if scale is not None:
+        boxes = boxes * np.tile(scale, 2)
+    return boxes, [table['id'] for table in layout['tables']]
+
+
+def layout_polygons(layout, image_shape):
+    """
+    Многоугольники столов схемы для кадра данного размера: список по столам
+    (None у столов с bbox) или None, если многоугольников в схеме нет
+    """
+    if not any('polygon' in table for table in layout['tables']):
+        return None
+    scale = _layout_scale(layout, image_shape)
+    polygons = []
+    for table in layout['tables']:
+        polygon = table.get('polygon')
+        if polygon is not None:
+            polygon = np.asarray(polygon, dtype=np.float64)
+            if scale is not None:
+                polygon = polygon * scale
+        polygons.append(polygon)
+    return polygons
+
+
+def crop_region(boxes, image_shape, margin=1.0):
+    """
+    Область кадра для детекции людей: объединение столов, каждый расширен на
+    margin своего размера (человек рядом со столом выходит за его бокс).
+    Возвращает (x1, y1, x2, y2) в целых пикселях
+    """
+    height, width = image_shape[:2]
+    sizes = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]) * margin
+    x1 = max(int(np.floor((boxes[:, 0] - sizes).min())), 0)
+    y1 = max(int(np.floor((boxes[:, 1] - sizes).min())), 0)
+    x2 = min(int(np.ceil((boxes[:, 2] + sizes).max())), width)
+    y2 = min(int(np.ceil((boxes[:, 3] + sizes).max())), height)
+    return x1, y1, x2, y2
+
+
+class LayoutStore(JSONFileStore):
+    """
+    Статические схемы столов по камерам в одном JSON-файле.
+    Для камеры со схемой столы не детектируются: люди сопоставляются с
+    неподвижными областями, id столов берутся из схемы
+    """
+
+    def put(self, camera_id, tables, image_size=None):
+        """Сохранение схемы камеры; image_size - {'width', 'height'} кадра, на котором она размечена"""
+        layout = {
+            'tables': normalize_layout(tables),
+            'image_size': normalize_image_size(image_size),
+            'updated': datetime.now().isoformat(),
+        }
+        layout['version'] = layout_version(layout)
+        return self._set(camera_id, layout)
@@ -0,0 +1,165 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Границы корзин гистограмм задержки (секунды)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счётчик с метками"""
+
+    type = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (как в Prometheus: накопительные счётчики, сумма, число)"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+
+        samples = []
+        for key, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append((f'{self.name}_bucket', key, cumulative, (('le', _format_value(bound)),)))
+            samples.append((f'{self.name}_sum', key, total))
+            samples.append((f'{self.name}_count', key, count))
+        return samples
+
+
+class Gauge:
+    """Значение, снимаемое в момент запроса метрик (функция без аргументов)"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help_text, function):
+        self.name = name
+        self.help = help_text
+        self.function = function
+
+    def samples(self):
+        value = self.function()
+        return [] if value is None else [(self.name, (), value)]
+
+
+class MetricsRegistry:
+    """
+    Метрики сервера в памяти процесса и их выдача в текстовом формате Prometheus.
+    Запись метрики - словарь и счётчики под коротким замком; с enabled=False
+    span() и запись метрик ничего не делают
+    """
+
+    def __init__(self, enabled=True, prefix='cafe_'):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._metrics = []
+        self.stage_seconds = self.histogram('stage_duration_seconds', 'Время этапов обработки запроса')
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self._register(Counter(self.prefix + name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self.prefix + name, help_text, buckets))
+
+    def gauge(self, name, help_text, function):
+        return self._register(Gauge(self.prefix + name, help_text, function))
+
+    def inc(self, counter, amount=1, **labels):
+        if self.enabled:
+            counter.inc(amount, **labels)
+
+    def observe(self, histogram, value, **labels):
+        if self.enabled:
+            histogram.observe(value, **labels)
+
+    @contextmanager
+    def span(self, stage):
+        """Замер длительности этапа в гистограмму stage_duration_seconds{stage=...}"""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - started, stage=stage)
+
+    def render(self):
+        """Текст для /metrics (формат Prometheus 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for sample in metric.samples():
+                name, key, value = sample[:3]
+                extra = sample[3] if len(sample) > 3 else ()
+                lines.append(f'{name}{_format_labels(key, extra)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
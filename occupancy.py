@@ -0,0 +1,283 @@
+import numpy as np
+
+
+# Доля ширины стола, в пределах которой человек считается сидящим за ним
+DISTANCE_THRESHOLD_RATIO = 0.8
+
+# До такого числа пар стол-человек занятость считается плотными матрицами,
+# для больших сцен - через пространственный индекс
+DENSE_MAX_PAIRS = 20_000
+
+# Предельное число ячеек сетки по стороне
+GRID_MAX_SIDE = 256
+
+
+def iou_matrix(boxes1, boxes2, epsilon=1e-6):
+    """
+    Матрица IoU между двумя наборами bounding boxes формы (N, 4) и (M, 4)
+    Формат: [x_min, y_min, x_max, y_max]
+    Результат - массив (N, M), поэлементно совпадающий с calculate_iou
+    """
+    boxes1 = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4)
+
+    b1 = boxes1[:, None, :]
+    b2 = boxes2[None, :, :]
+
+    # Координаты пересечения
+    x1 = np.maximum(b1[..., 0], b2[..., 0])
+    y1 = np.maximum(b1[..., 1], b2[..., 1])
+    x2 = np.minimum(b1[..., 2], b2[..., 2])
+    y2 = np.minimum(b1[..., 3], b2[..., 3])
+
+    # Вычисление площадей
+    intersection_area = (x2 - x1) * (y2 - y1)
+    box1_area = (b1[..., 2] - b1[..., 0]) * (b1[..., 3] - b1[..., 1])
+    box2_area = (b2[..., 2] - b2[..., 0]) * (b2[..., 3] - b2[..., 1])
+    union_area = box1_area + box2_area - intersection_area
+
+    # Невалидные боксы, отсутствие пересечения и нулевое объединение дают 0
+    valid1 = (b1[..., 2] > b1[..., 0]) & (b1[..., 3] > b1[..., 1])
+    valid2 = (b2[..., 2] > b2[..., 0]) & (b2[..., 3] > b2[..., 1])
+    mask = valid1 & valid2 & (x2 >= x1) & (y2 >= y1) & (union_area > 0)
+
+    iou = np.zeros(mask.shape, dtype=np.float64)
+    np.divide(intersection_area, union_area + epsilon, out=iou, where=mask)
+    return iou
+
+
+def calculate_iou(box1, box2, epsilon=1e-6):
+    """
+    Calculate Intersection over Union (IoU) for bounding boxes
+    Формат: [x_min, y_min, x_max, y_max]
+    Принимает одиночные боксы (возвращает float) или массивы (N, 4) и (M, 4)
+    (возвращает матрицу (N, M))
+    epsilon: маленькое значение для избежания деления на ноль
+    """
+    box1 = np.asarray(box1, dtype=np.float64)
+    box2 = np.asarray(box2, dtype=np.float64)
+    iou = iou_matrix(box1, box2, epsilon)
+    if box1.ndim == 1 and box2.ndim == 1:
+        return float(iou[0, 0])
+    return iou
+
+
+def _occupancy_dense(table_boxes, person_boxes):
+    """Все пары стол-человек сразу: матрицы (столы x люди)"""
+    # Расстояние между центрами по горизонтали
+    table_center = (table_boxes[:, 0] + table_boxes[:, 2]) / 2
+    person_center = (person_boxes[:, 0] + person_boxes[:, 2]) / 2
+    distance = np.abs(table_center[:, None] - person_center[None, :])
+
+    # Динамический порог на основе размера стола
+    threshold = (table_boxes[:, 2] - table_boxes[:, 0]) * DISTANCE_THRESHOLD_RATIO
+    near = distance < threshold[:, None]
+
+    iou = iou_matrix(table_boxes, person_boxes)
+    # Последовательное суммирование, как в исходном цикле
+    iou_sum = np.cumsum(iou, axis=1)[:, -1]
+
+    is_occupied = near.any(axis=1)
+    person_count = (near & (iou > 0)).sum(axis=1)
+    return is_occupied, person_count, iou_sum
+
+
+def _grid_cells(boxes, origin, cell_size, columns, rows):
+    """
+    Ячейки равномерной сетки, которые покрывает каждый бокс.
+    Возвращает (номера ячеек, индексы боксов) - по паре на каждую ячейку бокса
+    """
+    x1 = np.clip(np.floor((boxes[:, 0] - origin[0]) / cell_size), 0, columns - 1).astype(np.int64)
+    y1 = np.clip(np.floor((boxes[:, 1] - origin[1]) / cell_size), 0, rows - 1).astype(np.int64)
+    x2 = np.clip(np.floor((boxes[:, 2] - origin[0]) / cell_size), 0, columns - 1).astype(np.int64)
+    y2 = np.clip(np.floor((boxes[:, 3] - origin[1]) / cell_size), 0, rows - 1).astype(np.int64)
+    # Боксы нулевой или отрицательной площади ни с чем не пересекаются
+    valid = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+    widths = np.where(valid, x2 - x1 + 1, 0)
+    heights = np.where(valid, y2 - y1 + 1, 0)
+
+    counts = widths * heights
+    index = np.repeat(np.arange(len(boxes)), counts)
+    # Номер ячейки внутри прямоугольника бокса -> смещение по x и y
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cx = x1[index] + local % widths[index]
+    cy = y1[index] + local // widths[index]
+    return cy * columns + cx, index
+
+
+def _overlap_candidates(table_boxes, person_boxes):
+    """
+    Пары (стол, человек), боксы которых могут пересекаться: общая ячейка сетки.
+    Пары отсортированы по столу, затем по человеку
+    """
+    boxes = np.vstack([table_boxes, person_boxes])
+    origin = boxes[:, :2].min(axis=0)
+    extent = max(float((boxes[:, 2:] - origin).max()), 1.0)
+    # Ячейка порядка типичного размера бокса, но не больше GRID_MAX_SIDE ячеек по стороне
+    sizes = np.concatenate([boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]])
+    cell_size = max(float(np.median(sizes[sizes > 0])) if (sizes > 0).any() else 1.0, extent / GRID_MAX_SIDE)
+    columns = rows = int(extent // cell_size) + 1
+
+    table_cells, table_index = _grid_cells(table_boxes, origin, cell_size, columns, rows)
+    person_cells, person_index = _grid_cells(person_boxes, origin, cell_size, columns, rows)
+
+    order = np.argsort(table_cells, kind='stable')
+    table_cells, table_index = table_cells[order], table_index[order]
+    start = np.searchsorted(table_cells, person_cells, side='left')
+    counts = np.searchsorted(table_cells, person_cells, side='right') - start
+
+    # Все столы ячейки для каждой ячейки человека
+    persons = np.repeat(person_index, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    tables = table_index[np.repeat(start, counts) + offsets]
+
+    # Пара может встретиться в нескольких общих ячейках
+    pairs = np.unique(tables * len(person_boxes) + persons)
+    return pairs // len(person_boxes), pairs % len(person_boxes)
+
+
+def _occupancy_indexed(table_boxes, person_boxes):
+    """
+    То же, что _occupancy_dense, но без матриц на все пары.
+    Близость зависит только от центров по горизонтали: ближайший центр человека
+    находится двоичным поиском по отсортированным центрам. IoU считается только
+    для пар, попавших в общую ячейку сетки (у остальных пересечения нет)
+    """
+    table_center = (table_boxes[:, 0] + table_boxes[:, 2]) / 2
+    person_center = (person_boxes[:, 0] + person_boxes[:, 2]) / 2
+    threshold = (table_boxes[:, 2] - table_boxes[:, 0]) * DISTANCE_THRESHOLD_RATIO
+
+    # Ближайший по горизонтали человек - сосед слева или справа в отсортированном порядке
+    centers = np.sort(person_center)
+    position = np.searchsorted(centers, table_center)
+    left = centers[np.maximum(position - 1, 0)]
+    right = centers[np.minimum(position, len(centers) - 1)]
+    nearest = np.minimum(np.abs(table_center - left), np.abs(table_center - right))
+    is_occupied = nearest < threshold
+
+    t, p = _overlap_candidates(table_boxes, person_boxes)
+    b1, b2 = table_boxes[t], person_boxes[p]
+
+    # Те же вычисления, что в iou_matrix, поэлементно для пар-кандидатов
+    x1 = np.maximum(b1[:, 0], b2[:, 0])
+    y1 = np.maximum(b1[:, 1], b2[:, 1])
+    x2 = np.minimum(b1[:, 2], b2[:, 2])
+    y2 = np.minimum(b1[:, 3], b2[:, 3])
+    intersection_area = (x2 - x1) * (y2 - y1)
+    box1_area = (b1[:, 2] - b1[:, 0]) * (b1[:, 3] - b1[:, 1])
+    box2_area = (b2[:, 2] - b2[:, 0]) * (b2[:, 3] - b2[:, 1])
+    union_area = box1_area + box2_area - intersection_area
+    mask = (x2 >= x1) & (y2 >= y1) & (union_area > 0)
+    iou = np.zeros(len(t), dtype=np.float64)
+    np.divide(intersection_area, union_area + 1e-6, out=iou, where=mask)
+
+    # bincount складывает по порядку пар (по людям внутри стола), как исходный цикл
+    iou_sum = np.bincount(t, weights=iou, minlength=len(table_boxes))
+    near = np.abs(table_center[t] - person_center[p]) < threshold[t]
+    person_count = np.bincount(t[near & (iou > 0)], minlength=len(table_boxes))
+    return is_occupied, person_count, iou_sum
+
+
+def _polygon_area(points):
+    x, y = points[:, 0], points[:, 1]
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def _clip_polygon(points, box):
+    """Отсечение многоугольника боксом (Сазерленд-Ходжман: окно отсечения выпуклое)"""
+    x1, y1, x2, y2 = box
+    # Полуплоскости бокса: (ось, граница, внутри - больше границы)
+    for axis, bound, inside_greater in ((0, x1, True), (0, x2, False), (1, y1, True), (1, y2, False)):
+        if len(points) == 0:
+            break
+        inside = points[:, axis] >= bound if inside_greater else points[:, axis] <= bound
+        clipped = []
+        for i in range(len(points)):
+            current, previous = points[i], points[i - 1]
+            if inside[i] != inside[i - 1]:
+                t = (bound - previous[axis]) / (current[axis] - previous[axis])
+                clipped.append(previous + t * (current - previous))
+            if inside[i]:
+                clipped.append(current)
+        points = np.array(clipped).reshape(-1, 2)
+    return points
+
+
+def polygon_iou(polygon, boxes):
+    """IoU многоугольника стола с каждым боксом (N, 4)"""
+    polygon = np.asarray(polygon, dtype=np.float64)
+    polygon_area = _polygon_area(polygon)
+    iou = np.zeros(len(boxes), dtype=np.float64)
+    for i, box in enumerate(np.asarray(boxes, dtype=np.float64).reshape(-1, 4)):
+        box_area = (box[2] - box[0]) * (box[3] - box[1])
+        clipped = _clip_polygon(polygon, box)
+        intersection = _polygon_area(clipped) if len(clipped) >= 3 else 0.0
+        if intersection > 0:
+            iou[i] = intersection / (polygon_area + box_area - intersection)
+    return iou
+
+
+def _occupancy_polygons(polygons, table_boxes, person_boxes, is_occupied, person_count, iou_sum):
+    """Строки столов-многоугольников: пересечение считается с многоугольником, а не с его габаритами"""
+    person_center = (person_boxes[:, 0] + person_boxes[:, 2]) / 2
+    for i, polygon in enumerate(polygons):
+        if polygon is None:
+            continue
+        table_center = (table_boxes[i, 0] + table_boxes[i, 2]) / 2
+        near = np.abs(table_center - person_center) < (table_boxes[i, 2] - table_boxes[i, 0]) * DISTANCE_THRESHOLD_RATIO
+        iou = polygon_iou(polygon, person_boxes)
+        is_occupied[i] = near.any()
+        person_count[i] = (near & (iou > 0)).sum()
+        iou_sum[i] = iou.sum()
+
+
+def occupancy_arrays(table_boxes, person_boxes, method='auto', polygons=None):
+    """
+    Занятость столов по правилам пересечения и расстояния между центрами.
+    Возвращает массивы (is_occupied, person_count) длины числа столов.
+    method: 'dense' - все пары сразу, 'indexed' - пространственный индекс для
+    больших залов, 'auto' - индекс при числе пар больше DENSE_MAX_PAIRS.
+    polygons - многоугольники столов (None у прямоугольных столов), для них
+    пересечение с человеком считается по многоугольнику
+    """
+    table_boxes = np.asarray(table_boxes, dtype=np.float64).reshape(-1, 4)
+    person_boxes = np.asarray(person_boxes, dtype=np.float64).reshape(-1, 4)
+
+    if len(person_boxes) == 0 or len(table_boxes) == 0:
+        return np.zeros(len(table_boxes), dtype=bool), np.zeros(len(table_boxes), dtype=np.int64)
+
+    if method == 'auto':
+        method = 'dense' if len(table_boxes) * len(person_boxes) <= DENSE_MAX_PAIRS else 'indexed'
+    if method == 'dense':
+        is_occupied, person_count, iou_sum = _occupancy_dense(table_boxes, person_boxes)
+    elif method == 'indexed':
+        is_occupied, person_count, iou_sum = _occupancy_indexed(table_boxes, person_boxes)
+    else:
+        raise ValueError(f"Unknown occupancy method: {method}")
+    if polygons is not None:
+        _occupancy_polygons(polygons, table_boxes, person_boxes, is_occupied, person_count, iou_sum)
+
+    confirmed = (iou_sum > 0.2) | (person_count > 2) | ((iou_sum > 0.1) & (person_count > 1))
+    return is_occupied & confirmed, person_count
+
+
+def compute_occupancy(table_boxes, table_confidence, person_boxes, table_ids=None):
+    """
+    Формирование данных о столах (формат поля 'tables' результата анализа)
+    table_ids: стабильные id столов (по умолчанию - порядковые номера с 1)
+    """
+    is_occupied, person_count = occupancy_arrays(table_boxes, person_boxes)
+
+    table_boxes = np.asarray(table_boxes).reshape(-1, 4)
+    table_confidence = np.asarray(table_confidence).reshape(-1)
+
+    tables_data = []
+    for i, table_box in enumerate(table_boxes.tolist()):
+        tables_data.append({
+            'id': table_ids[i] if table_ids is not None else i + 1,
+            'bbox': table_box,
+            'status': 'occupied' if is_occupied[i] else 'free',
+            'person_count': int(person_count[i]),
+            'confidence': float(table_confidence[i]) if i < len(table_confidence) else 0.0
+        })
+    return tables_data
@@ -0,0 +1,96 @@
+import math
+
+import cv2
+import numpy as np
+
+from occupancy import iou_matrix
+
+
+# Шаг размеров входа YOLO (максимальный stride сети)
+MODEL_STRIDE = 32
+
+
+def inference_size(shape, imgsz):
+    """
+    Размер входа модели для кадра: не больше imgsz и не больше самого кадра
+    (округлённого до stride), чтобы маленькие кадры не растягивались и не дополнялись до imgsz
+    """
+    side = max(shape[:2])
+    return min(imgsz, math.ceil(side / MODEL_STRIDE) * MODEL_STRIDE)
+
+
+def downscale(image, max_side):
+    """
+    Раннее уменьшение BGR-кадра до max_side по длинной стороне - до конвертации
+    цвета, чтобы не копировать кадр в полном разрешении.
+    Возвращает (кадр, масштаб); кадры не больше max_side возвращаются как есть
+    """
+    height, width = image.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return image, 1.0
+    scale = max_side / max(height, width)
+    size = (max(round(width * scale), 1), max(round(height * scale), 1))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+
+def tile_windows(shape, tile_size, overlap=0.2):
+    """
+    Окна SAHI-нарезки (x1, y1, x2, y2) с перекрытием overlap.
+    Все окна одного размера: последнее в ряду сдвигается внутрь кадра
+    """
+    height, width = shape[:2]
+    tile_width, tile_height = min(tile_size, width), min(tile_size, height)
+
+    def starts(length, tile):
+        step = max(int(tile * (1 - overlap)), 1)
+        positions = list(range(0, max(length - tile, 0) + 1, step))
+        if positions[-1] + tile < length:
+            positions.append(length - tile)
+        return positions
+
+    return [(x, y, x + tile_width, y + tile_height)
+            for y in starts(height, tile_height) for x in starts(width, tile_width)]
+
+
+def nms(boxes, scores, iou_threshold):
+    """
+    Жадный NMS на numpy: матрица IoU считается один раз, подавление -
+    векторной операцией над строкой. Возвращает индексы оставшихся боксов
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    iou = iou_matrix(boxes[order], boxes[order])
+
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for i in range(len(order)):
+        if suppressed[i]:
+            continue
+        keep.append(order[i])
+        suppressed |= iou[i] > iou_threshold
+    return np.array(keep, dtype=np.int64)
+
+
+def to_frame_coordinates(detections, scale=1.0, offset=(0, 0)):
+    """Перенос детекций из уменьшенного кадра или окна в координаты исходного кадра"""
+    if scale == 1.0 and offset == (0, 0):
+        return detections
+    import supervision as sv
+
+    x, y = offset
+    xyxy = detections.xyxy / scale + np.array([x, y, x, y], dtype=np.float32)
+    return sv.Detections(xyxy=xyxy.astype(np.float32), confidence=detections.confidence,
+                         class_id=detections.class_id)
+
+
+def merge_detections(parts, iou_threshold):
+    """Объединение детекций окон и всего кадра (уже в координатах кадра) с NMS"""
+    import supervision as sv
+
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return sv.Detections.empty()
+    merged = sv.Detections.merge(parts)
+    if len(merged) < 2:
+        return merged
+    return merged[nms(merged.xyxy, merged.confidence, iou_threshold)]
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from history import file_lock
+
+
+# id задания - uuid4().hex
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+class ReportJobs:
+    """
+    Фоновая генерация отчётов.
+    Задание рендерится в пуле потоков в собственный файл с уникальным именем;
+    одинаковые запросы, пока задание выполняется или готово не дольше
+    dedupe_window секунд, возвращают то же задание.
+    Описание задания хранится JSON-файлом в folder/.jobs, поэтому состояние
+    видно всем воркерам gunicorn (опрос может попасть не в тот, что принял отчёт);
+    постановка и уборка идут под файловой блокировкой.
+    Готовые отчёты удаляются по TTL и при превышении общего размера папки
+    """
+
+    def __init__(self, renderers, folder='reports', workers=2, ttl=3600, max_total_bytes=500 * 1024 * 1024,
+                 dedupe_window=60):
+        # renderers: {тип отчёта: (функция render(payload, filepath), префикс имени, расширение)}
+        self.renderers = renderers
+        self.folder = os.path.abspath(folder)
+        self.jobs_folder = os.path.join(self.folder, '.jobs')
+        self.ttl = ttl
+        self.max_total_bytes = max_total_bytes
+        self.dedupe_window = dedupe_window
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report')
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def request_key(kind, payload):
+        """Ключ дедупликации: тип отчёта и содержимое запроса"""
+        body = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(f'{kind}:{body}'.encode('utf-8')).hexdigest()
+
+    @contextmanager
+    def _locked(self):
+        """Блокировка описаний заданий: между потоками и между процессами"""
+        os.makedirs(self.jobs_folder, exist_ok=True)
+        with self._lock, file_lock(self.jobs_folder + '.lock'):
+            yield
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_folder, f'{job_id}.json')
+
+    def _write(self, job):
+        # Атомарная замена: читатели из других воркеров не видят недописанный файл
+        fd, tmp_path = tempfile.mkstemp(dir=self.jobs_folder, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._job_path(job['id']))
+
+    def _read(self, job_id):
+        # id приходит из URL: принимаем только свои (uuid4.hex)
+        if not JOB_ID_PATTERN.fullmatch(job_id or ''):
+            return None
+        try:
+            with open(self._job_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _jobs(self):
+        if not os.path.isdir(self.jobs_folder):
+            return []
+        jobs = (self._read(name[:-5]) for name in os.listdir(self.jobs_folder) if name.endswith('.json'))
+        return [job for job in jobs if job is not None]
+
+    def submit(self, kind, payload):
+        """Постановка отчёта в очередь; возвращает описание задания"""
+        if kind not in self.renderers:
+            raise ValueError(f"Unknown report type: {kind}")
+
+        self.collect_garbage()
+        key = self.request_key(kind, payload)
+
+        with self._locked():
+            for job in self._jobs():
+                if job['key'] == key and (job['finished'] is None or (
+                        job['status'] == 'done' and time.time() - job['finished'] <= self.dedupe_window)):
+                    return job
+
+            _, prefix, extension = self.renderers[kind]
+            job_id = uuid.uuid4().hex
+            filename = f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{job_id[:8]}.{extension}"
+            job = {
+                'id': job_id,
+                'kind': kind,
+                'status': 'queued',
+                'filename': filename,
+                'filepath': os.path.join(self.folder, filename),
+                'error': None,
+                'created': time.time(),
+                'finished': None,
+                'size': None,
+                'key': key,
+            }
+            self._write(job)
+
+        self._executor.submit(self._render, job, payload)
+        return dict(job)
+
+    def _render(self, job, payload):
+        # Описание задания меняет только воркер, который его рендерит
+        job['status'] = 'running'
+        self._write(job)
+        render, _, _ = self.renderers[job['kind']]
+
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            render(payload, job['filepath'])
+            status, error, size = 'done', None, os.path.getsize(job['filepath'])
+        except Exception as e:
+            print(f"Error generating report: {e}")
+            status, error, size = 'failed', str(e), None
+
+        job.update({'status': status, 'error': error, 'size': size, 'finished': time.time()})
+        self._write(job)
+
+    def get(self, job_id):
+        return self._read(job_id)
+
+    def wait(self, job_id, timeout=60, poll=0.05):
+        """Ожидание завершения задания (для синхронных клиентов)"""
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+        while job is not None and job['status'] in ('queued', 'running') and time.monotonic() < deadline:
+            time.sleep(poll)
+            job = self.get(job_id)
+        return job
+
+    def _forget(self, job_id):
+        try:
+            os.remove(self._job_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def collect_garbage(self):
+        """Удаление отчётов старше TTL и самых старых, если папка превысила лимит размера"""
+        now = time.time()
+        with self._locked():
+            jobs = []
+            for job in self._jobs():
+                # Незавершённое задание старше TTL - воркер, который его рендерил, завершился
+                if now - (job['finished'] or job['created']) > self.ttl:
+                    self._forget(job['id'])
+                else:
+                    jobs.append(job)
+
+            active = {job['filepath'] for job in jobs if job['status'] in ('queued', 'running')}
+            files = []
+            for entry in os.scandir(self.folder):
+                # Служебные файлы (.jobs.lock) не трогаем
+                if entry.is_file() and not entry.name.startswith('.') and entry.path not in active:
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+            files.sort()
+            total = sum(size for _, size, _ in files)
+            by_path = {job['filepath']: job['id'] for job in jobs}
+            for mtime, size, path in files:
+                if now - mtime <= self.ttl and total <= self.max_total_bytes:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if path in by_path:
+                    self._forget(by_path[path])
+
+    @staticmethod
+    def public(job):
+        """Описание задания для ответа API (без внутренних полей)"""
+        return {key: job[key] for key in ('id', 'kind', 'status', 'filename', 'error', 'size')}
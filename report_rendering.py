@@ -0,0 +1,347 @@
+import os
+import threading
+from datetime import datetime
+from types import MappingProxyType
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.fonts import addMapping
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+
+# Проверяемые пути к шрифтам с поддержкой кириллицы
+FONT_CANDIDATES = [
+    'DejaVuSans.ttf',  # Распространённый свободный шрифт
+    'arial.ttf',  # Windows
+    'LiberationSans-Regular.ttf',  # Linux
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',  # Linux
+    'C:\\Windows\\Fonts\\arial.ttf',  # Windows
+]
+
+_fonts_lock = threading.Lock()
+_fonts_registered = None
+_templates = None
+
+
+def register_russian_fonts():
+    """
+    Регистрация шрифтов с поддержкой кириллицы.
+    Поиск и загрузка TTF выполняются один раз на процесс, дальше возвращается сохранённый результат
+    """
+    global _fonts_registered
+    if _fonts_registered is not None:
+        return _fonts_registered
+
+    with _fonts_lock:
+        if _fonts_registered is None:
+            _fonts_registered = _register_fonts()
+        return _fonts_registered
+
+
+def _register_fonts():
+    try:
+        font_path = next((font for font in FONT_CANDIDATES if os.path.exists(font)), None)
+
+        # Если шрифт не найден, используем стандартный (может не поддерживать кириллицу)
+        if font_path:
+            pdfmetrics.registerFont(TTFont('RussianFont', font_path))
+            pdfmetrics.registerFont(TTFont('RussianFont-Bold', font_path))
+            addMapping('RussianFont', 0, 0, 'RussianFont')
+            addMapping('RussianFont', 1, 0, 'RussianFont-Bold')
+            return True
+        return False
+    except Exception:
+        return False
+
+
+def _build_templates(font_registered):
+    """Стили абзацев и таблиц отчётов для выбранного шрифта"""
+    font_name = "RussianFont" if font_registered else "Helvetica"
+    bold_font_name = "RussianFont-Bold" if font_registered else "Helvetica-Bold"
+    # Без кириллического шрифта заголовки остаются в шрифтах стандартного набора
+    heading_font = {'fontName': bold_font_name} if font_registered else {}
+    text_font = {'fontName': font_name} if font_registered else {}
+
+    sample = getSampleStyleSheet()
+    styles = {
+        'RussianHeading1': ParagraphStyle(name='RussianHeading1', parent=sample['Heading1'],
+                                          fontSize=16, spaceAfter=12, **heading_font),
+        'RussianHeading2': ParagraphStyle(name='RussianHeading2', parent=sample['Heading2'],
+                                          fontSize=14, spaceAfter=8, **heading_font),
+        'RussianNormal': ParagraphStyle(name='RussianNormal', parent=sample['Normal'],
+                                        fontSize=10, **text_font),
+        'RussianMetadata': ParagraphStyle(name='RussianMetadata', parent=sample['Normal'],
+                                          fontSize=9, textColor=colors.grey, **text_font),
+        'Footer': ParagraphStyle(name='Footer', parent=sample['Normal'], fontName=font_name,
+                                 fontSize=8, textColor=colors.grey, alignment=TA_CENTER),
+    }
+
+    table_styles = {
+        'summary': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4A6572')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), bold_font_name),
+            ('FONTSIZE', (0, 0), (-1, 0), 11),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#F0F0F0')),
+            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#CCCCCC')),
+            ('FONTNAME', (0, 1), (-1, -1), font_name),
+        ]),
+        'tables': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#5D9CEC')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#DDDDDD')),
+            ('FONTNAME', (0, 0), (-1, 0), bold_font_name),
+            ('FONTNAME', (0, 1), (-1, -1), font_name),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('ALIGN', (0, 0), (0, -1), 'CENTER'),
+            ('ALIGN', (2, 0), (2, -1), 'CENTER'),
+            ('ALIGN', (3, 0), (3, -1), 'CENTER'),
+        ]),
+        'people': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#FFCE54')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#333333')),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#DDDDDD')),
+            ('FONTNAME', (0, 0), (-1, 0), bold_font_name),
+            ('FONTNAME', (0, 1), (-1, -1), font_name),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('ALIGN', (0, 0), (0, -1), 'CENTER'),
+            ('ALIGN', (1, 0), (1, -1), 'CENTER'),
+        ]),
+    }
+
+    # Шаблоны общие для всех запросов и потоков, поэтому отдаются только на чтение
+    return MappingProxyType({
+        'font_registered': font_registered,
+        'font_name': font_name,
+        'styles': MappingProxyType(styles),
+        'table_styles': MappingProxyType(table_styles),
+    })
+
+
+def report_templates():
+    """Готовые стили отчётов (строятся один раз, после регистрации шрифтов)"""
+    global _templates
+    if _templates is not None:
+        return _templates
+
+    font_registered = register_russian_fonts()
+    with _fonts_lock:
+        if _templates is None:
+            _templates = _build_templates(font_registered)
+        return _templates
+
+
+def render_pdf_report(data, filepath):
+    """Генерация PDF отчета"""
+    templates = report_templates()
+    font_name = templates['font_name']
+
+    c = canvas.Canvas(filepath, pagesize=A4)
+
+    # Устанавливаем шрифт с поддержкой кириллицы (или Helvetica, если он не найден)
+    c.setFont(font_name, 16)
+    c.drawString(50, 800, "Отчет по анализу использования столов в кафе")
+
+    c.setFont(font_name, 12)
+    c.drawString(50, 750, f"Дата генерации: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    if 'data' in data:
+        stats = data['data']
+        c.drawString(50, 700, f"Проанализировано столов: {stats.get('tables_found', 0)}")
+        c.drawString(50, 680, f"Обнаружено людей: {stats.get('people_found', 0)}")
+        c.drawString(50, 660, f"Загруженность: {stats.get('occupancy_rate', 0) * 100:.1f}%")
+
+        # Добавляем информацию о людях
+        c.drawString(50, 630, "Детализация по людям:")
+        y_pos = 610
+        if 'people' in stats and stats['people']:
+            for person in stats['people'][:10]:
+                c.drawString(70, y_pos,
+                             f"Человек {person.get('id', '')}: уверенность {person.get('confidence', 0) * 100:.1f}%")
+                y_pos -= 20
+                if y_pos < 50:
+                    break
+
+    c.save()
+
+
+def render_summary_pdf_report(data, filepath):
+    """Генерация PDF отчета со сводной статистикой по уже подготовленным данным"""
+    templates = report_templates()
+    font_registered = templates['font_registered']
+    styles = templates['styles']
+    table_styles = templates['table_styles']
+
+    doc = SimpleDocTemplate(filepath, pagesize=A4)
+    elements = []
+
+    # Заголовок отчета
+    if font_registered:
+        elements.append(Paragraph("Сводный отчет по использованию столов в кафе", styles['RussianHeading1']))
+    else:
+        elements.append(Paragraph("Cafe Table Usage Summary Report", styles['RussianHeading1']))
+
+    elements.append(Spacer(1, 12))
+
+    if 'data' in data:
+        stats = data['data']
+
+        # Основная информация
+        if font_registered:
+            elements.append(Paragraph(f"<b>Период:</b> {data.get('period', 'текущий')}", styles['RussianNormal']))
+            elements.append(Paragraph(f"<b>Сгенерировано:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                      styles['RussianNormal']))
+            elements.append(
+                Paragraph(f"<b>Количество анализов:</b> {stats.get('total_analyses', 1)}", styles['RussianNormal']))
+        else:
+            elements.append(Paragraph(f"<b>Period:</b> {data.get('period', 'current')}", styles['RussianNormal']))
+            elements.append(
+                Paragraph(f"<b>Generated:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['RussianNormal']))
+            elements.append(
+                Paragraph(f"<b>Number of analyses:</b> {stats.get('total_analyses', 1)}", styles['RussianNormal']))
+
+        elements.append(Spacer(1, 20))
+
+        # Статистика
+        if font_registered:
+            table_data = [
+                ['Показатель', 'Значение'],
+                ['Всего столов обнаружено', stats.get('tables_found', 0)],
+                ['Всего людей обнаружено', stats.get('people_found', 0)],
+                ['Общая загруженность', f"{stats.get('occupancy_rate', 0) * 100:.1f}%"],
+                ['Среднее столов на анализ', f"{stats.get('avg_tables_per_analysis', 0):.1f}"],
+                ['Среднее людей на анализ', f"{stats.get('avg_people_per_analysis', 0):.1f}"]
+            ]
+        else:
+            table_data = [
+                ['Metric', 'Value'],
+                ['Total tables detected', stats.get('tables_found', 0)],
+                ['Total people detected', stats.get('people_found', 0)],
+                ['Overall occupancy rate', f"{stats.get('occupancy_rate', 0) * 100:.1f}%"],
+                ['Average tables per analysis', f"{stats.get('avg_tables_per_analysis', 0):.1f}"],
+                ['Average people per analysis', f"{stats.get('avg_people_per_analysis', 0):.1f}"]
+            ]
+
+        table = Table(table_data, colWidths=[200, 100])
+        table.setStyle(table_styles['summary'])
+
+        elements.append(table)
+        elements.append(Spacer(1, 25))
+
+        # Подробная таблица столов (если есть)
+        if 'tables' in stats and stats['tables']:
+            if font_registered:
+                elements.append(Paragraph("Детализация по столам:", styles['RussianHeading2']))
+                tables_data = [['ID', 'Статус', 'Людей', 'Уверенность', 'Время анализа']]
+            else:
+                elements.append(Paragraph("Tables Details:", styles['RussianHeading2']))
+                tables_data = [['ID', 'Status', 'People', 'Confidence', 'Analysis Time']]
+
+            elements.append(Spacer(1, 5))
+
+            for table in stats['tables'][:20]:  # Ограничиваем 20 записями
+                if font_registered:
+                    status_text = 'Занят' if table.get('status') == 'occupied' else 'Свободен'
+                else:
+                    status_text = 'Occupied' if table.get('status') == 'occupied' else 'Free'
+
+                tables_data.append([
+                    table.get('id', ''),
+                    status_text,
+                    table.get('person_count', 0),
+                    f"{table.get('confidence', 0) * 100:.1f}%",
+                    table.get('analysis_time', '')[:19] if table.get('analysis_time') else ''
+                ])
+
+            if len(stats['tables']) > 20:
+                if font_registered:
+                    tables_data.append(['', f'... и еще {len(stats["tables"]) - 20} записей', '', '', ''])
+                else:
+                    tables_data.append(['', f'... and {len(stats["tables"]) - 20} more', '', '', ''])
+
+            tables_table = Table(tables_data, colWidths=[40, 60, 50, 70, 110])
+            tables_table.setStyle(table_styles['tables'])
+
+            elements.append(tables_table)
+            elements.append(Spacer(1, 20))
+
+        # Подробная таблица людей (если есть)
+        if 'people' in stats and stats['people']:
+            if font_registered:
+                elements.append(Paragraph("Детализация по людям:", styles['RussianHeading2']))
+                people_data = [['ID', 'Уверенность', 'Координаты', 'Время анализа']]
+            else:
+                elements.append(Paragraph("People Details:", styles['RussianHeading2']))
+                people_data = [['ID', 'Confidence', 'Coordinates', 'Analysis Time']]
+
+            elements.append(Spacer(1, 5))
+
+            for person in stats['people'][:15]:  # Ограничиваем 15 записями
+                bbox = person.get('bbox', [0, 0, 0, 0])
+                people_data.append([
+                    person.get('id', ''),
+                    f"{person.get('confidence', 0) * 100:.1f}%",
+                    f"[{bbox[0]:.0f},{bbox[1]:.0f},{bbox[2]:.0f},{bbox[3]:.0f}]",
+                    person.get('analysis_time', '')[:19] if person.get('analysis_time') else ''
+                ])
+
+            if len(stats['people']) > 15:
+                if font_registered:
+                    people_data.append(['', f'... и еще {len(stats["people"]) - 15} записей', '', ''])
+                else:
+                    people_data.append(['', f'... and {len(stats["people"]) - 15} more', '', ''])
+
+            people_table = Table(people_data, colWidths=[30, 70, 110, 110])
+            people_table.setStyle(table_styles['people'])
+
+            elements.append(people_table)
+            elements.append(Spacer(1, 20))
+
+        # Сводная информация
+        if font_registered:
+            elements.append(Paragraph("Сводная информация:", styles['RussianHeading2']))
+
+            summary_elements = []
+            if stats.get('period_start'):
+                summary_elements.append(f"Начало периода: {stats['period_start'][:19]}")
+            if stats.get('period_end'):
+                summary_elements.append(f"Конец периода: {stats['period_end'][:19]}")
+            if stats.get('summary'):
+                summary_elements.append(f"Описание: {stats['summary']}")
+        else:
+            elements.append(Paragraph("Summary Information:", styles['RussianHeading2']))
+
+            summary_elements = []
+            if stats.get('period_start'):
+                summary_elements.append(f"Period start: {stats['period_start'][:19]}")
+            if stats.get('period_end'):
+                summary_elements.append(f"Period end: {stats['period_end'][:19]}")
+            if stats.get('summary'):
+                summary_elements.append(f"Description: {stats['summary']}")
+
+        for item in summary_elements:
+            elements.append(Paragraph(f"• {item}", styles['RussianMetadata']))
+
+    else:
+        if font_registered:
+            elements.append(Paragraph("Данные для отчета не предоставлены.", styles['RussianNormal']))
+        else:
+            elements.append(Paragraph("No data provided for the report.", styles['RussianNormal']))
+
+    # Подвал с информацией о системе
+    elements.append(Spacer(1, 30))
+    if font_registered:
+        footer_text = f"Отчет сгенерирован системой AI Cafe Analytics • {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+    else:
+        footer_text = f"Report generated by AI Cafe Analytics • {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+
+    elements.append(Paragraph(footer_text, styles['Footer']))
+
+    doc.build(elements)
@@ -0,0 +1,103 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def content_hash(data):
+    """Хэш содержимого загруженного файла"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def perceptual_hash(image):
+    """64-битный разностный хэш (dHash) кадра: устойчив к шуму и перекодированию JPEG"""
+    gray = cv2.cvtColor(cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class ResultCache:
+    """
+    LRU-кэш результатов анализа с TTL.
+    Ключ - точный хэш содержимого; дополнительно можно искать почти
+    одинаковые кадры по перцептивному хэшу с порогом расстояния Хэмминга.
+    Ключи разделены по пространствам имён (например, по камерам)
+    """
+
+    def __init__(self, max_entries=256, ttl=300, phash_distance=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.phash_distance = phash_distance
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.phash_hits = 0
+        self.misses = 0
+
+    def _alive(self, entry, now):
+        return not self.ttl or now - entry['stored_at'] <= self.ttl
+
+    def get(self, namespace, key):
+        """Поиск по точному хэшу содержимого"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None and self._alive(entry, now):
+                self._entries.move_to_end((namespace, key))
+                self.hits += 1
+                return entry['results']
+            if entry is not None:
+                del self._entries[(namespace, key)]
+            return None
+
+    def get_similar(self, namespace, phash):
+        """Поиск почти одинакового кадра по перцептивному хэшу"""
+        if self.phash_distance is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_distance = None, None
+            for entry_key, entry in self._entries.items():
+                if entry_key[0] != namespace or entry['phash'] is None or not self._alive(entry, now):
+                    continue
+                distance = (entry['phash'] ^ phash).bit_count()
+                if distance <= self.phash_distance and (best_distance is None or distance < best_distance):
+                    best_key, best_distance = entry_key, distance
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self.phash_hits += 1
+            return self._entries[best_key]['results']
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(self, namespace, key, results, phash=None):
+        with self._lock:
+            self._entries[(namespace, key)] = {'results': results, 'phash': phash, 'stored_at': time.monotonic()}
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.phash_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'phash_distance': self.phash_distance,
+                'hits': self.hits,
+                'phash_hits': self.phash_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.phash_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,170 @@
+import importlib.util
+import json
+import struct
+
+import numpy as np
+
+
+# Форматы ответа с результатом анализа (выбираются по заголовку Accept).
+# JSON - по умолчанию; MessagePack требует необязательного пакета msgpack
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+PACKED_MIMETYPE = 'application/vnd.cafe.packed'
+RESULT_FORMATS = (JSON_MIMETYPE, MSGPACK_MIMETYPE, PACKED_MIMETYPE)
+
+# Компактные типы колонок для бинарных форматов: все по 4 байта, little-endian
+PACKED_DTYPES = {
+    'table_id': '<i4',
+    'table_bbox': '<f4',
+    'table_occupied': '<u4',
+    'table_person_count': '<i4',
+    'table_confidence': '<f4',
+    'table_dwell_seconds': '<f4',
+    'person_bbox': '<f4',
+    'person_confidence': '<f4',
+}
+
+
+class FrameResult:
+    """
+    Результат анализа кадра в виде колонок: массивы боксов, уверенностей,
+    статусов и числа людей по столам и людям вместо списка словарей.
+    Словарь формата API (to_dict) строится только при выдаче наружу.
+    table_dwell - время занятости столов (только при трекинге камеры),
+    extra - дополнительные поля верхнего уровня
+    """
+
+    __slots__ = ('timestamp', 'image_size', 'table_ids', 'table_boxes', 'table_confidence', 'table_occupied',
+                 'table_person_count', 'table_dwell', 'person_boxes', 'person_confidence', 'extra')
+
+    def __init__(self, timestamp, image_size, table_ids, table_boxes, table_confidence, table_occupied,
+                 table_person_count, person_boxes, person_confidence, table_dwell=None, extra=None):
+        self.timestamp = timestamp
+        self.image_size = image_size
+        self.table_ids = np.asarray(table_ids, dtype=np.int64).reshape(-1)
+        # Тип боксов и уверенностей сохраняется (float32 у детекций), чтобы to_dict давал те же числа
+        self.table_boxes = np.asarray(table_boxes).reshape(-1, 4)
+        self.table_confidence = np.asarray(table_confidence).reshape(-1)
+        self.table_occupied = np.asarray(table_occupied, dtype=bool).reshape(-1)
+        self.table_person_count = np.asarray(table_person_count, dtype=np.int64).reshape(-1)
+        self.table_dwell = None if table_dwell is None else np.asarray(table_dwell, dtype=np.float64).reshape(-1)
+        self.person_boxes = np.asarray(person_boxes).reshape(-1, 4)
+        self.person_confidence = np.asarray(person_confidence).reshape(-1)
+        self.extra = dict(extra or {})
+
+    @property
+    def tables_found(self):
+        return len(self.table_ids)
+
+    @property
+    def people_found(self):
+        return len(self.person_boxes)
+
+    @property
+    def occupancy_rate(self):
+        return int(self.table_occupied.sum()) / max(self.tables_found, 1)
+
+    def replace(self, **changes):
+        """Копия с изменёнными полями (массивы общие, они не изменяются)"""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return FrameResult(**values)
+
+    def to_dict(self):
+        """Словарь формата ответа /api/analyze и записей истории"""
+        dwell = self.table_dwell.tolist() if self.table_dwell is not None else None
+        tables = []
+        for i, (table_id, bbox, occupied, person_count, confidence) in enumerate(zip(
+                self.table_ids.tolist(), self.table_boxes.tolist(), self.table_occupied.tolist(),
+                self.table_person_count.tolist(), self.table_confidence.tolist())):
+            table = {
+                'id': table_id,
+                'bbox': bbox,
+                'status': 'occupied' if occupied else 'free',
+                'person_count': person_count,
+                'confidence': float(confidence),
+            }
+            if dwell is not None:
+                table['dwell_seconds'] = dwell[i]
+            tables.append(table)
+
+        people = [{'id': i + 1, 'bbox': bbox, 'confidence': float(confidence)}
+                  for i, (bbox, confidence) in enumerate(zip(self.person_boxes.tolist(),
+                                                             self.person_confidence.tolist()))]
+        return {
+            'timestamp': self.timestamp,
+            'tables_found': self.tables_found,
+            'people_found': self.people_found,
+            'tables': tables,
+            'people': people,
+            'occupancy_rate': self.occupancy_rate,
+            'image_size': self.image_size,
+            **self.extra,
+        }
+
+    def columns(self):
+        """Колонки в компактных типах PACKED_DTYPES (боксы - плоско, x1, y1, x2, y2 подряд)"""
+        columns = {
+            'table_id': self.table_ids,
+            'table_bbox': self.table_boxes.reshape(-1),
+            'table_occupied': self.table_occupied,
+            'table_person_count': self.table_person_count,
+            'table_confidence': self.table_confidence,
+            'person_bbox': self.person_boxes.reshape(-1),
+            'person_confidence': self.person_confidence,
+        }
+        if self.table_dwell is not None:
+            columns['table_dwell_seconds'] = self.table_dwell
+        return {name: np.ascontiguousarray(values, dtype=PACKED_DTYPES[name]) for name, values in columns.items()}
+
+    def header(self):
+        """Скалярные поля для бинарных форматов"""
+        return {
+            'timestamp': self.timestamp,
+            'tables_found': self.tables_found,
+            'people_found': self.people_found,
+            'occupancy_rate': self.occupancy_rate,
+            'image_size': self.image_size,
+            **self.extra,
+        }
+
+
+def encode_packed(result):
+    """
+    Упакованный формат: uint32 LE длина заголовка, JSON-заголовок (скалярные поля и
+    'arrays': {колонка: [dtype, число элементов, смещение]}) с выравниванием до 4 байт,
+    затем колонки подряд. Смещения отсчитываются от начала данных после заголовка
+    """
+    columns = result.columns()
+    arrays, offset = {}, 0
+    for name, values in columns.items():
+        arrays[name] = [values.dtype.str, int(values.size), offset]
+        offset += values.nbytes
+
+    header = json.dumps(dict(result.header(), arrays=arrays), ensure_ascii=False).encode('utf-8')
+    header += b' ' * (-len(header) % 4)
+    return b''.join([struct.pack('<I', len(header)), header, *(values.tobytes() for values in columns.values())])
+
+
+def encode_msgpack(result):
+    """MessagePack: скалярные поля и колонки списками (числа с плавающей точкой - float32)"""
+    import msgpack
+
+    payload = dict(result.header(), columns={name: values.tolist() for name, values in result.columns().items()})
+    return msgpack.packb(payload, use_single_float=True)
+
+
+def available_formats():
+    """Форматы, которые можно выдать в этом окружении (JSON - первым, он по умолчанию)"""
+    if importlib.util.find_spec('msgpack') is None:
+        return [JSON_MIMETYPE, PACKED_MIMETYPE]
+    return list(RESULT_FORMATS)
+
+
+def encode_result(result, mimetype):
+    """Тело ответа в бинарном формате"""
+    if mimetype == PACKED_MIMETYPE:
+        return encode_packed(result)
+    if mimetype == MSGPACK_MIMETYPE:
+        return encode_msgpack(result)
+    raise ValueError(f"Unknown result format: {mimetype}")
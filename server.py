@@ -1,38 +1,136 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
-import cv2
-import numpy as np
-import json
+import gzip
+import hashlib
 import os
-from datetime import datetime
-import pandas as pd
-from werkzeug.utils import secure_filename
-import torch
-from ultralytics import YOLO
-import supervision as sv
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.fonts import addMapping
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from functools import partial
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from detection import DetectorRegistry, DETECTOR_ROLES
+from occupancy import occupancy_arrays
+from batching import BatchScheduler
+from report_jobs import ReportJobs
+from history import create_history_store, file_lock, migrate_json_history, time_bound
+from stats import GRANULARITIES, StatsStore
+from streaming import MAX_FPS as STREAM_MAX_FPS_LIMIT, MIN_FPS as STREAM_MIN_FPS, STREAM_SCHEMES, StreamManager
+from tracking import TableTracker, TrackingSessions
+from layouts import LayoutStore, crop_region, layout_boxes, layout_polygons, layout_version
+from cameras import CameraScheduler, CameraStore, fetch_snapshot
+from metrics import MetricsRegistry
+from preprocess import downscale, merge_detections, tile_windows, to_frame_coordinates
+from ingest import (ImageTooLarge, archive_images, decode_image, decode_upload, detach_upload, is_zip, load_upload_from_disk,
+                    read_upload, resolve_source, rgb_frame)
+from result_cache import ResultCache, content_hash, perceptual_hash
+from results import JSON_MIMETYPE, FrameResult, available_formats, encode_result
+from exports import EXPORT_COLUMNS, EXPORT_FORMATS, export_available, export_filename, stream_export
 
 
 app = Flask(__name__)
-CORS(app)
+# ETag и служебные заголовки должны быть доступны скрипту страницы с другого origin
+CORS(app, expose_headers=['ETag', 'X-Total-Count', 'X-Cache'])
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
-
-# Загрузка предобученных моделей
-person_model = YOLO('models/yolov8n.pt')
-table_model = YOLO('models/yolov8n.pt')
+app.config['MAX_IMAGE_PIXELS'] = 50_000_000  # Изображения больше отклоняются до декодирования
+app.config['SAVE_UPLOADS'] = False  # Отладка: сохранять загрузки в UPLOAD_FOLDER вместо декодирования в памяти
+app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND', 'torch')  # torch, onnx, onnx-int8, openvino...
+app.config['INFERENCE_BATCH_SIZE'] = 8  # Максимальный размер батча для параллельных запросов
+app.config['INFERENCE_MAX_WAIT_MS'] = 5  # Сколько ждать добора батча после первого кадра
+app.config['INFERENCE_IMGSZ'] = 640  # Размер входа модели
+app.config['INFERENCE_ADAPTIVE_SIZE'] = True  # Маленькие кадры обрабатываются в своём размере, без растяжения до IMGSZ
+app.config['INFERENCE_MAX_SIDE'] = 640  # Кадры больше уменьшаются ещё до конвертации цвета (None - не уменьшать)
+app.config['INFERENCE_TILING'] = False  # SAHI-нарезка очень больших кадров на перекрывающиеся окна
+app.config['TILING_MIN_SIDE'] = 1600  # ...с длинной стороной не меньше этой
+app.config['TILE_SIZE'] = 640
+app.config['TILE_OVERLAP'] = 0.2
+app.config['STREAM_MAX_FPS'] = 5  # Ограничение частоты анализа кадров видеопотока
+app.config['MAX_STREAMS'] = 32
+app.config['MEDIA_DIR'] = 'media'  # Видеофайлы и снимки, которые клиент может указать источником потока или камеры
+app.config['SOURCE_ALLOWED_HOSTS'] = None  # Хосты источников-URL (None - любые, кроме адресов самого сервера)
+app.config['WORKER_PROCESSES'] = 1  # Число процессов сервера (задаёт wsgi.create_app)
+app.config['TABLE_REDETECT_EVERY'] = 30  # Для камер с camera_id столы детектируются раз в N кадров
+app.config['SCENE_CHANGE_THRESHOLD'] = 12.0  # ...или при среднем изменении уменьшенного кадра больше порога
+app.config['TRACKING_SESSION_TTL'] = 600  # Секунды бездействия, после которых состояние камеры сбрасывается
+app.config['MOTION_GATING'] = os.environ.get('MOTION_GATING', '1') != '0'  # Без движения в кадре камеры модель не запускается
+app.config['MOTION_THRESHOLD'] = 0.005  # Доля изменившихся пикселей уменьшенного кадра, ниже которой сцена статична
+app.config['MOTION_PIXEL_THRESHOLD'] = 25  # Изменение яркости пикселя, которое считается движением
+app.config['MOTION_MAX_REUSE_SECONDS'] = 10  # Даже на статичной сцене модель запускается не реже
+app.config['MOTION_REGION_DETECTION'] = False  # При небольшом изменении искать людей только в изменившейся области
+app.config['MOTION_REGION_MAX_AREA'] = 0.25  # ...если она (с запасом) не больше этой доли кадра
+app.config['MOTION_REGION_MARGIN'] = 0.5  # Запас вокруг изменившейся области в долях её размера
+app.config['RESULT_CACHE_SIZE'] = 256  # Сколько результатов анализа держать в кэше
+app.config['RESULT_CACHE_TTL'] = 300  # Секунды
+app.config['RESULT_CACHE_PHASH_DISTANCE'] = None  # Порог расстояния Хэмминга dHash для почти одинаковых кадров (None - выкл.)
+app.config['TABLE_LAYOUTS_PATH'] = 'table_layouts.json'  # Статические схемы столов по камерам
+app.config['LAYOUT_CROP_PERSONS'] = False  # Со схемой искать людей только в области вокруг столов
+app.config['LAYOUT_CROP_MARGIN'] = 1.0  # Расширение области на размер стола в каждую сторону
+app.config['BATCH_MAX_CONTENT_LENGTH'] = 512 * 1024 * 1024  # Пакетная загрузка (много файлов или ZIP)
+app.config['BATCH_MAX_FILES'] = 10_000
+app.config['BATCH_WORKERS'] = 8  # Потоки декодирования; их кадры планировщик собирает в общие батчи
+app.config['BATCH_HISTORY_CHUNK'] = 1000  # Сколько результатов пакета пишется в историю одной транзакцией
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') != '0'  # Метрики для /metrics
+app.config['CAMERAS_PATH'] = 'cameras.json'  # Камеры, которые сервер опрашивает сам
+app.config['CAMERA_POLLING'] = os.environ.get('CAMERA_POLLING', '1') != '0'
+app.config['CAMERA_MAX_IN_FLIGHT'] = 4  # Одновременно опрашиваемых камер
+app.config['CAMERA_SATURATION_QUEUE'] = 16  # При такой очереди инференса опрос камер замедляется
+
+# Метрики: время этапов, счётчики детекций/кэша/ошибок, гистограммы задержки и батчей
+metrics = MetricsRegistry(enabled=app.config['METRICS_ENABLED'])
+request_seconds = metrics.histogram('http_request_duration_seconds', 'Время обработки HTTP-запроса')
+requests_total = metrics.counter('http_requests_total', 'HTTP-запросы по эндпоинту и статусу')
+detections_total = metrics.counter('detections_total', 'Найденные объекты по ролям')
+analyses_total = metrics.counter('analyses_total', 'Выполненные анализы кадров')
+cache_requests_total = metrics.counter('result_cache_requests_total', 'Обращения к кэшу результатов')
+errors_total = metrics.counter('errors_total', 'Ошибки обработки по видам')
+batch_size = metrics.histogram('inference_batch_size', 'Размер батча инференса', buckets=(1, 2, 4, 8, 16, 32, 64))
+batch_seconds = metrics.histogram('inference_batch_duration_seconds', 'Время батчевого вызова модели')
+motion_frames_total = metrics.counter('motion_frames_total', 'Кадры камер по решению детектора движения')
+
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.url_rule is not None:
+        endpoint = request.url_rule.rule
+        metrics.observe(request_seconds, time.perf_counter() - started, endpoint=endpoint)
+        metrics.inc(requests_total, endpoint=endpoint, status=response.status_code)
+    return response
+
+
+# Реестр детекторов: общий файл весов для людей и столов загружается один раз
+detectors = DetectorRegistry(DETECTOR_ROLES, backend=app.config['INFERENCE_BACKEND'],
+                             imgsz=app.config['INFERENCE_IMGSZ'], adaptive_size=app.config['INFERENCE_ADAPTIVE_SIZE'])
+
+# Фоновый планировщик: кадры параллельных запросов объединяются в батчи
+scheduler = BatchScheduler(
+    detectors.detect_batch,
+    max_batch_size=app.config['INFERENCE_BATCH_SIZE'],
+    max_wait_ms=app.config['INFERENCE_MAX_WAIT_MS'],
+    on_batch=lambda size, seconds: (metrics.observe(batch_size, size), metrics.observe(batch_seconds, seconds)),
+    role_weights={name: role['weights'] for name, role in DETECTOR_ROLES.items()},
+)
+
+
+# Готовность к обслуживанию запросов: модели загружены и прогреты
+readiness = {'ready': False, 'loading': False, 'warmup_ms': None, 'pid': os.getpid()}
+_warmup_thread = None
+_warmup_lock = threading.Lock()
 
 
 def load_models():
-    global person_model, table_model
     try:
-        # YOLOv8 для детектирования людей
-        person_model = YOLO('models/yolov8n.pt')
-
-        # YOLOv8 для детектирования столов
-        table_model = YOLO('models/yolov8n.pt')
+        # YOLOv8 для детектирования людей и столов
+        detectors.load()
 
         print("Модели загружены успешно")
         return True
@@ -41,93 +139,324 @@ def load_models():
         return False
 
 
-# База данных для хранения истории
-HISTORY_FILE = 'analysis_history.json'
-
-
-def save_to_history(data):
-    """Сохранение результатов в JSON файл"""
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, 'r') as f:
-            history = json.load(f)
-    else:
-        history = []
+def warmup_models(size=640):
+    """Загрузка моделей и прогревочный инференс на пустом кадре"""
+    started = time.perf_counter()
+    if not load_models():
+        return False
+    detectors.detect(np.zeros((size, size, 3), dtype=np.uint8))
+    readiness.update({'ready': True, 'warmup_ms': (time.perf_counter() - started) * 1000, 'pid': os.getpid()})
+    return True
 
-    history.append({
-        'timestamp': datetime.now().isoformat(),
-        'data': data
-    })
 
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(history[-100:], f, indent=2)  # Храним 100 последних записей
+def start_warmup(size=640, prepare=None):
+    """
+    Загрузка и прогрев моделей в фоновом потоке (один раз на процесс).
+    Сервер и /health отвечают сразу; запросы анализа до готовности ждут
+    загрузки под замком реестра детекторов. prepare выполняется в том же
+    потоке до загрузки (например, настройка потоков torch)
+    """
+    global _warmup_thread
 
+    def run():
+        readiness.update({'loading': True, 'pid': os.getpid()})
+        try:
+            if prepare is not None:
+                prepare()
+            warmup_models(size)
+        finally:
+            readiness['loading'] = False
 
-def register_russian_fonts():
-    """Регистрация шрифтов с поддержкой кириллицы"""
-    try:
-        # Путь к шрифту (можно использовать стандартные или добавить свой)
-        font_path = None
-
-        # Проверяем доступные системные шрифты
-        possible_fonts = [
-            'DejaVuSans.ttf',  # Распространённый свободный шрифт
-            'arial.ttf',  # Windows
-            'LiberationSans-Regular.ttf',  # Linux
-            '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',  # Linux
-            'C:\\Windows\\Fonts\\arial.ttf',  # Windows
-        ]
-
-        for font in possible_fonts:
-            if os.path.exists(font):
-                font_path = font
-                break
-
-        # Если шрифт не найден, используем стандартный (может не поддерживать кириллицу)
-        if font_path:
-            pdfmetrics.registerFont(TTFont('RussianFont', font_path))
-            pdfmetrics.registerFont(TTFont('RussianFont-Bold', font_path))
-            addMapping('RussianFont', 0, 0, 'RussianFont')
-            addMapping('RussianFont', 1, 0, 'RussianFont-Bold')
-            return True
-        return False
-    except Exception:
-        return False
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=run, name='model-warmup', daemon=True)
+            _warmup_thread.start()
+        return _warmup_thread
 
 
-def calculate_iou(box1, box2, epsilon=1e-6):
+# База данных для хранения истории
+HISTORY_FILE = 'analysis_history.json'  # Старый формат, переносится в хранилище при первом обращении
+app.config['HISTORY_BACKEND'] = 'sqlite'  # 'sqlite' или 'jsonl'
+app.config['HISTORY_PATH'] = 'analysis_history.db'
+app.config['HISTORY_RETENTION'] = 100_000  # Сколько последних записей хранить
+
+app.config['REPORTS_FOLDER'] = 'reports'
+app.config['REPORT_WORKERS'] = 2  # Потоки фоновой генерации отчётов
+app.config['REPORT_TTL'] = 3600  # Готовые отчёты хранятся час
+app.config['REPORTS_MAX_BYTES'] = 500 * 1024 * 1024  # ...и не больше 500 МБ в сумме
+app.config['STATS_PATH'] = 'analysis_stats.db'  # Предагрегированная статистика по минутам/часам/дням
+app.config['HISTORY_GZIP_MIN_BYTES'] = 1024  # Ответы истории больше сжимаются gzip, если клиент его принимает (None - выкл.)
+
+history_store = None
+stats_store = None
+history_store_lock = threading.Lock()
+
+
+def get_history_store():
+    """Хранилище истории (создаётся при первом обращении, с переносом старого JSON-файла)"""
+    global history_store
+    with history_store_lock:
+        if history_store is None:
+            history_store = create_history_store(app.config['HISTORY_BACKEND'], app.config['HISTORY_PATH'],
+                                                 app.config['HISTORY_RETENTION'])
+            migrated = migrate_json_history(HISTORY_FILE, history_store)
+            if migrated:
+                print(f"Перенесено записей истории из {HISTORY_FILE}: {migrated}")
+        return history_store
+
+
+def get_stats_store():
+    """Хранилище агрегатов (один раз на все процессы заполняется по уже накопленной истории)"""
+    global stats_store
+    history = get_history_store()
+    with history_store_lock:
+        if stats_store is None:
+            store = StatsStore(app.config['STATS_PATH'])
+            # Проверка и заполнение под блокировкой файла: второй процесс ждёт и видит отметку о завершении.
+            # Прерванное заполнение не отмечено и при следующем запуске повторяется с нуля
+            with file_lock(app.config['STATS_PATH'] + '.lock'):
+                if store.get_meta('backfilled') is None:
+                    store.clear()
+                    for entries in chunked(history.iter_entries(), 1000):
+                        store.record_many([(entry['data'], entry['data'].get('camera_id'), entry['timestamp'])
+                                           for entry in entries])
+                    store.set_meta('backfilled', datetime.now().isoformat())
+            stats_store = store
+        return stats_store
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def save_to_history(data, camera_id=None):
+    """Сохранение результатов в хранилище истории и в агрегаты статистики"""
+    return save_many_to_history([(data, camera_id)])[0]
+
+
+def save_many_to_history(items):
+    """Сохранение пачки результатов [(data, camera_id), ...] одной транзакцией; возвращает id записей"""
+    stats = get_stats_store()
+    # Камера сохраняется в записи, чтобы выгрузки и пересчёт агрегатов могли по ней фильтровать
+    with metrics.span('history'):
+        entry_ids = get_history_store().append_many([dict(data, camera_id=camera_id) if camera_id else data
+                                                     for data, camera_id in items])
+        stats.record_many([(data, camera_id, None) for data, camera_id in items])
+    return entry_ids
+
+
+# Кэш результатов для повторно присланных и почти одинаковых кадров
+result_cache = ResultCache(
+    max_entries=app.config['RESULT_CACHE_SIZE'],
+    ttl=app.config['RESULT_CACHE_TTL'],
+    phash_distance=app.config['RESULT_CACHE_PHASH_DISTANCE'],
+)
+
+# Статические схемы столов по камерам
+table_layouts = LayoutStore(app.config['TABLE_LAYOUTS_PATH'])
+
+# Состояние трекинга столов по камерам
+tracking_sessions = TrackingSessions(
+    ttl=app.config['TRACKING_SESSION_TTL'],
+    redetect_every=app.config['TABLE_REDETECT_EVERY'],
+    scene_change_threshold=app.config['SCENE_CHANGE_THRESHOLD'],
+)
+
+
+def create_tracker():
+    return TableTracker(redetect_every=app.config['TABLE_REDETECT_EVERY'],
+                        scene_change_threshold=app.config['SCENE_CHANGE_THRESHOLD'])
+
+
+def detect_frame(image, role_names=None):
     """
-    Calculate Intersection over Union (IoU) for two bounding boxes
-    Формат: [x_min, y_min, x_max, y_max]
-    epsilon: маленькое значение для избежания деления на ноль
+    Детекция на BGR-кадре любого размера: раннее уменьшение до INFERENCE_MAX_SIDE,
+    а для очень больших кадров (с INFERENCE_TILING) - ещё и детекция по окнам
+    с объединением через NMS. Детекции возвращаются в координатах исходного кадра
     """
-    # Проверка на валидность bounding boxes
-    if box1[2] <= box1[0] or box1[3] <= box1[1]:
-        return 0.0
-    if box2[2] <= box2[0] or box2[3] <= box2[1]:
-        return 0.0
-
-    # Координаты пересечения
-    x1 = max(box1[0], box2[0])
-    y1 = max(box1[1], box2[1])
-    x2 = min(box1[2], box2[2])
-    y2 = min(box1[3], box2[3])
+    tiles = []
+    if app.config['INFERENCE_TILING'] and max(image.shape[:2]) >= app.config['TILING_MIN_SIDE']:
+        tiles = tile_windows(image.shape, app.config['TILE_SIZE'], app.config['TILE_OVERLAP'])
+    with metrics.span('downscale'):
+        small, scale = downscale(image, app.config['INFERENCE_MAX_SIDE'])
+
+    # Уменьшенный кадр и все окна уходят в планировщик сразу и попадают в общие батчи
+    frames = [(small, scale, (0, 0))] + [(image[y1:y2, x1:x2], 1.0, (x1, y1)) for x1, y1, x2, y2 in tiles]
+    with ExitStack() as stack:
+        with metrics.span('color_conversion'):
+            images_rgb = [stack.enter_context(rgb_frame(frame)) for frame, _, _ in frames]
+        with metrics.span('inference'):
+            futures = [scheduler.submit(image_rgb, role_names) for image_rgb in images_rgb]
+            results = [future.result() for future in futures]
+
+    if not tiles:
+        return {name: to_frame_coordinates(detections, scale) for name, detections in results[0].items()}
+    return {
+        name: merge_detections([to_frame_coordinates(result[name], frame_scale, offset)
+                                for result, (_, frame_scale, offset) in zip(results, frames)],
+                               DETECTOR_ROLES[name]['iou'])
+        for name in results[0]
+    }
+
+
+def analyze_frame(image, tracker=None, layout=None):
+    """
+    Детектирование и анализ занятости столов на одном BGR-кадре.
+    С трекером столы получают стабильные id и детектируются не на каждом кадре,
+    со статической схемой камеры (layout) столы не детектируются вовсе
+    """
+    if tracker is None:
+        return _analyze_frame(image, layout=layout)
+    with tracker.lock:
+        return _analyze_frame(image, tracker, layout)
 
-    # Проверка на пересечение
-    if x2 < x1 or y2 < y1:
-        return 0.0
 
-    # Вычисление площадей
-    intersection_area = (x2 - x1) * (y2 - y1)
-    box1_area = (box1[2] - box1[0]) * (box1[3] - box1[1])
-    box2_area = (box2[2] - box2[0]) * (box2[3] - box2[1])
+def motion_region(image, motion):
+    """
+    Область кадра для детекции людей только в ней (None - анализировать весь кадр):
+    изменившаяся область с запасом, если она достаточно мала
+    """
+    if not app.config['MOTION_REGION_DETECTION'] or motion.region is None:
+        return None
+    x1, y1, x2, y2 = crop_region(np.array([motion.region], dtype=np.float64), image.shape,
+                                 app.config['MOTION_REGION_MARGIN'])
+    if (x2 - x1) * (y2 - y1) > app.config['MOTION_REGION_MAX_AREA'] * image.shape[0] * image.shape[1]:
+        return None
+    return x1, y1, x2, y2
+
+
+def _analyze_frame(image, tracker=None, layout=None):
+    image_size = {'width': image.shape[1], 'height': image.shape[0]}
+
+    # Статичная сцена камеры: прошлый результат без прохода модели (не дольше MOTION_MAX_REUSE_SECONDS)
+    motion, region = None, None
+    if tracker is not None and app.config['MOTION_GATING']:
+        with metrics.span('motion'):
+            motion = tracker.motion(image, app.config['MOTION_PIXEL_THRESHOLD'])
+        previous = tracker.last_result
+        if previous is not None and previous.image_size == image_size \
+                and time.time() - tracker.last_analyzed_at < app.config['MOTION_MAX_REUSE_SECONDS']:
+            if motion.fraction <= app.config['MOTION_THRESHOLD']:
+                tracker.count_motion('reused')
+                metrics.inc(motion_frames_total, decision='reused')
+                return previous.replace(
+                    timestamp=datetime.now().isoformat(),
+                    table_dwell=tracker.update_dwell(previous.table_ids, previous.table_occupied),
+                    extra=dict(previous.extra, reused=True, motion=round(motion.fraction, 4)),
+                )
+            region = motion_region(image, motion)
+
+    # Детектирование столов (класс 60 в COCO - dining table) и людей (класс 0 в COCO - person)
+    # за один проход общей модели, батчем вместе с кадрами параллельных запросов.
+    # Между повторными детекциями столов трекер обходится детекцией одних людей
+    if layout is not None:
+        table_boxes, table_ids = layout_boxes(layout, image.shape)
+        detect_tables = False
+    else:
+        detect_tables = tracker is None or tracker.needs_table_detection(image)
+    if detect_tables:
+        # Столы детектируются по всему кадру
+        region = None
+
+    # Со схемой столов людей можно искать только в области вокруг столов,
+    # а при небольшом движении - только в изменившейся области
+    x_offset, y_offset = 0, 0
+    frame = image
+    if region is not None:
+        x_offset, y_offset, x2, y2 = region
+        frame = image[y_offset:y2, x_offset:x2]
+    elif layout is not None and app.config['LAYOUT_CROP_PERSONS']:
+        x_offset, y_offset, x2, y2 = crop_region(table_boxes, image.shape, app.config['LAYOUT_CROP_MARGIN'])
+        frame = image[y_offset:y2, x_offset:x2]
+
+    detections = detect_frame(frame, None if detect_tables else ['person'])
+    person_detections = detections['person']
+    for role, role_detections in detections.items():
+        metrics.inc(detections_total, len(role_detections), role=role)
+    # Координаты людей - в системе исходного кадра
+    person_boxes = person_detections.xyxy + np.array([x_offset, y_offset, x_offset, y_offset], dtype=np.float32)
+    person_confidence = person_detections.confidence
+    if region is not None:
+        # Люди вне изменившейся области остаются из прошлого результата
+        previous = tracker.last_result
+        centers = (previous.person_boxes[:, :2] + previous.person_boxes[:, 2:]) / 2
+        inside = ((centers[:, 0] >= region[0]) & (centers[:, 0] < region[2]) &
+                  (centers[:, 1] >= region[1]) & (centers[:, 1] < region[3]))
+        person_boxes = np.vstack([previous.person_boxes[~inside], person_boxes]).astype(np.float32)
+        person_confidence = np.concatenate([previous.person_confidence[~inside], person_confidence])
+
+    # Анализ занятости столов (векторизованно по всем парам стол-человек)
+    with metrics.span('occupancy'):
+        if layout is not None:
+            table_confidence = np.ones(len(table_boxes))
+            if tracker is not None:
+                tracker.use_layout(table_boxes, table_ids)
+        elif tracker is None:
+            table_boxes, table_confidence = detections['table'].xyxy, detections['table'].confidence
+            table_ids = np.arange(1, len(table_boxes) + 1)
+        else:
+            if detect_tables:
+                tracker.update(image, detections['table'].xyxy, detections['table'].confidence)
+            else:
+                tracker.skip_table_detection()
+            tracks = sorted(tracker.tracks, key=lambda track: track['id'])
+            table_boxes = np.array([track['bbox'] for track in tracks], dtype=np.float64).reshape(-1, 4)
+            table_confidence = [track['confidence'] for track in tracks]
+            table_ids = [track['id'] for track in tracks]
+        polygons = layout_polygons(layout, image.shape) if layout is not None else None
+        table_occupied, person_count = occupancy_arrays(table_boxes, person_boxes, polygons=polygons)
+        dwell = tracker.update_dwell(table_ids, table_occupied) if tracker is not None else None
+
+    # Результат - колонки массивов; словарь для JSON строится только при выдаче
+    result = FrameResult(
+        timestamp=datetime.now().isoformat(),
+        image_size=image_size,
+        table_ids=table_ids,
+        table_boxes=table_boxes,
+        table_confidence=table_confidence,
+        table_occupied=table_occupied,
+        table_person_count=person_count,
+        table_dwell=dwell,
+        person_boxes=person_boxes,
+        person_confidence=person_confidence,
+    )
+    if motion is not None:
+        decision = 'full' if region is None else 'regions'
+        tracker.remember_analysis(result, motion, decision)
+        metrics.inc(motion_frames_total, decision=decision)
+    return result
+
+
+def cache_bypassed():
+    """Клиент может запросить анализ в обход кэша заголовком X-Cache-Bypass или Cache-Control: no-cache"""
+    if request.headers.get('X-Cache-Bypass', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'no-cache' in request.headers.get('Cache-Control', '').lower()
 
-    # IoU с защитой от деления на ноль (используем epsilon)
-    union_area = box1_area + box2_area - intersection_area
-    if union_area <= 0:
-        return 0.0
 
-    iou = intersection_area / (union_area + epsilon)  # Теперь используем epsilon
-    return iou
+def result_response(result, data=None, cache_status=None):
+    """
+    Ответ с результатом анализа в формате из заголовка Accept: JSON по умолчанию,
+    MessagePack или упакованные float32-колонки по запросу клиента.
+    data - уже построенный словарь результата, если он есть
+    """
+    with metrics.span('serialization'):
+        mimetype = request.accept_mimetypes.best_match(available_formats(), default=JSON_MIMETYPE)
+        if mimetype == JSON_MIMETYPE:
+            response = jsonify(data if data is not None else result.to_dict())
+        else:
+            response = Response(encode_result(result, mimetype), mimetype=mimetype)
+    response.vary.add('Accept')
+    if cache_status is not None:
+        response.headers['X-Cache'] = cache_status
+    return response
 
 
 @app.route('/api/analyze', methods=['POST'])
@@ -141,496 +470,606 @@ def analyze_image():
         return jsonify({'error': 'No file selected'}), 400
 
     # Проверяем, что модели загружены
-    if person_model is None or table_model is None:
+    if not detectors.loaded:
         if not load_models():
             return jsonify({'error': 'Models failed to load'}), 500
 
-    # Сохранение файла
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
+    # Кадры одной камеры анализируются с общим состоянием трекинга столов
+    camera_id = request.form.get('camera_id') or request.headers.get('X-Camera-Id')
+    use_cache = not cache_bypassed()
+    layout = table_layouts.get(camera_id)
+    # Результаты, посчитанные по другой версии схемы камеры, в кэше не находятся
+    namespace = (camera_id, layout_version(layout))
 
     try:
-        # Загрузка изображения
-        image = cv2.imread(filepath)
+        # Загрузка изображения: декодирование прямо из потока запроса (или через диск в режиме отладки)
+        key = None
+        if app.config['SAVE_UPLOADS']:
+            image = load_upload_from_disk(file, app.config['UPLOAD_FOLDER'], app.config['MAX_IMAGE_PIXELS'])
+        else:
+            with ExitStack() as upload:
+                with metrics.span('upload'):
+                    data = upload.enter_context(
+                        read_upload(file, app.config['MAX_CONTENT_LENGTH'], size_hint=request.content_length))
+                # Повторно присланный файл отдаём из кэша без декодирования и инференса
+                if use_cache:
+                    key = content_hash(data)
+                    cached = result_cache.get(namespace, key)
+                    if cached is not None:
+                        metrics.inc(cache_requests_total, result='hit')
+                        return result_response(cached, cache_status='HIT')
+                with metrics.span('decode'):
+                    image = decode_image(data, app.config['MAX_IMAGE_PIXELS'])
         if image is None:
             return jsonify({'error': 'Failed to load image'}), 400
 
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        # Почти одинаковый кадр (например, статичная камера ночью) - тоже из кэша, но как новое наблюдение
+        phash = None
+        if use_cache and result_cache.phash_distance is not None:
+            phash = perceptual_hash(image)
+            cached = result_cache.get_similar(namespace, phash)
+            if cached is not None:
+                metrics.inc(cache_requests_total, result='similar')
+                results = cached.replace(timestamp=datetime.now().isoformat())
+                data = results.to_dict()
+                save_to_history(data, camera_id)
+                return result_response(results, data, cache_status='SIMILAR')
+
+        tracker = tracking_sessions.get(camera_id, layout_version(layout)) if camera_id else None
+        results = analyze_frame(image, tracker, layout)
+        metrics.inc(analyses_total)
+        if use_cache:
+            metrics.inc(cache_requests_total, result='miss')
+            result_cache.miss()
+            if key is not None or phash is not None:
+                result_cache.put(namespace, key or f'phash:{phash:016x}', results, phash)
 
-        # Детектирование столов - используем модель правильно
-        table_results = table_model.predict(image_rgb, conf=0.10, iou=0.10)[0]
-        table_detections = sv.Detections.from_ultralytics(table_results)
+        # Сохранение в историю
+        data = results.to_dict()
+        save_to_history(data, camera_id)
 
-        # Детектирование людей
-        person_results = person_model.predict(image_rgb, conf=0.10, iou=0.15)[0]
-        person_detections = sv.Detections.from_ultralytics(person_results)
+        return result_response(results, data)
 
-        # Фильтрация только столов (класс 60 в COCO - dining table)
-        table_detections = table_detections[table_detections.class_id == 60]
+    except ImageTooLarge as e:
+        metrics.inc(errors_total, kind='image_too_large')
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        metrics.inc(errors_total, kind='analysis')
+        print(f"Error during analysis: {e}")
+        return jsonify({'error': str(e)}), 500
 
-        # Фильтрация только людей (класс 0 в COCO - person)
-        person_detections = person_detections[person_detections.class_id == 0]
 
-        # Формирование данных о людях
-        people_data = []
-        for i, person_box in enumerate(person_detections.xyxy):
-            person_box = person_box.tolist()
-            people_data.append({
-                'id': i + 1,
-                'bbox': person_box,
-                'confidence': float(person_detections.confidence[i]) if i < len(person_detections.confidence) else 0.0
-            })
+def analyze_many(items, layout=None, workers=None):
+    """
+    Анализ набора изображений [(имя, функция декодирования), ...] в пуле потоков.
+    Декодирование идёт параллельно, а кадры из разных потоков планировщик собирает
+    в общие батчи YOLO. Генератор (индекс, имя, результаты, ошибка) в порядке
+    готовности; одновременно в работе не больше 2 * workers изображений
+    """
+    workers = workers or app.config['BATCH_WORKERS']
 
-        # Анализ занятости столов
-        tables_data = []
-        for i, table_box in enumerate(table_detections.xyxy):
-            table_box = table_box.tolist()
-
-            # Проверка, есть ли люди рядом со столом
-            is_occupied = False
-            person_count = 0
-            iou_sum = 0
-
-            for person_box in person_detections.xyxy:
-                person_box = person_box.tolist()
-
-                # Простая логика пересечения bounding boxes
-                table_center = (table_box[0] + table_box[2]) / 2
-                person_center = (person_box[0] + person_box[2]) / 2
-
-                distance = abs(table_center - person_center)
-
-                # Динамический порог на основе размера стола
-                table_width = table_box[2] - table_box[0]
-                threshold = table_width * 0.8
-                iou = calculate_iou(table_box, person_box)
-                iou_sum += iou
-
-                if distance < threshold:
-                    is_occupied = True
-                    if iou > 0:
-                        person_count += 1
-
-            if not (iou_sum > 0.2 or person_count > 2 or (iou_sum > 0.1 and person_count > 1)):
-                is_occupied = False
-
-            tables_data.append({
-                'id': i + 1,
-                'bbox': table_box,
-                'status': 'occupied' if is_occupied else 'free',
-                'person_count': person_count,
-                'confidence': float(table_detections.confidence[i]) if i < len(table_detections.confidence) else 0.0
-            })
+    def run(decode):
+        with metrics.span('decode'):
+            image = decode()
+        if image is None:
+            raise ValueError('Failed to load image')
+        return analyze_frame(image, layout=layout)
+
+    inputs = enumerate(items)
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analyze-batch') as executor:
+        def submit_next():
+            for index, (name, decode) in inputs:
+                futures[executor.submit(run, decode)] = (index, name)
+                return
+
+        for _ in range(workers * 2):
+            submit_next()
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, name = futures.pop(future)
+                submit_next()
+                error = future.exception()
+                if error is None:
+                    metrics.inc(analyses_total)
+                    yield index, name, future.result(), None
+                else:
+                    metrics.inc(errors_total, kind='image_too_large' if isinstance(error, ImageTooLarge) else 'analysis')
+                    yield index, name, None, str(error)
 
-        # Подготовка результатов
-        results = {
-            'timestamp': datetime.now().isoformat(),
-            'tables_found': len(tables_data),
-            'people_found': len(people_data),
-            'tables': tables_data,
-            'people': people_data,
-            'occupancy_rate': sum(1 for t in tables_data if t['status'] == 'occupied') / max(len(tables_data), 1),
-            'image_size': {'width': image.shape[1], 'height': image.shape[0]}
-        }
 
-        # Сохранение в историю
-        save_to_history(results)
+def close_uploads(uploads):
+    for upload in uploads:
+        upload.close()
 
-        return jsonify(results)
 
-    except Exception as e:
-        print(f"Error during analysis: {e}")
-        return jsonify({'error': str(e)}), 500
-    finally:
-        # Очистка временных файлов
-        if os.path.exists(filepath):
-            os.remove(filepath)
+@app.route('/api/analyze_batch', methods=['POST'])
+def analyze_batch():
+    """
+    Пакетный анализ: несколько файлов (поле files) и/или ZIP-архивы с изображениями.
+    Ответ - NDJSON по мере готовности: строка на изображение ({"index", "name", "results"}
+    или {"index", "name", "error"}) и итоговая строка {"summary": {...}}.
+    Поля формы: camera_id (схема столов и камера в истории), save_history (по умолчанию 1)
+    """
+    try:
+        request.max_content_length = app.config['BATCH_MAX_CONTENT_LENGTH']
+        request.max_form_parts = app.config['BATCH_MAX_FILES'] + 16
+    except AttributeError:
+        # Flask < 3.1: действует общий MAX_CONTENT_LENGTH
+        pass
 
+    files = [file for file in request.files.getlist('files') + request.files.getlist('file') if file.filename]
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
 
-@app.route('/api/history', methods=['GET'])
-def get_history():
-    """Получение истории анализов"""
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, 'r') as f:
-            history = json.load(f)
-        return jsonify(history)
-    return jsonify([])
+    if not detectors.loaded:
+        if not load_models():
+            return jsonify({'error': 'Models failed to load'}), 500
 
+    # Файлы читаются уже после возврата из обработчика, когда запрос закрыт
+    uploads = [detach_upload(file) for file in files]
+
+    max_bytes, max_pixels = app.config['MAX_CONTENT_LENGTH'], app.config['MAX_IMAGE_PIXELS']
+    items = []
+    for upload in uploads:
+        if is_zip(upload.stream):
+            try:
+                items.extend(archive_images(upload.stream, max_bytes, max_pixels))
+            except zipfile.BadZipFile as e:
+                close_uploads(uploads)
+                return jsonify({'error': f'Invalid archive {upload.filename}: {e}'}), 400
+        else:
+            items.append((upload.filename, partial(decode_upload, upload, max_pixels, max_bytes)))
+    if len(items) > app.config['BATCH_MAX_FILES']:
+        close_uploads(uploads)
+        return jsonify({'error': f"Too many images: {len(items)} > {app.config['BATCH_MAX_FILES']}"}), 413
+
+    camera_id = request.form.get('camera_id') or request.headers.get('X-Camera-Id')
+    save_history = request.form.get('save_history', '1').lower() not in ('0', 'false', 'no')
+    layout = table_layouts.get(camera_id)
+
+    def generate():
+        try:
+            yield from generate_lines()
+        finally:
+            close_uploads(uploads)
+
+    def generate_lines():
+        pending, processed, failed = [], 0, 0
+        for index, name, results, error in analyze_many(items, layout):
+            if error is None:
+                processed += 1
+                results = results.to_dict()
+                line = {'index': index, 'name': name, 'results': results}
+                if save_history:
+                    pending.append((results, camera_id))
+                    if len(pending) >= app.config['BATCH_HISTORY_CHUNK']:
+                        save_many_to_history(pending)
+                        pending = []
+            else:
+                failed += 1
+                line = {'index': index, 'name': name, 'error': error}
+            yield app.json.dumps(line) + '\n'
 
-@app.route('/api/report/pdf', methods=['POST'])
-def generate_pdf_report():
-    """Генерация PDF отчета"""
-    data = request.json
+        # Вся история пакета (или его очередной части) пишется одной транзакцией
+        if pending:
+            save_many_to_history(pending)
+        yield app.json.dumps({'summary': {'total': len(items), 'processed': processed, 'failed': failed,
+                                          'saved_to_history': save_history}}) + '\n'
 
-    from reportlab.lib.pagesizes import A4
-    from reportlab.pdfgen import canvas
-    from reportlab.lib import colors
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-    # Регистрируем русские шрифты
-    font_registered = register_russian_fonts()
 
-    os.makedirs('reports', exist_ok=True)
+# Активные видеопотоки (файлы или RTSP-камеры)
+streams = StreamManager(max_streams=app.config['MAX_STREAMS'])
 
-    filename = f"cafe_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    filepath = os.path.join('reports', filename)
 
-    c = canvas.Canvas(filepath, pagesize=A4)
+@app.route('/api/stream', methods=['POST'])
+def start_stream():
+    """
+    Запуск анализа видеопотока.
+    Тело: {"source": "<rtsp://, http(s):// или видеофайл в MEDIA_DIR>", "max_fps": 5,
+    "save_history": false, "camera_id": null}.
+    Потоки живут в памяти процесса: с несколькими воркерами запуск отклоняется
+    """
+    if app.config['WORKER_PROCESSES'] > 1:
+        return jsonify({'error': 'Video streams require a single server process (WEB_CONCURRENCY=1)'}), 409
 
-    # Устанавливаем шрифт с поддержкой кириллицы
-    if font_registered:
-        c.setFont("RussianFont", 16)
-    else:
-        c.setFont("Helvetica", 16)  # Fallback
+    data = request.json or {}
+    if not data.get('source'):
+        return jsonify({'error': 'No source provided'}), 400
+    try:
+        source = resolve_source(data['source'], app.config['MEDIA_DIR'], STREAM_SCHEMES,
+                                app.config['SOURCE_ALLOWED_HOSTS'])
+    except ValueError as e:
+        return jsonify({'error': f'Invalid source: {e}'}), 400
+    try:
+        max_fps = float(data.get('max_fps', app.config['STREAM_MAX_FPS']))
+    except (TypeError, ValueError):
+        max_fps = None
+    if max_fps is None or not STREAM_MIN_FPS <= max_fps <= STREAM_MAX_FPS_LIMIT:
+        return jsonify({'error': f'max_fps must be a number between {STREAM_MIN_FPS} and {STREAM_MAX_FPS_LIMIT}'}), 400
 
-    c.drawString(50, 800, "Отчет по анализу использования столов в кафе")
+    if not detectors.loaded:
+        if not load_models():
+            return jsonify({'error': 'Models failed to load'}), 500
 
-    if font_registered:
-        c.setFont("RussianFont", 12)
+    try:
+        tracker = create_tracker()
+        stream = streams.start(
+            source,
+            lambda frame: analyze_frame(frame, tracker, table_layouts.get(data.get('camera_id'))).to_dict(),
+            max_fps=max_fps,
+            on_result=(lambda results: save_to_history(results, data.get('camera_id')))
+            if data.get('save_history') else None,
+        )
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 429
+
+    return jsonify({'stream_id': stream.id, 'events': f'/api/stream/{stream.id}/events'}), 201
+
+
+@app.route('/api/stream/<stream_id>/events', methods=['GET'])
+def stream_events(stream_id):
+    """Результаты анализа видеопотока в формате Server-Sent Events"""
+    stream = streams.get(stream_id)
+    if stream is None:
+        return jsonify({'error': 'Stream not found'}), 404
+
+    return Response(stream.events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/stream/<stream_id>', methods=['GET', 'DELETE'])
+def stream_status(stream_id):
+    """Состояние видеопотока (GET) или его остановка (DELETE)"""
+    stream = streams.stop(stream_id) if request.method == 'DELETE' else streams.get(stream_id)
+    if stream is None:
+        return jsonify({'error': 'Stream not found'}), 404
+    return jsonify(stream.stats())
+
+
+@app.route('/api/streams', methods=['GET'])
+def list_streams():
+    """Список видеопотоков"""
+    return jsonify(streams.list())
+
+
+def poll_camera(camera_id, image):
+    """Анализ снимка камеры серверного опроса (с трекингом и схемой камеры) и запись в историю"""
+    layout = table_layouts.get(camera_id)
+    results = analyze_frame(image, tracking_sessions.get(camera_id, layout_version(layout)), layout)
+    metrics.inc(analyses_total)
+    data = results.to_dict()
+    save_to_history(data, camera_id)
+    return data
+
+
+def resolve_camera_source(source):
+    """Источник камеры: http(s)-адрес снимка или файл в MEDIA_DIR (ValueError для остального)"""
+    return resolve_source(source, app.config['MEDIA_DIR'], ('http', 'https'), app.config['SOURCE_ALLOWED_HOSTS'])
+
+
+# Серверный опрос камер: частота и приоритет у каждой камеры свои.
+# Источник проверяется и при сохранении, и перед каждым снимком (файл камер могли поправить вручную)
+camera_store = CameraStore(app.config['CAMERAS_PATH'], resolve_camera_source)
+camera_scheduler = CameraScheduler(
+    camera_store,
+    poll_camera,
+    fetch=lambda source: fetch_snapshot(resolve_camera_source(source), app.config['MAX_CONTENT_LENGTH'],
+                                        app.config['MAX_IMAGE_PIXELS']),
+    saturated=lambda: scheduler.queue_depth >= app.config['CAMERA_SATURATION_QUEUE'],
+    max_in_flight=app.config['CAMERA_MAX_IN_FLIGHT'],
+    lock_path=app.config['CAMERAS_PATH'] + '.lock',
+    state_path=app.config['CAMERAS_PATH'] + '.state',
+)
+
+
+def start_camera_polling():
+    """Запуск опроса камер (в пуле воркеров опрашивает один процесс)"""
+    if app.config['CAMERA_POLLING']:
+        camera_scheduler.start()
+
+
+@app.route('/api/cameras', methods=['GET'])
+def list_cameras():
+    """Камеры серверного опроса с состоянием опроса"""
+    stats = camera_scheduler.stats()
+    cameras = {camera_id: dict(camera, state=stats['cameras'].get(camera_id))
+               for camera_id, camera in camera_store.list().items()}
+    return jsonify({'cameras': cameras, 'scheduler': {key: value for key, value in stats.items() if key != 'cameras'}})
+
+
+@app.route('/api/cameras/<camera_id>', methods=['GET', 'PUT', 'DELETE'])
+def camera(camera_id):
+    """
+    Камера серверного опроса.
+    PUT: {"source": "<файл снимка или http(s)://...>", "fps": 1.0, "priority": 0, "enabled": true}
+    GET возвращает настройки, состояние опроса и последний результат
+    """
+    if request.method == 'GET':
+        config = camera_store.get(camera_id)
+        if config is None:
+            return jsonify({'error': 'Camera not found'}), 404
+        state = camera_scheduler.stats()['cameras'].get(camera_id)
+        return jsonify(dict(config, state=state, last_result=camera_scheduler.last_result(camera_id)))
+
+    if request.method == 'DELETE':
+        if not camera_store.delete(camera_id):
+            return jsonify({'error': 'Camera not found'}), 404
+        return jsonify({'camera_id': camera_id, 'deleted': True})
+
+    try:
+        config = camera_store.put(camera_id, request.json)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid camera: {e}'}), 400
+    start_camera_polling()
+    return jsonify(config)
+
+
+@app.route('/api/motion', methods=['GET'])
+def motion_stats():
+    """Статистика пропуска инференса на статичных кадрах по камерам (для подбора порогов)"""
+    cameras = tracking_sessions.motion_stats()
+    totals = {key: sum(stats[key] for stats in cameras.values()) for key in ('frames', 'reused', 'regions', 'full')}
+    totals['skip_rate'] = totals['reused'] / max(totals['frames'], 1)
+    return jsonify({'enabled': app.config['MOTION_GATING'], 'threshold': app.config['MOTION_THRESHOLD'],
+                    'cameras': cameras, 'totals': totals})
+
+
+@app.route('/api/session/<camera_id>', methods=['DELETE'])
+def reset_session(camera_id):
+    """Сброс состояния трекинга столов для камеры"""
+    if not tracking_sessions.reset(camera_id):
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify({'camera_id': camera_id, 'reset': True})
+
+
+@app.route('/api/layout/<camera_id>', methods=['GET', 'PUT', 'DELETE'])
+def table_layout(camera_id):
+    """
+    Статическая схема столов камеры.
+    PUT: {"tables": [{"id": 1, "bbox": [x1, y1, x2, y2]} | {"id": 2, "polygon": [[x, y], ...]}],
+          "image_size": {"width": 1920, "height": 1080}}
+    """
+    if request.method == 'GET':
+        layout = table_layouts.get(camera_id)
+        if layout is None:
+            return jsonify({'error': 'Layout not found'}), 404
+        return jsonify(layout)
+
+    if request.method == 'DELETE':
+        if not table_layouts.delete(camera_id):
+            return jsonify({'error': 'Layout not found'}), 404
     else:
-        c.setFont("Helvetica", 12)
+        data = request.json or {}
+        try:
+            layout = table_layouts.put(camera_id, data.get('tables'), data.get('image_size'))
+        except (ValueError, TypeError, AttributeError) as e:
+            return jsonify({'error': f'Invalid layout: {e}'}), 400
 
-    c.drawString(50, 750, f"Дата генерации: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    # Кэш результатов и трекинг камеры привязаны к версии схемы: старые данные
+    # перестают находиться во всех воркерах без явной очистки
+    return jsonify(layout) if request.method == 'PUT' else jsonify({'camera_id': camera_id, 'deleted': True})
 
-    if 'data' in data:
-        stats = data['data']
-        c.drawString(50, 700, f"Проанализировано столов: {stats.get('tables_found', 0)}")
-        c.drawString(50, 680, f"Обнаружено людей: {stats.get('people_found', 0)}")
-        c.drawString(50, 660, f"Загруженность: {stats.get('occupancy_rate', 0) * 100:.1f}%")
 
-        # Добавляем информацию о людях
-        c.drawString(50, 630, "Детализация по людям:")
-        y_pos = 610
-        if 'people' in stats and stats['people']:
-            for person in stats['people'][:10]:
-                c.drawString(70, y_pos,
-                             f"Человек {person.get('id', '')}: уверенность {person.get('confidence', 0) * 100:.1f}%")
-                y_pos -= 20
-                if y_pos < 50:
-                    break
+@app.route('/api/layout/<camera_id>/seed', methods=['POST'])
+def seed_table_layout(camera_id):
+    """
+    Начальная схема столов по детекции на присланном кадре (поле file).
+    Дальше схему можно поправить через PUT /api/layout/<camera_id>
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
 
-    c.save()
+    if not detectors.loaded:
+        if not load_models():
+            return jsonify({'error': 'Models failed to load'}), 500
 
-    return send_file(filepath, as_attachment=True)
+    try:
+        with read_upload(request.files['file'], app.config['MAX_CONTENT_LENGTH'],
+                         size_hint=request.content_length) as data:
+            image = decode_image(data, app.config['MAX_IMAGE_PIXELS'])
+        if image is None:
+            return jsonify({'error': 'Failed to load image'}), 400
+        table_detections = detect_frame(image, ['table'])['table']
+    except ImageTooLarge as e:
+        return jsonify({'error': str(e)}), 413
 
+    if len(table_detections) == 0:
+        return jsonify({'error': 'No tables detected'}), 422
 
-@app.route('/api/report/summary_pdf', methods=['POST'])
-def generate_summary_pdf_report():
-    """Генерация PDF отчета со сводной статистикой"""
-    data = request.json
-
-    # Регистрируем русские шрифты
-    font_registered = register_russian_fonts()
-
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib import colors
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.enums import TA_CENTER, TA_LEFT
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
-    import reportlab.rl_config
-
-    os.makedirs('reports', exist_ok=True)
-
-    filename = f"cafe_summary_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    filepath = os.path.join('reports', filename)
-
-    # Создаем стили с поддержкой кириллицы
-    styles = getSampleStyleSheet()
-
-    # Определяем имя шрифта в зависимости от регистрации
-    font_name = "RussianFont" if font_registered else "Helvetica"
-    bold_font_name = "RussianFont-Bold" if font_registered else "Helvetica-Bold"
-
-    # Создаем кастомные стили с русским шрифтом
-    if font_registered:
-        # Стиль для заголовка
-        styles.add(ParagraphStyle(
-            name='RussianHeading1',
-            parent=styles['Heading1'],
-            fontName=bold_font_name,
-            fontSize=16,
-            spaceAfter=12
-        ))
+    # Нумерация слева направо, сверху вниз
+    boxes = sorted(table_detections.xyxy.tolist(), key=lambda box: (box[0], box[1]))
+    layout = table_layouts.put(camera_id, [{'id': i + 1, 'bbox': box} for i, box in enumerate(boxes)],
+                               {'width': image.shape[1], 'height': image.shape[0]})
+    return jsonify(layout), 201
 
-        # Стиль для подзаголовка
-        styles.add(ParagraphStyle(
-            name='RussianHeading2',
-            parent=styles['Heading2'],
-            fontName=bold_font_name,
-            fontSize=14,
-            spaceAfter=8
-        ))
 
-        # Стиль для обычного текста
-        styles.add(ParagraphStyle(
-            name='RussianNormal',
-            parent=styles['Normal'],
-            fontName=font_name,
-            fontSize=10
-        ))
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Статистика кэша результатов: попадания и промахи"""
+    return jsonify(result_cache.stats())
 
-        # Стиль для метаданных
-        styles.add(ParagraphStyle(
-            name='RussianMetadata',
-            parent=styles['Normal'],
-            fontName=font_name,
-            fontSize=9,
-            textColor=colors.grey
-        ))
+
+@app.route('/api/inference/stats', methods=['GET'])
+def inference_stats():
+    """Статистика планировщика инференса: глубина очереди и размеры батчей"""
+    return jsonify(scheduler.stats())
+
+
+def gzip_response(response):
+    """Сжатие JSON-ответа gzip, если клиент его принимает и ответ не меньше HISTORY_GZIP_MIN_BYTES"""
+    min_bytes = app.config['HISTORY_GZIP_MIN_BYTES']
+    response.vary.add('Accept-Encoding')
+    if min_bytes is None or not request.accept_encodings['gzip']:
+        return response
+    data = response.get_data()
+    if len(data) >= min_bytes:
+        response.set_data(gzip.compress(data, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """
+    Получение истории анализов.
+    Параметры: limit, offset (от самых новых записей), from, to (ISO-время).
+    Инкрементальная синхронизация: since=<курсор> - только записи с id больше курсора
+    (по возрастанию id, с tail=1 - последние limit из них); ответ
+    {"entries", "cursor", "latest_id", "has_more"}, следующий запрос - since=cursor.
+    Ответы с ETag (If-None-Match -> 304, пока история не изменилась) и gzip
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 0), 1000)
+        offset = max(int(request.args.get('offset', 0)), 0)
+        since = request.args.get('since')
+        since = max(int(since), 0) if since is not None else None
+    except ValueError:
+        return jsonify({'error': 'limit, offset and since must be integers'}), 400
+    start = request.args.get('from')
+    end = request.args.get('to')
+    try:
+        start, end = time_bound(start) if start else None, time_bound(end, end=True) if end else None
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates or times'}), 400
+
+    # Записи только добавляются, поэтому ответ определяется последним id и параметрами запроса
+    store = get_history_store()
+    latest_id = store.last_id()
+    etag = hashlib.sha1(f'{latest_id}?{request.query_string.decode()}'.encode()).hexdigest()[:20]
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+
+    if since is None:
+        response = jsonify(store.query(limit=limit, offset=offset, start=start, end=end))
+        response.headers['X-Total-Count'] = str(store.count(start=start, end=end))
     else:
-        # Fallback стили с английским текстом
-        styles.add(ParagraphStyle(
-            name='RussianHeading1',
-            parent=styles['Heading1'],
-            fontSize=16,
-            spaceAfter=12
-        ))
-        styles.add(ParagraphStyle(
-            name='RussianHeading2',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceAfter=8
-        ))
-        styles.add(ParagraphStyle(
-            name='RussianNormal',
-            parent=styles['Normal'],
-            fontSize=10
-        ))
-        styles.add(ParagraphStyle(
-            name='RussianMetadata',
-            parent=styles['Normal'],
-            fontSize=9,
-            textColor=colors.grey
+        tail = request.args.get('tail', '0').lower() in ('1', 'true', 'yes')
+        entries = store.since(since, limit if tail else limit + 1, newest=tail)
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        response = jsonify({
+            'entries': entries,
+            'cursor': entries[-1]['id'] if entries else min(since, latest_id),
+            'latest_id': latest_id,
+            'has_more': has_more,
+        })
+    # Слабый ETag: тело одинаково по смыслу и в сжатом, и в несжатом виде
+    response.set_etag(etag, weak=True)
+    return gzip_response(response)
+
+
+@app.route('/api/export', methods=['GET'])
+def export_history():
+    """
+    Потоковая выгрузка истории за период без загрузки в память.
+    Параметры: format (csv, xlsx, parquet), level (analyses - строка на анализ,
+    tables - строка на стол в каждом анализе; для xlsx - оба листа), from, to, camera_id
+    """
+    export_format = request.args.get('format', 'csv')
+    level = request.args.get('level', 'analyses')
+    if export_format not in EXPORT_FORMATS or level not in EXPORT_COLUMNS:
+        return jsonify({'error': 'Unknown export format or level'}), 400
+    if not export_available(export_format):
+        return jsonify({'error': f'Export format {export_format} requires pyarrow'}), 501
+
+    start, end = request.args.get('from'), request.args.get('to')
+    try:
+        # Проверяется до начала потока: ошибку посреди выгрузки клиенту уже не вернуть
+        start, end = time_bound(start) if start else None, time_bound(end, end=True) if end else None
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates or times'}), 400
+
+    store = get_history_store()
+    chunks = stream_export(lambda: store.iter_entries(start=start, end=end), export_format, level,
+                           request.args.get('camera_id'))
+
+    mimetype, _ = EXPORT_FORMATS[export_format]
+    response = Response(chunks, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={export_filename(export_format, level)}'
+    return response
+
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """
+    Статистика занятости из предагрегированных корзин.
+    Параметры: from, to (ISO-время), granularity (minute, hour, day), camera_id
+    """
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in GRANULARITIES:
+        return jsonify({'error': f"granularity must be one of: {', '.join(GRANULARITIES)}"}), 400
+
+    try:
+        return jsonify(get_stats_store().query(
+            start=request.args.get('from'),
+            end=request.args.get('to'),
+            granularity=granularity,
+            camera_id=request.args.get('camera_id'),
         ))
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates or times'}), 400
 
-    doc = SimpleDocTemplate(filepath, pagesize=A4)
-    elements = []
 
-    # Заголовок отчета
-    if font_registered:
-        elements.append(Paragraph("Сводный отчет по использованию столов в кафе", styles['RussianHeading1']))
-    else:
-        elements.append(Paragraph("Cafe Table Usage Summary Report", styles['RussianHeading1']))
+# Периоды отчётов, которые клиент может указать вместо явного диапазона
+REPORT_PERIODS = {
+    'day': timedelta(days=1),
+    'week': timedelta(days=7),
+}
 
-    elements.append(Spacer(1, 12))
 
+def resolve_report_data(data):
+    """
+    Данные для сводного отчёта: либо готовый блок 'data' от клиента,
+    либо агрегаты за диапазон from/to или период (day, week, all)
+    """
     if 'data' in data:
-        stats = data['data']
-
-        # Основная информация
-        if font_registered:
-            elements.append(Paragraph(f"<b>Период:</b> {data.get('period', 'текущий')}", styles['RussianNormal']))
-            elements.append(Paragraph(f"<b>Сгенерировано:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                      styles['RussianNormal']))
-            elements.append(
-                Paragraph(f"<b>Количество анализов:</b> {stats.get('total_analyses', 1)}", styles['RussianNormal']))
-        else:
-            elements.append(Paragraph(f"<b>Period:</b> {data.get('period', 'current')}", styles['RussianNormal']))
-            elements.append(
-                Paragraph(f"<b>Generated:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['RussianNormal']))
-            elements.append(
-                Paragraph(f"<b>Number of analyses:</b> {stats.get('total_analyses', 1)}", styles['RussianNormal']))
-
-        elements.append(Spacer(1, 20))
-
-        # Статистика
-        if font_registered:
-            table_data = [
-                ['Показатель', 'Значение'],
-                ['Всего столов обнаружено', stats.get('tables_found', 0)],
-                ['Всего людей обнаружено', stats.get('people_found', 0)],
-                ['Общая загруженность', f"{stats.get('occupancy_rate', 0) * 100:.1f}%"],
-                ['Среднее столов на анализ', f"{stats.get('avg_tables_per_analysis', 0):.1f}"],
-                ['Среднее людей на анализ', f"{stats.get('avg_people_per_analysis', 0):.1f}"]
-            ]
-        else:
-            table_data = [
-                ['Metric', 'Value'],
-                ['Total tables detected', stats.get('tables_found', 0)],
-                ['Total people detected', stats.get('people_found', 0)],
-                ['Overall occupancy rate', f"{stats.get('occupancy_rate', 0) * 100:.1f}%"],
-                ['Average tables per analysis', f"{stats.get('avg_tables_per_analysis', 0):.1f}"],
-                ['Average people per analysis', f"{stats.get('avg_people_per_analysis', 0):.1f}"]
-            ]
-
-        table = Table(table_data, colWidths=[200, 100])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4A6572')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), bold_font_name),
-            ('FONTSIZE', (0, 0), (-1, 0), 11),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#F0F0F0')),
-            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#CCCCCC')),
-            ('FONTNAME', (0, 1), (-1, -1), font_name),
-        ]))
-
-        elements.append(table)
-        elements.append(Spacer(1, 25))
-
-        # Подробная таблица столов (если есть)
-        if 'tables' in stats and stats['tables']:
-            if font_registered:
-                elements.append(Paragraph("Детализация по столам:", styles['RussianHeading2']))
-                tables_data = [['ID', 'Статус', 'Людей', 'Уверенность', 'Время анализа']]
-            else:
-                elements.append(Paragraph("Tables Details:", styles['RussianHeading2']))
-                tables_data = [['ID', 'Status', 'People', 'Confidence', 'Analysis Time']]
+        return data
 
-            elements.append(Spacer(1, 5))
+    start, end = data.get('from'), data.get('to')
+    period = data.get('period', 'all')
+    if not start and period in REPORT_PERIODS:
+        start = (datetime.now() - REPORT_PERIODS[period]).isoformat()
 
-            for table in stats['tables'][:20]:  # Ограничиваем 20 записями
-                if font_registered:
-                    status_text = 'Занят' if table.get('status') == 'occupied' else 'Свободен'
-                else:
-                    status_text = 'Occupied' if table.get('status') == 'occupied' else 'Free'
-
-                tables_data.append([
-                    table.get('id', ''),
-                    status_text,
-                    table.get('person_count', 0),
-                    f"{table.get('confidence', 0) * 100:.1f}%",
-                    table.get('analysis_time', '')[:19] if table.get('analysis_time') else ''
-                ])
-
-            if len(stats['tables']) > 20:
-                if font_registered:
-                    tables_data.append(['', f'... и еще {len(stats["tables"]) - 20} записей', '', '', ''])
-                else:
-                    tables_data.append(['', f'... and {len(stats["tables"]) - 20} more', '', '', ''])
-
-            tables_table = Table(tables_data, colWidths=[40, 60, 50, 70, 110])
-            tables_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#5D9CEC')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#DDDDDD')),
-                ('FONTNAME', (0, 0), (-1, 0), bold_font_name),
-                ('FONTNAME', (0, 1), (-1, -1), font_name),
-                ('FONTSIZE', (0, 0), (-1, -1), 9),
-                ('ALIGN', (0, 0), (0, -1), 'CENTER'),
-                ('ALIGN', (2, 0), (2, -1), 'CENTER'),
-                ('ALIGN', (3, 0), (3, -1), 'CENTER'),
-            ]))
-
-            elements.append(tables_table)
-            elements.append(Spacer(1, 20))
-
-        # Подробная таблица людей (если есть)
-        if 'people' in stats and stats['people']:
-            if font_registered:
-                elements.append(Paragraph("Детализация по людям:", styles['RussianHeading2']))
-                people_data = [['ID', 'Уверенность', 'Координаты', 'Время анализа']]
-            else:
-                elements.append(Paragraph("People Details:", styles['RussianHeading2']))
-                people_data = [['ID', 'Confidence', 'Coordinates', 'Analysis Time']]
-
-            elements.append(Spacer(1, 5))
-
-            for person in stats['people'][:15]:  # Ограничиваем 15 записями
-                bbox = person.get('bbox', [0, 0, 0, 0])
-                people_data.append([
-                    person.get('id', ''),
-                    f"{person.get('confidence', 0) * 100:.1f}%",
-                    f"[{bbox[0]:.0f},{bbox[1]:.0f},{bbox[2]:.0f},{bbox[3]:.0f}]",
-                    person.get('analysis_time', '')[:19] if person.get('analysis_time') else ''
-                ])
-
-            if len(stats['people']) > 15:
-                if font_registered:
-                    people_data.append(['', f'... и еще {len(stats["people"]) - 15} записей', '', ''])
-                else:
-                    people_data.append(['', f'... and {len(stats["people"]) - 15} more', '', ''])
-
-            people_table = Table(people_data, colWidths=[30, 70, 110, 110])
-            people_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#FFCE54')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#333333')),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#DDDDDD')),
-                ('FONTNAME', (0, 0), (-1, 0), bold_font_name),
-                ('FONTNAME', (0, 1), (-1, -1), font_name),
-                ('FONTSIZE', (0, 0), (-1, -1), 9),
-                ('ALIGN', (0, 0), (0, -1), 'CENTER'),
-                ('ALIGN', (1, 0), (1, -1), 'CENTER'),
-            ]))
-
-            elements.append(people_table)
-            elements.append(Spacer(1, 20))
-
-        # Сводная информация
-        if font_registered:
-            elements.append(Paragraph("Сводная информация:", styles['RussianHeading2']))
-
-            summary_elements = []
-            if stats.get('period_start'):
-                summary_elements.append(f"Начало периода: {stats['period_start'][:19]}")
-            if stats.get('period_end'):
-                summary_elements.append(f"Конец периода: {stats['period_end'][:19]}")
-            if stats.get('summary'):
-                summary_elements.append(f"Описание: {stats['summary']}")
-
-            if summary_elements:
-                for item in summary_elements:
-                    elements.append(Paragraph(f"• {item}", styles['RussianMetadata']))
-        else:
-            elements.append(Paragraph("Summary Information:", styles['RussianHeading2']))
+    summary = get_stats_store().summary(start=start, end=end, camera_id=data.get('camera_id'))
+    return {'data': summary, 'period': period, 'summary': True}
 
-            summary_elements = []
-            if stats.get('period_start'):
-                summary_elements.append(f"Period start: {stats['period_start'][:19]}")
-            if stats.get('period_end'):
-                summary_elements.append(f"Period end: {stats['period_end'][:19]}")
-            if stats.get('summary'):
-                summary_elements.append(f"Description: {stats['summary']}")
 
-            if summary_elements:
-                for item in summary_elements:
-                    elements.append(Paragraph(f"• {item}", styles['RussianMetadata']))
+# reportlab и pandas импортируются при первом отчёте своего типа, а не при старте сервера
+def render_pdf_report(data, filepath):
+    """Генерация PDF отчета по результатам анализа"""
+    import report_rendering
 
-    else:
-        if font_registered:
-            elements.append(Paragraph("Данные для отчета не предоставлены.", styles['RussianNormal']))
-        else:
-            elements.append(Paragraph("No data provided for the report.", styles['RussianNormal']))
+    report_rendering.render_pdf_report(data, filepath)
 
-    # Подвал с информацией о системе
-    elements.append(Spacer(1, 30))
-    if font_registered:
-        footer_text = f"Отчет сгенерирован системой AI Cafe Analytics • {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-    else:
-        footer_text = f"Report generated by AI Cafe Analytics • {datetime.now().strftime('%Y-%m-%d %H:%M')}"
 
-    elements.append(Paragraph(footer_text, ParagraphStyle(
-        name='Footer',
-        parent=styles['Normal'],
-        fontName=font_name,
-        fontSize=8,
-        textColor=colors.grey,
-        alignment=TA_CENTER
-    )))
+def render_summary_pdf_report(data, filepath):
+    """Генерация PDF отчета со сводной статистикой (по переданным данным или за диапазон времени)"""
+    import report_rendering
 
-    try:
-        doc.build(elements)
-        return send_file(filepath, as_attachment=True)
-    except Exception as e:
-        print(f"Error generating PDF: {e}")
-        return jsonify({'error': str(e)}), 500
+    report_rendering.render_summary_pdf_report(resolve_report_data(data), filepath)
 
 
-@app.route('/api/report/excel', methods=['POST'])
-def generate_excel_report():
-    """Генерация Excel отчета"""
-    data = request.json
+def render_excel_report(data, filepath):
+    """Генерация Excel отчета (по переданным данным или за диапазон времени)"""
+    import pandas as pd
 
-    os.makedirs('reports', exist_ok=True)
+    data = resolve_report_data(data)
+    # Сводка за период: столы - по камерам за весь диапазон, людей поимённо нет
+    is_summary = data.get('summary', False)
 
     # Создаем DataFrame для столов
     tables_data = []
     if 'data' in data and 'tables' in data['data']:
         for table in data['data']['tables']:
-            tables_data.append({
+            row = {'Камера': table.get('camera_id') or '-'} if is_summary else {}
+            row.update({
                 'ID стола': table['id'],
                 'Статус': 'Занят' if table['status'] == 'occupied' else 'Свободен',
                 'Количество людей': table['person_count'],
@@ -638,6 +1077,10 @@ def generate_excel_report():
                 'Координаты': f"[{table['bbox'][0]:.1f}, {table['bbox'][1]:.1f},"
                               f" {table['bbox'][2]:.1f}, {table['bbox'][3]:.1f}]"
             })
+            if is_summary:
+                row['Доля занятости'] = f"{table['occupancy_rate']:.1%}"
+                row['Анализов'] = table['samples']
+            tables_data.append(row)
 
     # Создаем DataFrame для людей
     people_data = []
@@ -652,9 +1095,6 @@ def generate_excel_report():
                 'Координаты Y2': f"{person['bbox'][3]:.1f}"
             })
 
-    filename = f"cafe_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    filepath = os.path.join('reports', filename)
-
     # Сохранение в Excel с несколькими листами
     with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
         if tables_data:
@@ -663,18 +1103,110 @@ def generate_excel_report():
             pd.DataFrame(people_data).to_excel(writer, sheet_name='Люди', index=False)
 
         # Добавляем суммарный лист
-        summary_data = {
-            'Показатель': ['Всего столов', 'Всего людей', 'Загруженность', 'Дата отчета'],
-            'Значение': [
-                len(tables_data),
-                len(people_data),
-                f"{data.get('data', {}).get('occupancy_rate', 0) * 100:.1f}%" if 'data' in data else "0%",
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            ]
-        }
+        occupancy = f"{data.get('data', {}).get('occupancy_rate', 0) * 100:.1f}%" if 'data' in data else "0%"
+        report_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if is_summary:
+            # Детекции за все анализы периода, а не строки листов
+            summary = data['data']
+            summary_data = {
+                'Показатель': ['Анализов', 'Всего столов', 'Всего людей', 'Загруженность',
+                               'Начало периода', 'Конец периода', 'Дата отчета'],
+                'Значение': [
+                    summary['total_analyses'],
+                    summary['tables_found'],
+                    summary['people_found'],
+                    occupancy,
+                    summary.get('period_start') or '-',
+                    summary.get('period_end') or '-',
+                    report_date,
+                ]
+            }
+        else:
+            summary_data = {
+                'Показатель': ['Всего столов', 'Всего людей', 'Загруженность', 'Дата отчета'],
+                'Значение': [len(tables_data), len(people_data), occupancy, report_date]
+            }
         pd.DataFrame(summary_data).to_excel(writer, sheet_name='Сводка', index=False)
 
-    return send_file(filepath, as_attachment=True)
+
+# Фоновая генерация отчётов: тип -> (функция рендеринга, префикс имени файла, расширение)
+report_jobs = ReportJobs(
+    {
+        'pdf': (render_pdf_report, 'cafe_report', 'pdf'),
+        'summary_pdf': (render_summary_pdf_report, 'cafe_summary_report', 'pdf'),
+        'excel': (render_excel_report, 'cafe_report', 'xlsx'),
+    },
+    folder=app.config['REPORTS_FOLDER'],
+    workers=app.config['REPORT_WORKERS'],
+    ttl=app.config['REPORT_TTL'],
+    max_total_bytes=app.config['REPORTS_MAX_BYTES'],
+)
+
+
+def submit_report(kind):
+    """
+    Постановка отчёта в очередь: ответ 202 с id задания.
+    С параметром ?wait=1 ждём готовности и сразу отдаём файл
+    """
+    job = report_jobs.submit(kind, request.json or {})
+    if request.args.get('wait') in ('1', 'true'):
+        return send_report(report_jobs.wait(job['id']))
+
+    response = jsonify(dict(report_jobs.public(job), url=f"/api/report/{job['id']}"))
+    response.headers['Location'] = f"/api/report/{job['id']}"
+    return response, 202
+
+
+def send_report(job):
+    if job is None:
+        return jsonify({'error': 'Report not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify(report_jobs.public(job)), 500
+    if job['status'] != 'done':
+        return jsonify(report_jobs.public(job)), 202
+    if not os.path.exists(job['filepath']):
+        return jsonify({'error': 'Report expired'}), 410
+    return send_file(job['filepath'], as_attachment=True, download_name=job['filename'])
+
+
+@app.route('/api/report/pdf', methods=['POST'])
+def generate_pdf_report():
+    """Генерация PDF отчета"""
+    return submit_report('pdf')
+
+
+@app.route('/api/report/summary_pdf', methods=['POST'])
+def generate_summary_pdf_report():
+    """Генерация PDF отчета со сводной статистикой"""
+    return submit_report('summary_pdf')
+
+
+@app.route('/api/report/excel', methods=['POST'])
+def generate_excel_report():
+    """Генерация Excel отчета"""
+    return submit_report('excel')
+
+
+@app.route('/api/report/<job_id>', methods=['GET'])
+def get_report(job_id):
+    """Готовый отчёт (файл) или состояние задания, если он ещё генерируется"""
+    return send_report(report_jobs.get(job_id))
+
+
+# Значения, которые снимаются в момент запроса /metrics
+metrics.gauge('models_loaded', 'Модели загружены (1/0)', lambda: int(detectors.loaded))
+metrics.gauge('inference_queue_depth', 'Кадров в очереди инференса', lambda: scheduler.queue_depth)
+metrics.gauge('last_inference_seconds', 'Время последнего батча инференса',
+              lambda: scheduler.last_batch_ms / 1000 if scheduler.last_batch_ms is not None else None)
+metrics.gauge('active_streams', 'Активные видеопотоки', lambda: len(streams.list()))
+metrics.gauge('camera_polling_slowdown', 'Замедление опроса камер из-за нагрузки', lambda: camera_scheduler.slowdown)
+metrics.gauge('result_cache_entries', 'Записей в кэше результатов', lambda: result_cache.stats()['entries'])
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/health', methods=['GET'])
@@ -682,7 +1214,14 @@ def health_check():
     """Проверка состояния сервера"""
     return jsonify({
         'status': 'healthy',
-        'models_loaded': person_model is not None and table_model is not None,
+        'models_loaded': detectors.loaded,
+        'inference_backend': detectors.backend,
+        'ready': readiness['ready'],
+        'models_loading': readiness['loading'],
+        'warmup_ms': readiness['warmup_ms'],
+        'queue_depth': scheduler.queue_depth,
+        'last_inference_ms': scheduler.last_batch_ms,
+        'pid': readiness['pid'],
         'timestamp': datetime.now().isoformat()
     })
 
@@ -690,11 +1229,14 @@ def health_check():
 if __name__ == '__main__':
     # Создание необходимых директорий
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs('reports', exist_ok=True)
+    os.makedirs(app.config['REPORTS_FOLDER'], exist_ok=True)
     os.makedirs('models', exist_ok=True)
 
-    # Загрузка моделей при запуске
-    if not load_models():
-        print("Warning: Models failed to load. The server will attempt to load them on first request.")
+    # В режиме отладки запросы обслуживает дочерний процесс перезапуска (reloader):
+    # модели и опрос камер запускаются только в нём, а не в следящем родителе
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Модели загружаются в фоне, сервер принимает запросы сразу
+        start_warmup()
+        start_camera_polling()
 
     app.run(debug=True, port=5000)
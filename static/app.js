@@ -1,12 +1,21 @@
 class CafeTableAnalyzer {
     constructor() {
         this.models = {};
-        this.history = JSON.parse(localStorage.getItem('cafeAnalysisHistory') || '[]');
+        this.apiBaseUrl = 'http://localhost:5000';
+        // Локальная копия последних записей истории сервера и курсор синхронизации (id последней записи)
+        this.historyLimit = 50;
+        this.historyCursor = Number(localStorage.getItem('cafeHistoryCursor') || 0);
+        this.historyEtag = null;
+        // Старая локальная история без серверных id не сливается с серверной
+        this.history = localStorage.getItem('cafeHistoryCursor') === null
+            ? [] : JSON.parse(localStorage.getItem('cafeAnalysisHistory') || '[]');
         this.currentResults = null;
         this.initElements();
         this.initEventListeners();
         this.loadHistory();
-        this.apiBaseUrl = 'http://localhost:5000';
+        this.syncHistory();
+        // Записи добавляют и другие клиенты, и серверный опрос камер; без изменений сервер отвечает 304
+        setInterval(() => this.syncHistory(), 15000);
     }
 
     initElements() {
@@ -362,19 +371,62 @@ class CafeTableAnalyzer {
     }
 
     saveToHistory(results) {
-        const historyItem = {
-            id: Date.now(),
-            ...results,
-            image: null // Не сохраняем base64 в историю для экономии места
-        };
+        // Сервер уже сохранил результат анализа - забираем новые записи истории
+        this.syncHistory();
+    }
+
+    async syncHistory() {
+        // Инкрементальная синхронизация: только записи новее курсора
+        const params = new URLSearchParams({ since: this.historyCursor, limit: this.historyLimit, tail: 1 });
+        let page;
+        try {
+            const response = await fetch(`${this.apiBaseUrl}/api/history?${params}`, {
+                headers: this.historyEtag ? { 'If-None-Match': this.historyEtag } : {}
+            });
+            if (response.status === 304 || !response.ok) {
+                return;
+            }
+            this.historyEtag = response.headers.get('ETag');
+            page = await response.json();
+        } catch (error) {
+            console.error('Ошибка синхронизации истории:', error);
+            return;
+        }
+
+        // История на сервере создана заново - начинаем с чистого листа
+        if (page.latest_id < this.historyCursor) {
+            this.history = [];
+            this.historyCursor = 0;
+            this.historyEtag = null;
+            this.loadHistory();
+            return this.syncHistory();
+        }
 
-        this.history.unshift(historyItem);
-        if (this.history.length > 50) {
-            this.history = this.history.slice(0, 50);
+        const items = page.entries.map(entry => ({ ...entry.data, id: entry.id, timestamp: entry.timestamp }));
+        this.historyCursor = page.cursor;
+        this.mergeHistory(items);
+        localStorage.setItem('cafeHistoryCursor', String(this.historyCursor));
+    }
+
+    mergeHistory(items) {
+        // Новые записи (по возрастанию id) добавляются в начало списка без перерисовки старых
+        const known = new Set(this.history.map(item => item.id));
+        const fresh = items.filter(item => !known.has(item.id)).reverse();
+        if (fresh.length === 0) {
+            return;
         }
 
+        const wasEmpty = this.history.length === 0;
+        this.history = fresh.concat(this.history).slice(0, this.historyLimit);
         localStorage.setItem('cafeAnalysisHistory', JSON.stringify(this.history));
-        this.loadHistory();
+
+        if (wasEmpty) {
+            this.historyList.innerHTML = '';
+        }
+        this.historyList.insertAdjacentHTML('afterbegin', fresh.map(item => this.renderHistoryItem(item)).join(''));
+        while (this.historyList.children.length > this.historyLimit) {
+            this.historyList.lastElementChild.remove();
+        }
     }
 
     loadHistory() {
@@ -383,31 +435,33 @@ class CafeTableAnalyzer {
             return;
         }
 
-        this.historyList.innerHTML = this.history.map(item => {
-            const date = new Date(item.timestamp || new Date());
-            const tables = item.tables || [];
-            const people = item.people || [];
-            const occupied = tables.filter(t => t.status === 'occupied').length;
-            const total = tables.length;
-            const free = total - occupied;
-
-            return `
-                <div class="history-item p-3">
-                    <div class="d-flex justify-content-between align-items-start">
-                        <div>
-                            <small class="text-muted">${date.toLocaleString('ru-RU')}</small>
-                            <div class="mt-1">
-                                <span class="badge bg-primary">${total} столов</span>
-                                <span class="badge bg-danger">${occupied} занято</span>
-                                <span class="badge bg-success">${free} свободно</span>
-                                <span class="badge bg-warning">${people.length} людей</span>
-                            </div>
+        this.historyList.innerHTML = this.history.map(item => this.renderHistoryItem(item)).join('');
+    }
+
+    renderHistoryItem(item) {
+        const date = new Date(item.timestamp || new Date());
+        const tables = item.tables || [];
+        const people = item.people || [];
+        const occupied = tables.filter(t => t.status === 'occupied').length;
+        const total = tables.length;
+        const free = total - occupied;
+
+        return `
+            <div class="history-item p-3">
+                <div class="d-flex justify-content-between align-items-start">
+                    <div>
+                        <small class="text-muted">${date.toLocaleString('ru-RU')}</small>
+                        <div class="mt-1">
+                            <span class="badge bg-primary">${total} столов</span>
+                            <span class="badge bg-danger">${occupied} занято</span>
+                            <span class="badge bg-success">${free} свободно</span>
+                            <span class="badge bg-warning">${people.length} людей</span>
                         </div>
-                        <small class="text-muted">${((item.occupancy_rate || 0) * 100).toFixed(0)}%</small>
                     </div>
+                    <small class="text-muted">${((item.occupancy_rate || 0) * 100).toFixed(0)}%</small>
                 </div>
-            `;
-        }).join('');
+            </div>
+        `;
     }
 
     showReportModal() {
@@ -450,13 +504,7 @@ class CafeTableAnalyzer {
         try {
             const reportData = this.prepareReportData(period);
 
-            const response = await fetch(`${this.apiBaseUrl}/api/report/pdf`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(reportData)
-            });
+            const response = await this.requestReport('pdf', reportData);
 
             if (!response.ok) {
                 const contentType = response.headers.get('content-type');
@@ -479,15 +527,9 @@ class CafeTableAnalyzer {
 
     async generateSummaryPDFReport(period) {
         try {
-            const reportData = this.prepareReportData(period);
+            const reportData = this.prepareRangeReportData(period);
 
-            const response = await fetch(`${this.apiBaseUrl}/api/report/summary_pdf`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(reportData)
-            });
+            const response = await this.requestReport('summary_pdf', reportData);
 
             if (!response.ok) {
                 const contentType = response.headers.get('content-type');
@@ -510,15 +552,9 @@ class CafeTableAnalyzer {
 
     async generateExcelReport(period) {
         try {
-            const reportData = this.prepareReportData(period);
+            const reportData = this.prepareRangeReportData(period);
 
-            const response = await fetch(`${this.apiBaseUrl}/api/report/excel`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(reportData)
-            });
+            const response = await this.requestReport('excel', reportData);
 
             if (!response.ok) {
                 const contentType = response.headers.get('content-type');
@@ -539,6 +575,25 @@ class CafeTableAnalyzer {
         }
     }
 
+    async requestReport(type, reportData) {
+        // Отчет генерируется на сервере в фоне: получаем id задания и ждем готовности файла
+        let response = await fetch(`${this.apiBaseUrl}/api/report/${type}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(reportData)
+        });
+
+        while (response.status === 202) {
+            const job = await response.json();
+            await new Promise(resolve => setTimeout(resolve, 500));
+            response = await fetch(`${this.apiBaseUrl}/api/report/${job.id}`);
+        }
+
+        return response;
+    }
+
     prepareReportData(period) {
         let data;
         if (period === 'current') {
@@ -564,6 +619,18 @@ class CafeTableAnalyzer {
         return data;
     }
 
+    prepareRangeReportData(period) {
+        if (period === 'current') {
+            return this.prepareReportData(period);
+        }
+
+        // Сводка за период строится на сервере по накопленной статистике
+        return {
+            'period': period,
+            'summary': true
+        };
+    }
+
     createSummaryReport(history) {
         if (!history || history.length === 0) {
             return {
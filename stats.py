@@ -0,0 +1,251 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from history import time_bound
+
+
+# Длина префикса ISO-времени, задающего корзину, и суффикс до полного ISO-времени
+GRANULARITIES = {
+    'minute': (16, ':00'),
+    'hour': (13, ':00:00'),
+    'day': (10, 'T00:00:00'),
+}
+
+
+def bucket_start(timestamp, granularity):
+    """Начало корзины для ISO-времени: 2024-05-01T12:34:56 -> 2024-05-01T12:00:00 для 'hour'"""
+    length, suffix = GRANULARITIES[granularity]
+    return timestamp[:length] + suffix
+
+
+def bucket_bound(value, granularity, end=False):
+    """Корзина границы диапазона для ISO-времени или даты (ValueError, если не разбирается)"""
+    return bucket_start(time_bound(value, end), granularity)
+
+
+class StatsStore:
+    """
+    Предагрегированная статистика занятости в SQLite.
+    При сохранении каждого анализа обновляются поминутные, почасовые и
+    дневные корзины по камере (table_id = 0) и по каждому столу, поэтому
+    запрос статистики за период стоит O(корзин), а не O(анализов)
+    """
+
+    # Поминутные корзины старше этого срока удаляются
+    MINUTE_RETENTION = timedelta(days=7)
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._records = 0
+
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            tables = {name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS rollups (
+                    granularity TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    camera_id TEXT NOT NULL,
+                    table_id INTEGER NOT NULL,
+                    samples INTEGER NOT NULL DEFAULT 0,
+                    tables_sum INTEGER NOT NULL DEFAULT 0,
+                    people_sum INTEGER NOT NULL DEFAULT 0,
+                    occupied_sum INTEGER NOT NULL DEFAULT 0,
+                    occupancy_rate_sum REAL NOT NULL DEFAULT 0,
+                    confidence_sum REAL NOT NULL DEFAULT 0,
+                    max_people INTEGER NOT NULL DEFAULT 0,
+                    last_bbox TEXT,
+                    PRIMARY KEY (granularity, camera_id, bucket, table_id)
+                )
+            """)
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            # База без meta заполнялась по истории сразу при создании
+            if 'rollups' in tables and 'meta' not in tables:
+                connection.execute("INSERT INTO meta (key, value) VALUES ('backfilled', ?)",
+                                   (datetime.now().isoformat(),))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _rows(results, camera_id, timestamp):
+        tables = results.get('tables') or []
+        occupied = sum(1 for table in tables if table.get('status') == 'occupied')
+        people = results.get('people_found', len(results.get('people') or []))
+
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(timestamp, granularity)
+            # Строка камеры: samples - число анализов
+            yield (granularity, bucket, camera_id, 0, 1, len(tables), people, occupied,
+                   results.get('occupancy_rate', 0), 0.0, people, None)
+            # Строки столов: samples - сколько раз стол попал в анализ, occupied_sum - сколько раз был занят
+            for table in tables:
+                yield (granularity, bucket, camera_id, int(table['id']), 1, 0, table.get('person_count', 0),
+                       int(table.get('status') == 'occupied'), 0.0, table.get('confidence', 0),
+                       table.get('person_count', 0), json.dumps(table.get('bbox')))
+
+    def get_meta(self, key):
+        """Служебное значение базы (None, если не задано)"""
+        row = self._connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self._connection().execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def clear(self):
+        """Удаление всех корзин"""
+        with self._write_lock:
+            self._connection().execute('DELETE FROM rollups')
+
+    def record(self, results, camera_id=None, timestamp=None):
+        """Учёт одного анализа в корзинах всех гранулярностей"""
+        self.record_many([(results, camera_id, timestamp)])
+
+    def record_many(self, items):
+        rows = []
+        for results, camera_id, timestamp in items:
+            timestamp = timestamp or results.get('timestamp') or datetime.now().isoformat()
+            rows.extend(self._rows(results, camera_id or '', timestamp))
+
+        connection = self._connection()
+        with self._write_lock:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany("""
+                    INSERT INTO rollups (granularity, bucket, camera_id, table_id, samples, tables_sum, people_sum,
+                                         occupied_sum, occupancy_rate_sum, confidence_sum, max_people, last_bbox)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (granularity, camera_id, bucket, table_id) DO UPDATE SET
+                        samples = samples + excluded.samples,
+                        tables_sum = tables_sum + excluded.tables_sum,
+                        people_sum = people_sum + excluded.people_sum,
+                        occupied_sum = occupied_sum + excluded.occupied_sum,
+                        occupancy_rate_sum = occupancy_rate_sum + excluded.occupancy_rate_sum,
+                        confidence_sum = confidence_sum + excluded.confidence_sum,
+                        max_people = MAX(max_people, excluded.max_people),
+                        last_bbox = COALESCE(excluded.last_bbox, last_bbox)
+                """, rows)
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+            self._records += len(items)
+            if self._records >= self.PRUNE_EVERY:
+                self._records = 0
+                cutoff = (datetime.now() - self.MINUTE_RETENTION).isoformat()
+                connection.execute("DELETE FROM rollups WHERE granularity = 'minute' AND bucket < ?", (cutoff,))
+
+    def _select(self, granularity, start, end, camera_id):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity: {granularity}")
+        conditions, params = ['granularity = ?'], [granularity]
+        if start:
+            conditions.append('bucket >= ?')
+            params.append(bucket_bound(start, granularity))
+        if end:
+            conditions.append('bucket <= ?')
+            params.append(bucket_bound(end, granularity, end=True))
+        if camera_id is not None:
+            conditions.append('camera_id = ?')
+            params.append(camera_id)
+        return self._connection().execute(f"""
+            SELECT bucket, camera_id, table_id, samples, tables_sum, people_sum, occupied_sum,
+                   occupancy_rate_sum, confidence_sum, max_people, last_bbox
+            FROM rollups WHERE {' AND '.join(conditions)}
+            ORDER BY bucket, camera_id, table_id
+        """, params).fetchall()
+
+    def query(self, start=None, end=None, granularity='hour', camera_id=None):
+        """Корзины статистики за период: средние по камере и занятость каждого стола"""
+        buckets = {}
+        for (bucket, camera, table_id, samples, tables_sum, people_sum, occupied_sum,
+             occupancy_rate_sum, confidence_sum, max_people, _) in self._select(granularity, start, end, camera_id):
+            entry = buckets.setdefault((bucket, camera), {'bucket': bucket, 'camera_id': camera, 'tables': []})
+            if table_id == 0:
+                entry.update({
+                    'analyses': samples,
+                    'avg_tables': tables_sum / samples,
+                    'avg_people': people_sum / samples,
+                    'max_people': max_people,
+                    'occupancy_rate': occupancy_rate_sum / samples,
+                })
+            else:
+                entry['tables'].append({
+                    'id': table_id,
+                    'samples': samples,
+                    'occupancy_rate': occupied_sum / samples,
+                    'avg_people': people_sum / samples,
+                })
+        return list(buckets.values())
+
+    def summary(self, start=None, end=None, camera_id=None, granularity='hour'):
+        """
+        Сводная статистика за период в формате данных сводного отчёта
+        (tables_found, people_found, occupancy_rate, tables, ...)
+        """
+        analyses = tables_sum = people_sum = occupied_sum = 0
+        first_bucket = last_bucket = None
+        tables = {}
+
+        for (bucket, camera, table_id, samples, bucket_tables, bucket_people, bucket_occupied,
+             _, confidence_sum, _, last_bbox) in self._select(granularity, start, end, camera_id):
+            first_bucket = first_bucket or bucket
+            last_bucket = bucket
+            if table_id == 0:
+                analyses += samples
+                tables_sum += bucket_tables
+                people_sum += bucket_people
+                occupied_sum += bucket_occupied
+                continue
+            key = (camera, table_id)
+            table = tables.setdefault(key, {'samples': 0, 'occupied': 0, 'people': 0, 'confidence': 0.0})
+            table['samples'] += samples
+            table['occupied'] += bucket_occupied
+            table['people'] += bucket_people
+            table['confidence'] += confidence_sum
+            table['bbox'] = json.loads(last_bbox) if last_bbox else [0, 0, 0, 0]
+
+        tables_data = []
+        for (camera, table_id), table in sorted(tables.items()):
+            occupancy_rate = table['occupied'] / table['samples']
+            tables_data.append({
+                'id': table_id,
+                'camera_id': camera,
+                'status': 'occupied' if occupancy_rate >= 0.5 else 'free',
+                'occupancy_rate': occupancy_rate,
+                'person_count': round(table['people'] / table['samples']),
+                'confidence': table['confidence'] / table['samples'],
+                'bbox': table['bbox'],
+                'samples': table['samples'],
+            })
+
+        return {
+            'tables_found': tables_sum,
+            'people_found': people_sum,
+            'tables': tables_data,
+            'people': [],
+            'occupancy_rate': occupied_sum / tables_sum if tables_sum else 0,
+            'total_analyses': analyses,
+            'avg_tables_per_analysis': tables_sum / analyses if analyses else 0,
+            'avg_people_per_analysis': people_sum / analyses if analyses else 0,
+            'period_start': start or first_bucket,
+            'period_end': end or last_bucket,
+            'summary': f'Сводный отчет за период: {analyses} анализов',
+        }
@@ -0,0 +1,242 @@
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+import cv2
+
+
+# Пределы частоты анализа кадров видеопотока (кадров в секунду)
+MIN_FPS = 0.01
+MAX_FPS = 60.0
+
+# Схемы URL, которые можно указать источником видеопотока
+STREAM_SCHEMES = ('rtsp', 'rtsps', 'http', 'https')
+
+
+class VideoStream:
+    """
+    Анализ видеопотока (файл или RTSP/HTTP URL) в фоновых потоках.
+    Поток чтения декодирует кадры и хранит только самый свежий, поэтому
+    кадры, которые инференс не успевает обработать, отбрасываются.
+    Поток анализа берёт последний кадр, вызывает analyze и рассылает
+    результат подписчикам.
+    """
+
+    # Сколько результатов держим в очереди медленного подписчика
+    SUBSCRIBER_QUEUE_SIZE = 16
+
+    def __init__(self, source, analyze, max_fps=None, on_result=None, stream_id=None):
+        self.id = stream_id or uuid.uuid4().hex[:12]
+        self.source = source
+        self.analyze = analyze
+        self.max_fps = max_fps
+        self.on_result = on_result
+        # Локальный файл читаем в темпе его FPS, чтобы он вёл себя как камера
+        self.realtime = os.path.exists(source)
+
+        self._stop = threading.Event()
+        self._frame_ready = threading.Condition()
+        self._frame = None
+        self._frame_index = 0
+        self._reader_done = False
+        self._subscribers = []
+        self._subscribers_lock = threading.Lock()
+        self._threads = []
+
+        self.frames_read = 0
+        self.frames_analyzed = 0
+        self.last_result = None
+        self.error = None
+        self.started_at = None
+
+    def start(self):
+        self.started_at = time.time()
+        for target, name in ((self._read_loop, 'reader'), (self._analyze_loop, 'analyzer')):
+            thread = threading.Thread(target=target, name=f'stream-{self.id}-{name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._frame_ready:
+            self._frame_ready.notify_all()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def _read_loop(self):
+        capture = cv2.VideoCapture(self.source)
+        try:
+            if not capture.isOpened():
+                self.error = f'Failed to open video source: {self.source}'
+                return
+
+            fps = capture.get(cv2.CAP_PROP_FPS) or 0
+            frame_interval = 1 / fps if self.realtime and fps > 0 else 0
+            next_frame_at = time.monotonic()
+
+            while not self._stop.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                self.frames_read += 1
+
+                # Подменяем непрочитанный кадр свежим - так отбрасываются лишние кадры
+                with self._frame_ready:
+                    self._frame = frame
+                    self._frame_index = self.frames_read
+                    self._frame_ready.notify()
+
+                if frame_interval:
+                    next_frame_at += frame_interval
+                    delay = next_frame_at - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+        finally:
+            capture.release()
+            with self._frame_ready:
+                self._reader_done = True
+                self._frame_ready.notify_all()
+
+    def _analyze_loop(self):
+        min_interval = 1 / self.max_fps if self.max_fps else 0
+        last_started = 0
+
+        while not self._stop.is_set():
+            with self._frame_ready:
+                while self._frame is None and not self._reader_done and not self._stop.is_set():
+                    self._frame_ready.wait()
+                if self._frame is None:
+                    break
+                frame, frame_index = self._frame, self._frame_index
+                self._frame = None
+
+            if min_interval:
+                delay = last_started + min_interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            last_started = time.monotonic()
+
+            try:
+                results = self.analyze(frame)
+            except Exception as e:
+                print(f"Error during stream analysis: {e}")
+                self._publish('error', {'error': str(e)})
+                continue
+
+            self.frames_analyzed += 1
+            results['stream'] = {'id': self.id, 'frame_index': frame_index, 'frames_dropped': self.frames_dropped}
+            self.last_result = results
+            if self.on_result is not None:
+                self.on_result(results)
+            self._publish('result', results)
+
+        self._publish('end', self.stats())
+
+    @property
+    def frames_dropped(self):
+        return max(self.frames_read - self.frames_analyzed, 0)
+
+    def _publish(self, event, data):
+        message = (event, data)
+        with self._subscribers_lock:
+            for subscriber in self._subscribers:
+                # Медленный подписчик теряет самые старые результаты, а не тормозит анализ
+                while True:
+                    try:
+                        subscriber.put_nowait(message)
+                        break
+                    except queue.Full:
+                        try:
+                            subscriber.get_nowait()
+                        except queue.Empty:
+                            pass
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.SUBSCRIBER_QUEUE_SIZE)
+        with self._subscribers_lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._subscribers_lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def events(self, keepalive=15):
+        """Генератор сообщений Server-Sent Events с результатами анализа"""
+        subscriber = self.subscribe()
+        try:
+            if self.last_result is not None:
+                yield format_sse('result', self.last_result)
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    if not self.running:
+                        yield format_sse('end', self.stats())
+                        return
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_sse(event, data)
+                if event == 'end':
+                    return
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        elapsed = time.time() - self.started_at if self.started_at else 0
+        return {
+            'id': self.id,
+            'source': self.source,
+            'running': self.running,
+            'error': self.error,
+            'frames_read': self.frames_read,
+            'frames_analyzed': self.frames_analyzed,
+            'frames_dropped': self.frames_dropped,
+            'analyzed_fps': self.frames_analyzed / elapsed if elapsed else 0.0,
+        }
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StreamManager:
+    """Реестр активных видеопотоков"""
+
+    def __init__(self, max_streams=32):
+        self.max_streams = max_streams
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def start(self, source, analyze, **kwargs):
+        with self._lock:
+            # Завершившиеся потоки не занимают место
+            for stream_id in [sid for sid, stream in self._streams.items() if not stream.running]:
+                del self._streams[stream_id]
+            if len(self._streams) >= self.max_streams:
+                raise RuntimeError(f'Too many active streams (max {self.max_streams})')
+            stream = VideoStream(source, analyze, **kwargs)
+            self._streams[stream.id] = stream
+        return stream.start()
+
+    def get(self, stream_id):
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def stop(self, stream_id):
+        with self._lock:
+            stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            stream.stop()
+        return stream
+
+    def list(self):
+        with self._lock:
+            return [stream.stats() for stream in self._streams.values()]
@@ -0,0 +1,214 @@
+import math
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from occupancy import iou_matrix
+
+
+# Размер уменьшенного кадра для дешёвой проверки смены сцены
+THUMBNAIL_SIZE = (64, 36)
+
+# Размер кадра для поиска движения: мелкий шум пропадает при уменьшении и размытии
+MOTION_SIZE = (160, 90)
+
+# Изменение кадра: доля изменившихся пикселей, их габарит в координатах кадра
+# (x1, y1, x2, y2 или None) и уменьшенный кадр, с которым сравнивались
+Motion = namedtuple('Motion', ['fraction', 'region', 'frame'])
+
+
+def scene_thumbnail(image):
+    """Уменьшенная серая копия кадра для сравнения сцен"""
+    small = cv2.resize(image, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+
+def motion_frame(image):
+    """Уменьшенная размытая серая копия кадра для поиска движения"""
+    small = cv2.resize(image, MOTION_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+
+def frame_motion(reference, image, pixel_threshold=25):
+    """Изменение кадра image относительно уменьшенного кадра reference (Motion)"""
+    frame = motion_frame(image)
+    if reference is None:
+        return Motion(1.0, None, frame)
+    mask = cv2.absdiff(reference, frame) > pixel_threshold
+    fraction = float(mask.mean())
+    if not fraction:
+        return Motion(0.0, None, frame)
+
+    ys, xs = np.nonzero(mask)
+    scale_x, scale_y = image.shape[1] / MOTION_SIZE[0], image.shape[0] / MOTION_SIZE[1]
+    region = (int(xs.min() * scale_x), int(ys.min() * scale_y),
+              math.ceil((xs.max() + 1) * scale_x), math.ceil((ys.max() + 1) * scale_y))
+    return Motion(fraction, region, frame)
+
+
+class TableTracker:
+    """
+    IoU-трекер столов для одной камеры.
+    Столы получают стабильные id, детекция столов перезапускается раз в
+    redetect_every кадров или при смене сцены; между ними используются
+    сохранённые треки, а на каждом кадре детектируются только люди.
+    """
+
+    def __init__(self, redetect_every=30, scene_change_threshold=12.0, match_iou=0.3, max_misses=3):
+        self.redetect_every = redetect_every
+        self.scene_change_threshold = scene_change_threshold
+        self.match_iou = match_iou
+        self.max_misses = max_misses
+
+        self.tracks = []
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self._next_id = 1
+        self._frames_since_detection = None
+        self._reference_thumbnail = None
+        # Версия схемы столов камеры, с которой ведётся трекинг (см. TrackingSessions.get)
+        self.layout_version = None
+
+        # Пропуск инференса на статичной сцене: результат последнего анализа
+        # с моделью и уменьшенный кадр, на котором он получен
+        self.last_result = None
+        self.last_analyzed_at = None
+        self._motion_reference = None
+        self.motion_stats = {'frames': 0, 'reused': 0, 'regions': 0, 'full': 0}
+
+    def needs_table_detection(self, image):
+        """Нужно ли заново детектировать столы на этом кадре"""
+        if self._frames_since_detection is None or self._frames_since_detection + 1 >= self.redetect_every:
+            return True
+        if self._reference_thumbnail is None:
+            return True
+        diff = np.abs(scene_thumbnail(image) - self._reference_thumbnail).mean()
+        return diff > self.scene_change_threshold
+
+    def skip_table_detection(self):
+        """Кадр обработан без детекции столов"""
+        self._frames_since_detection += 1
+        self.last_used = time.time()
+
+    def update(self, image, boxes, confidence):
+        """Сопоставление новых детекций столов с треками"""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        confidence = np.asarray(confidence, dtype=np.float64).reshape(-1)
+        self._frames_since_detection = 0
+        self._reference_thumbnail = scene_thumbnail(image)
+        self.last_used = time.time()
+
+        matched_tracks, matched_detections = set(), set()
+        if self.tracks and len(boxes):
+            iou = iou_matrix(np.array([track['bbox'] for track in self.tracks]), boxes)
+            # Жадное сопоставление по убыванию IoU
+            for flat in np.argsort(iou, axis=None)[::-1]:
+                t, d = np.unravel_index(flat, iou.shape)
+                if iou[t, d] < self.match_iou:
+                    break
+                if t in matched_tracks or d in matched_detections:
+                    continue
+                matched_tracks.add(t)
+                matched_detections.add(d)
+                self.tracks[t].update({'bbox': boxes[d].tolist(), 'confidence': float(confidence[d]), 'misses': 0})
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track['misses'] += 1
+
+        for d in range(len(boxes)):
+            if d not in matched_detections:
+                self.tracks.append({
+                    'id': self._next_id,
+                    'bbox': boxes[d].tolist(),
+                    'confidence': float(confidence[d]),
+                    'misses': 0,
+                    'occupied_since': None,
+                })
+                self._next_id += 1
+
+        # Стол, не найденный несколько детекций подряд, считаем исчезнувшим
+        self.tracks = [track for track in self.tracks if track['misses'] <= self.max_misses]
+
+    def use_layout(self, boxes, ids):
+        """Столы из статической схемы камеры: треки задаются схемой, время занятости сохраняется по id"""
+        previous = {track['id']: track for track in self.tracks}
+        self.tracks = [{
+            'id': table_id,
+            'bbox': list(box),
+            'confidence': 1.0,
+            'misses': 0,
+            'occupied_since': previous[table_id]['occupied_since'] if table_id in previous else None,
+        } for table_id, box in zip(ids, np.asarray(boxes, dtype=np.float64).tolist())]
+        # Если схему удалят, новые треки не должны занять id из схемы
+        self._next_id = max([self._next_id, *(table_id + 1 for table_id in ids)])
+        self.last_used = time.time()
+
+    def motion(self, image, pixel_threshold=25):
+        """Изменение кадра относительно кадра последнего анализа с моделью"""
+        return frame_motion(self._motion_reference, image, pixel_threshold)
+
+    def remember_analysis(self, result, motion, decision):
+        """Результат анализа с моделью (decision - 'full' или 'regions') становится опорным"""
+        self.last_result = result
+        self.last_analyzed_at = time.time()
+        self._motion_reference = motion.frame
+        self.count_motion(decision)
+
+    def count_motion(self, decision):
+        self.motion_stats['frames'] += 1
+        self.motion_stats[decision] += 1
+
+    def update_dwell(self, table_ids, occupied, now=None):
+        """Время занятости каждого стола (секунды с момента, когда он стал занят); массив по table_ids"""
+        now = now or time.time()
+        tracks = {track['id']: track for track in self.tracks}
+        dwell = np.zeros(len(table_ids), dtype=np.float64)
+        for i, (table_id, is_occupied) in enumerate(zip(table_ids, occupied)):
+            track = tracks.get(table_id)
+            if track is None:
+                continue
+            if is_occupied:
+                if track['occupied_since'] is None:
+                    track['occupied_since'] = now
+                dwell[i] = round(now - track['occupied_since'], 3)
+            else:
+                track['occupied_since'] = None
+        return dwell
+
+
+class TrackingSessions:
+    """Трекеры столов по камерам; неиспользуемые сессии удаляются по TTL"""
+
+    def __init__(self, ttl=600, **tracker_options):
+        self.ttl = ttl
+        self.tracker_options = tracker_options
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, camera_id, layout_version=None):
+        """Трекер камеры; если схема столов камеры сменилась (layout_version), состояние начинается заново"""
+        with self._lock:
+            now = time.time()
+            for key in [key for key, tracker in self._sessions.items() if now - tracker.last_used > self.ttl]:
+                del self._sessions[key]
+            tracker = self._sessions.get(camera_id)
+            if tracker is None or tracker.layout_version != layout_version:
+                tracker = self._sessions[camera_id] = TableTracker(**self.tracker_options)
+                tracker.layout_version = layout_version
+            return tracker
+
+    def reset(self, camera_id):
+        with self._lock:
+            return self._sessions.pop(camera_id, None) is not None
+
+    def motion_stats(self):
+        """Статистика пропуска инференса по камерам: кадры, повторно использованные результаты, доля пропусков"""
+        with self._lock:
+            stats = {camera_id: dict(tracker.motion_stats) for camera_id, tracker in self._sessions.items()}
+        for camera_stats in stats.values():
+            camera_stats['skip_rate'] = camera_stats['reused'] / max(camera_stats['frames'], 1)
+        return stats
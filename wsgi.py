@@ -0,0 +1,116 @@
+"""
+Точка входа для production-сервера.
+
+    gunicorn -c gunicorn.conf.py "wsgi:create_app()"
+
+или просто `python wsgi.py` (gunicorn с теми же настройками, а на системах
+без gunicorn - встроенный многопоточный сервер Flask в одном процессе)
+
+По умолчанию сервер работает одним процессом с потоками: параллельные
+запросы собираются в батчи планировщиком инференса, а torch использует все
+ядра. Часть состояния живёт в памяти процесса - трекинг столов и время
+занятости по камерам, опорные кадры пропуска инференса, кэш результатов,
+видеопотоки. С WEB_CONCURRENCY > 1 gunicorn раздаёт кадры одной камеры
+разным воркерам: id столов и время занятости сбрасываются, пропуск
+инференса не срабатывает, видеопотоки не запускаются - это режим только
+для разовых анализов без camera_id. Для камер масштабирование - несколько
+экземпляров по одному воркеру за балансировщиком, привязывающим камеру к
+экземпляру (hash по заголовку X-Camera-Id). История, статистика, схемы
+столов, настройки и состояние опроса камер, задания отчётов общие для
+всех воркеров
+"""
+import os
+import runpy
+
+
+def cpu_count():
+    """Число доступных процессу ядер (с учётом ограничения affinity/cgroup)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def default_workers():
+    """Число воркеров: один процесс, если WEB_CONCURRENCY не задан (см. описание модуля)"""
+    return max(int(os.environ.get('WEB_CONCURRENCY', 1)), 1)
+
+
+def default_torch_threads(workers=None):
+    """Потоков intra-op на воркер: ядра делятся поровну, чтобы воркеры не конкурировали"""
+    workers = workers or default_workers()
+    return int(os.environ.get('TORCH_THREADS', max(cpu_count() // workers, 1)))
+
+
+def configure_worker(threads=None):
+    """Ограничение числа потоков torch/OpenCV в текущем процессе"""
+    import cv2
+    import torch
+
+    threads = threads or default_torch_threads()
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Можно задать только до первого параллельного вычисления
+        pass
+    cv2.setNumThreads(threads)
+    return threads
+
+
+def create_app(warmup=True, threads=None, background=None):
+    """
+    WSGI-фабрика: настройка потоков, загрузка и прогрев моделей в этом процессе.
+    С background (по умолчанию, WARMUP_BACKGROUND=0 - отключить) torch
+    импортируется и модели прогреваются в фоновом потоке, а воркер сразу
+    начинает отвечать (/health показывает готовность)
+    """
+    if background is None:
+        background = os.environ.get('WARMUP_BACKGROUND', '1') != '0'
+
+    import server
+
+    # Состояние видеопотоков - в памяти процесса: с несколькими воркерами они не запускаются
+    server.app.config['WORKER_PROCESSES'] = default_workers()
+    server.start_camera_polling()
+    if warmup and background:
+        server.start_warmup(prepare=lambda: configure_worker(threads))
+        return server.app
+
+    configure_worker(threads)
+    if warmup and not server.warmup_models():
+        print("Warning: Models failed to load. The server will attempt to load them on first request.")
+    return server.app
+
+
+def serve(bind=None, workers=None):
+    """Запуск пула воркеров gunicorn (pre-fork), каждый со своими моделями"""
+    bind = bind or os.environ.get('BIND', '0.0.0.0:5000')
+    workers = workers or default_workers()
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("gunicorn не установлен, запускается встроенный сервер в одном процессе")
+        host, port = bind.rsplit(':', 1)
+        create_app().run(host=host, port=int(port), threaded=True)
+        return
+
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in runpy.run_path(config_path).items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+            self.cfg.set('bind', bind)
+            self.cfg.set('workers', workers)
+
+        def load(self):
+            return create_app()
+
+    Application().run()
+
+
+if __name__ == '__main__':
+    serve()